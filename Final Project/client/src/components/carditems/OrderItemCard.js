@@ -109,13 +109,14 @@ function OrderItemCard({ parcel, onCancel, onUpdateDestination }) {
       setIsLoading(true);
       setError(null);
       try {
-        // First, update the recipient information
+        // First, update the recipient information. parcel_id moves only this order, other parcels sent to the
+        // same recipient keep their address
         const recipientResponse = await fetch(`${API_BASE_URL}/recipients/${parcel.recipient_id}`, {
           method: 'PATCH',
           headers: {
             'Content-Type': 'application/json',
           },
-          body: JSON.stringify(updatedRecipient),
+          body: JSON.stringify({ ...updatedRecipient, parcel_id: parcel.id }),
           credentials: 'include',
         });
 
@@ -0,0 +1,215 @@
+# /server/addressbook.py
+
+# Per-user recipient address book.
+# A recipient is identified by a fingerprint: the sha256 of its normalized email, phone number, street, zip code
+# and country. (user_id, fingerprint) is unique, so creating a recipient that's already in the user's address
+# book updates and returns that row instead of adding another one (upsert_recipient). Parcels show their
+# recipient's row, so once a parcel points at a recipient the upsert only fills in fields it's missing: posting
+# the same address under another name doesn't rename the recipient of past parcels.
+# Editing a recipient (edit_recipient, PATCH /recipients/<id>) follows the same rule: a row other parcels point
+# at is copied on write, the new values are upserted and only the order being edited is moved to the result.
+#
+# Recipients written before fingerprints existed have neither an owner nor a fingerprint. They are merged by
+#   flask --app app recipients-compact [--batch-size 1000]
+# which walks them in id order, gives each the owner of its first parcel and its fingerprint, keeps the oldest
+# row of every duplicate group and repoints the parcels of the others at it before deleting them.
+# It commits per batch and can be stopped and run again at any time, new recipients never need it.
+
+import hashlib
+import re
+
+import click
+from sqlalchemy import event, select, update, delete
+from sqlalchemy.exc import IntegrityError
+
+from config import db
+from models import Recipient, Parcel
+from events import LOCATION_FIELDS
+
+FINGERPRINT_FIELDS = ('email', 'phone_number', 'street', 'zip_code', 'country')
+# Updated on an existing recipient when the same address is added again, only if empty once it has parcels
+UPSERT_FIELDS = ('first_name', 'last_name', 'city', 'state', 'latitude', 'longitude')
+EDITABLE_FIELDS = FINGERPRINT_FIELDS + UPSERT_FIELDS
+COMPACT_BATCH_SIZE = 1000
+
+_SPACES = re.compile(r'\s+')
+_STREET_PUNCTUATION = re.compile(r'[.,#]')
+_NOT_DIGITS = re.compile(r'\D')
+
+
+def _text(value):
+    return _SPACES.sub(' ', str(value or '')).strip().casefold()
+
+
+def normalized_address(values):
+    # "  12 Moi Ave.," / "+254 700-000 000" -> "12 moi ave" / "254700000000"
+    get = values.get
+    return (
+        _text(get('email')),
+        _NOT_DIGITS.sub('', str(get('phone_number') or '')),
+        _text(_STREET_PUNCTUATION.sub(' ', str(get('street') or ''))),
+        _text(get('zip_code')).replace(' ', '').replace('-', ''),
+        _text(get('country')),
+    )
+
+
+def recipient_fingerprint(values):
+    return hashlib.sha256('\x1f'.join(normalized_address(values)).encode()).hexdigest()
+
+
+def _fields(recipient):
+    return {field: getattr(recipient, field) for field in FINGERPRINT_FIELDS}
+
+
+@event.listens_for(Recipient, 'before_insert')
+def fingerprint_new_recipient(mapper, connection, target):
+    if target.fingerprint is None:
+        target.fingerprint = recipient_fingerprint(_fields(target))
+
+
+@event.listens_for(Recipient, 'before_update')
+def fingerprint_changed_recipient(mapper, connection, target):
+    # Rows the compaction job hasn't reached yet are left to it
+    if target.fingerprint is not None:
+        target.fingerprint = recipient_fingerprint(_fields(target))
+
+
+def _find(user_id, fingerprint):
+    stmt = select(Recipient).where(Recipient.user_id == user_id, Recipient.fingerprint == fingerprint)
+    return db.session.execute(stmt).scalar_one_or_none()
+
+
+def _refresh(recipient, values):
+    in_use = db.session.execute(select(Parcel.id).where(Parcel.recipient_id == recipient.id).limit(1)).first()
+    for field in UPSERT_FIELDS:
+        if values.get(field) is not None and (in_use is None or getattr(recipient, field) is None):
+            setattr(recipient, field, values[field])
+    db.session.commit()
+    return recipient, False
+
+
+def upsert_recipient(user_id, values):
+    # Returns (recipient, created)
+    fingerprint = recipient_fingerprint(values)
+    existing = _find(user_id, fingerprint)
+    if existing is not None:
+        return _refresh(existing, values)
+
+    recipient = Recipient(user_id=user_id, fingerprint=fingerprint, **values)
+    db.session.add(recipient)
+    try:
+        db.session.commit()
+        return recipient, True
+    except IntegrityError:
+        # Lost a race with the same address being added from another request (a double submit)
+        db.session.rollback()
+        existing = _find(user_id, fingerprint)
+        if existing is None:
+            raise
+        return _refresh(existing, values)
+
+
+def edit_recipient(recipient, values, owner_id, parcel=None):
+    # Returns (recipient, created), a copy goes into owner_id's address book. parcel is the order whose destination changes, if the caller named one: it
+    # doesn't count as a parcel sharing the row, is moved to the edited recipient and gets its address copied
+    values = {field: value for field, value in values.items() if field in EDITABLE_FIELDS}
+    others = select(Parcel.id).where(Parcel.recipient_id == recipient.id)
+    if parcel is not None:
+        others = others.where(Parcel.id != parcel.id)
+    edited, created = None, False
+    if db.session.execute(others.limit(1)).first() is None:
+        for field, value in values.items():
+            setattr(recipient, field, value)
+        try:
+            db.session.commit()
+            edited = recipient
+        except IntegrityError:
+            # The new address is already another recipient in the same address book, which the upsert finds
+            db.session.rollback()
+    if edited is None:
+        current = {field: getattr(recipient, field) for field in EDITABLE_FIELDS}
+        edited, created = upsert_recipient(owner_id, dict(current, **values))
+
+    if parcel is not None:
+        parcel.recipient_id = edited.id
+        for field in LOCATION_FIELDS:
+            setattr(parcel, field, getattr(edited, field))
+        db.session.commit()
+    return edited, created
+
+
+def _compact_batch(rows):
+    session = db.session
+    ids = [row.id for row in rows]
+    # Legacy rows have no owner, they belong to whoever sent their first parcel
+    owners = {}
+    stmt = select(Parcel.recipient_id, Parcel.user_id).where(Parcel.recipient_id.in_(ids)).order_by(Parcel.id.desc())
+    for recipient_id, user_id in session.execute(stmt):
+        owners[recipient_id] = user_id
+    keys = {row.id: (row.user_id if row.user_id is not None else owners.get(row.id), recipient_fingerprint(row._mapping))
+            for row in rows}
+
+    # Rows that already have a fingerprint are the keepers, the oldest one if there are several ownerless ones
+    keepers = {}
+    stmt = (select(Recipient.id, Recipient.user_id, Recipient.fingerprint)
+            .where(Recipient.fingerprint.in_(list({fingerprint for _, fingerprint in keys.values()})))
+            .order_by(Recipient.id.desc()))
+    for id, user_id, fingerprint in session.execute(stmt):
+        keepers[(user_id, fingerprint)] = id
+
+    fingerprinted, merged = [], {}
+    for row in rows:
+        key = keys[row.id]
+        if key in keepers:
+            merged.setdefault(keepers[key], []).append(row.id)
+        else:
+            keepers[key] = row.id
+            fingerprinted.append({'id': row.id, 'user_id': key[0], 'fingerprint': key[1]})
+
+    if fingerprinted:
+        session.execute(update(Recipient), fingerprinted)
+    for keeper, duplicates in merged.items():
+        session.execute(update(Parcel).where(Parcel.recipient_id.in_(duplicates)).values(recipient_id=keeper),
+                        execution_options={'synchronize_session': False})
+    duplicates = [id for group in merged.values() for id in group]
+    if duplicates:
+        session.execute(delete(Recipient).where(Recipient.id.in_(duplicates)),
+                        execution_options={'synchronize_session': False})
+    session.commit()
+    return len(fingerprinted), len(duplicates)
+
+
+def compact_recipients(batch_size=COMPACT_BATCH_SIZE, echo=print):
+    columns = (Recipient.id, Recipient.user_id) + tuple(getattr(Recipient, field) for field in FINGERPRINT_FIELDS)
+    kept = merged = 0
+    after_id = 0
+    retried = False
+    while True:
+        stmt = (select(*columns).where(Recipient.fingerprint.is_(None), Recipient.id > after_id)
+                .order_by(Recipient.id).limit(batch_size))
+        rows = db.session.execute(stmt).all()
+        if not rows:
+            break
+        try:
+            batch_kept, batch_merged = _compact_batch(rows)
+        except IntegrityError:
+            # Someone added the same address to the same address book meanwhile, the retry merges into theirs
+            db.session.rollback()
+            if retried:
+                raise
+            retried = True
+            continue
+        retried = False
+        kept += batch_kept
+        merged += batch_merged
+        after_id = rows[-1].id
+        echo(f"Up to recipient {after_id}: {kept} kept, {merged} duplicates merged")
+    return kept, merged
+
+
+def init_addressbook(app):
+    @app.cli.command('recipients-compact')
+    @click.option('--batch-size', default=COMPACT_BATCH_SIZE, help='Recipients per batch and commit')
+    def recipients_compact(batch_size):
+        kept, merged = compact_recipients(batch_size, echo=click.echo)
+        click.echo(f"Compacted recipients: {kept} kept, {merged} duplicates merged")
@@ -2,12 +2,15 @@
 # /server/app.py
 
 # Remote library imports
-from flask import request, make_response, jsonify, session, send_from_directory
+from flask import request, make_response, jsonify, session, Response, stream_with_context
 from flask_restful import Api, Resource
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_migrate import Migrate
-from flask_mail import Mail, Message
+from flask_mail import Mail
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+from sqlalchemy.orm import selectinload
 import functools
+import time
 from dotenv import load_dotenv
 import os
 
@@ -16,6 +19,26 @@ load_dotenv()
 
 from config import app, db, api
 from models import User, Role, Recipient, Parcel, BillingAddress
+from pagination import paginated_response
+from listing import QueryArgsError, MAX_FILTER_VALUES, parse_ids
+from loading import endpoint_profile, init_query_budget
+from instrumentation import init_instrumentation
+from serializers import json_response, init_json
+from ingest import ingest_parcels, iter_request_rows, BulkPayloadError
+from outbox import enqueue_email, init_outbox
+from tracking import lookup_tracking, invalidate_tracking
+from stats import dashboard_summary, init_stats
+from seed import init_seed
+from addressbook import upsert_recipient, edit_recipient, init_addressbook
+from passwords import init_passwords, hash_password, verify_password
+from events import (head_cursor, fetch_changes, wait_for_changes, sse_stream, feed_waiters, MAX_LONG_POLL_WAIT,
+                    FEED_RETRY_AFTER, LOCATION_FIELDS)
+from pricing import quote, quote_batch, QuoteError
+from spatial import find_nearby
+from dispatch import route_options, plan_day, init_dispatch, RoutePlanError
+from policy import init_route_policies
+from static_assets import init_static, serve_spa
+from principal import current_principal, remember_principal, invalidate_principal, clear_principals
 
 migrate = Migrate(app, db)
 
@@ -24,49 +47,41 @@ mail_port = os.getenv('mail_port')
 mail_username = os.getenv('mail_username')
 mail_password = os.getenv('mail_password')
 mail_defaul_sender = os.getenv('mail_defaul_sender')
+mail_use_tls = os.getenv('mail_use_tls', 'true').lower() == 'true'
 
 # Configuring mail
 # app.config['DEBUG'] = True
 # app.config['TESTING'] = False # This will be true while testing 
 app.config['MAIL_SERVER'] = f'{mail_server}'
 app.config['MAIL_PORT'] = f'{mail_port}' # May be another value based on the server
-app.config['MAIL_USE_TLS'] = True # Test first to see whether true or false works
+app.config['MAIL_USE_TLS'] = mail_use_tls # Turn off with mail_use_tls=false for a local debug SMTP server
 app.config['MAIL_USE_SSL'] = False # Test first to see whether true or false works
 # app.config['MAIL_DEBUG'] = True # same value as the debug
-app.config['MAIL_USERNAME'] = f'{mail_username}'
-app.config['MAIL_PASSWORD'] = f'{mail_password}' # will move this to a .env file for safety
-app.config['MAIL_DEFAULT_SENDER'] = f'{mail_defaul_sender}'
+app.config['MAIL_USERNAME'] = mail_username # Left unset (not 'None') so Flask-Mail skips SMTP AUTH without credentials
+app.config['MAIL_PASSWORD'] = mail_password # will move this to a .env file for safety
+app.config['MAIL_DEFAULT_SENDER'] = mail_defaul_sender
 # app.config['MAIL_MAX_EMAILS'] = None
 # app.config['MAIL_SUPPRESS_SEND'] = False # Same value as the testing value so that it doesn't have to send emails every time
 # app.config['MAIL_ASCII_ATTACHMENTS'] = False # This will convert the characters that look like normal English
 
 # Initialising Flask-Mail
 mail = Mail(app)
+init_outbox(app)
+init_stats(app)
+init_seed(app)
+init_addressbook(app)
+init_passwords(app)
+init_dispatch(app)
 
-def load_user():
-    user_id = session.get('user_id')
-    if user_id:
-        return User.query.get(int(user_id))
-    return None
+# Registered before the auth gate so its time and queries are measured too
+init_instrumentation(app)
+init_json(app, api)
 
-@app.before_request
-def check_if_logged_in():
-    # List of static file serving paths or patterns
-    static_paths = ['/static', '/favicon.ico', '/']
-    
-    # Check if the request path starts with any of the static paths
-    if any(request.path.startswith(path) for path in static_paths):
-        return
-    
-    whitelist = ['index', 'signup', 'login', 'check_session', 'logout', 'serve_static_files']
-    if request.endpoint is None:
-        return make_response(jsonify({"message": "Invalid endpoint"}), 404)
-    if request.endpoint not in whitelist and not request.endpoint.startswith('admin'):
-        user = load_user()
-        if not user:
-            return make_response(jsonify({"message": "Unauthorized access"}), 401)
-        if request.endpoint.startswith('admin') and not any(role.name == 'admin' for role in user.roles):
-            return make_response(jsonify({"message": "Admin access required"}), 403)
+# React build, read once here instead of on every request
+static_manifest = init_static(app)
+
+# Registered before the auth gate (init_route_policies at the bottom) so its queries count towards the request's budget
+init_query_budget(app)
 
 
 @app.route('/')
@@ -76,15 +91,16 @@ def home():
 @app.route('/', defaults={'path': ''})
 @app.route('/<path:path>')
 def serve(path):
-    if path != "":
-        full_path = os.path.join(app.static_folder, path)
-        if os.path.exists(full_path):
-            print(f"Serving file from: {full_path}")  # Debug log
-            return send_from_directory(app.static_folder, path)
-        else:
-            print(f"File not found: {full_path}")  # Debug log
-    return send_from_directory(app.static_folder, 'index.html')
+    return serve_spa(static_manifest, path)
+
+
 
+def conflict_response(error):
+    # Uniqueness is left to the unique indexes, a violation on commit becomes a 409
+    db.session.rollback()
+    if 'email' in str(error.orig).lower():
+        return make_response(jsonify({"message": "Email is already in use"}), 409)
+    return make_response(jsonify({"message": "Conflicts with an existing record"}), 409)
 
 
 # User resource
@@ -94,21 +110,22 @@ class Signup(Resource):
         if not all(k in data for k in ('first_name', 'last_name', 'email', 'password')):
             return {"message": "Missing required fields"}, 400
 
-        existing_user = User.query.filter_by(email=data['email']).first()
-        if existing_user:
-            return {"message": "Email is already in use"}, 400
-
-        hashed_password = generate_password_hash(data['password'])
-        new_user = User.create_with_default_role(
-            first_name=data['first_name'],
-            last_name=data['last_name'],
-            email=data['email'],
-            password=hashed_password
-        )
-        db.session.add(new_user)
-        db.session.commit()
+        hashed_password = hash_password(data['password'])
+        try:
+            new_user = User.create_with_default_role(
+                first_name=data['first_name'],
+                last_name=data['last_name'],
+                email=data['email'],
+                password=hashed_password
+            )
+        except ValueError as e:
+            db.session.rollback()
+            return {"message": str(e)}, 400
+        except IntegrityError as e:
+            return conflict_response(e)
 
         session['user_id'] = new_user.id
+        remember_principal(new_user)
 
         return {"message": "User created successfully", "user": new_user.to_dict()}, 201
 
@@ -117,21 +134,18 @@ api.add_resource(Signup, '/signup', endpoint='signup')
 class Login(Resource):
     def post(self):
         data = request.get_json()
-        user = User.query.filter_by(email=data['email']).first()
-        if user and check_password_hash(user.password, data['password']):
+        user = User.query.options(selectinload(User.roles)).filter_by(email=data['email']).first()
+        matches, new_hash = verify_password(user.password, data['password']) if user else (False, None)
+        if matches:
+            if new_hash: # Made with older PASSWORD_HASH_METHOD settings
+                user.password = new_hash
+                db.session.commit()
             session['user_id'] = user.id
-            roles = [role.name for role in user.roles]
+            # Cache the principal now so the requests that follow don't have to load it
+            principal = remember_principal(user)
             return {
                 "message": "Login successful",
-                "user": {
-                    "id": user.id,
-                    "email": user.email,
-                    "first_name": user.first_name,
-                    "last_name": user.last_name,
-                    "roles": roles,
-                    "isAdmin": 'admin' in roles,
-                    "isUser": 'user' in roles
-                }
+                "user": principal.to_dict()
             }, 200
         return {"message": "Invalid credentials"}, 401
 
@@ -147,54 +161,51 @@ api.add_resource(Logout, '/logout', endpoint='logout')
 
 class CheckSession(Resource):
     def get(self):
-        user_id = session.get('user_id')
-        if user_id:
-            user = User.query.get(int(user_id))
-            if user:
-                roles = [role.name for role in user.roles]
-                return {
-                    "message": "Session active",
-                    "user": {
-                        "id": user.id,
-                        "email": user.email,
-                        "first_name": user.first_name,
-                        "last_name": user.last_name,
-                        "roles": roles,
-                        "isAdmin": 'admin' in roles,
-                        "isUser": 'user' in roles
-                    }
-                }, 200
+        principal = current_principal()
+        if principal:
+            return {
+                "message": "Session active",
+                "user": principal.to_dict()
+            }, 200
         return {"message": "No active session"}, 204
 
 api.add_resource(CheckSession, '/check_session', endpoint='check_session')
 
 class Users(Resource):
     def get(self):
-        response_dict_list = [user.to_dict() for user in User.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Keyset paginated (?after_id=&limit=), or streamed as NDJSON with ?format=ndjson
+        # Filters, ?sort=, ?fields= and ?include= as allowed by the endpoint's CollectionSpec (listing.py)
+        profile = endpoint_profile()
+        return paginated_response(User, profile.serialize, profile.select(), profile.collection)
 
     def post(self):
         data = request.get_json()
-        hashed_password = generate_password_hash(data['password'])
-        new_user = User(
-            first_name=data['first_name'],
-            last_name=data['last_name'],
-            email=data['email'],
-            password=hashed_password
-        )
-        db.session.add(new_user)
-        db.session.commit()
-        return make_response(jsonify(new_user.to_dict()), 201)
+        hashed_password = hash_password(data['password'])
+        try:
+            new_user = User(
+                first_name=data['first_name'],
+                last_name=data['last_name'],
+                email=data['email'],
+                password=hashed_password
+            )
+            db.session.add(new_user)
+            db.session.commit()
+        except ValueError as e:
+            db.session.rollback()
+            return make_response(jsonify({"message": str(e)}), 400)
+        except IntegrityError as e:
+            return conflict_response(e)
+        return json_response(endpoint_profile().serialize(new_user), 201)
 
 api.add_resource(Users, '/users')
 
 class UsersByID(Resource):
     def get(self, id):
-        user_specific = User.query.filter_by(id=id).first()
+        user_specific = endpoint_profile().query().filter_by(id=id).first()
         if user_specific:
             try:
-                user_data = user_specific.to_dict()
-                return user_data, 200
+                user_data = endpoint_profile().serialize(user_specific)
+                return json_response(user_data, 200)
             except Exception as e:
                 app.logger.error(f"Error serializing user data: {str(e)}")
                 return {"message": "Error serializing user data", "error": str(e)}, 500
@@ -202,15 +213,22 @@ class UsersByID(Resource):
 
 
     def patch(self, id):
-        user_specific = User.query.filter_by(id=id).first()
+        user_specific = endpoint_profile().query().filter_by(id=id).first()
         if user_specific:
             data = request.get_json()
-            for key, value in data.items():
-                if key == 'password':
-                    value = generate_password_hash(value)
-                setattr(user_specific, key, value)
-            db.session.commit()
-            return make_response(jsonify(user_specific.to_dict()), 200)
+            try:
+                for key, value in data.items():
+                    if key == 'password':
+                        value = hash_password(value)
+                    setattr(user_specific, key, value)
+                db.session.commit()
+            except ValueError as e:
+                db.session.rollback()
+                return make_response(jsonify({"message": str(e)}), 400)
+            except IntegrityError as e:
+                return conflict_response(e)
+            invalidate_principal(user_specific.id)
+            return json_response(endpoint_profile().serialize(user_specific), 200)
         return make_response(jsonify({"message": "User not found"}), 404)
 
     def delete(self, id):
@@ -218,6 +236,7 @@ class UsersByID(Resource):
         if user_specific:
             db.session.delete(user_specific)
             db.session.commit()
+            invalidate_principal(id)
             return make_response({}, 204)
         return make_response(jsonify({"message": "User not found"}), 404)
 
@@ -226,33 +245,37 @@ api.add_resource(UsersByID, '/users/<int:id>')
 # Role resource
 class Roles(Resource):
     def get(self):
-        response_dict_list = [role.to_dict() for role in Role.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Keyset paginated (?after_id=&limit=), or streamed as NDJSON with ?format=ndjson
+        # Filters, ?sort=, ?fields= and ?include= as allowed by the endpoint's CollectionSpec (listing.py)
+        profile = endpoint_profile()
+        return paginated_response(Role, profile.serialize, profile.select(), profile.collection)
 
     def post(self):
         data = request.get_json()
         new_role = Role(name=data['name'])
         db.session.add(new_role)
         db.session.commit()
-        return make_response(jsonify(new_role.to_dict()), 201)
+        clear_principals() # A new "admin" role changes the cached admin role ids
+        return json_response(endpoint_profile().serialize(new_role), 201)
 
 api.add_resource(Roles, '/roles')
 
 class RolesByID(Resource):
     def get(self, id):
-        role_specific = Role.query.filter_by(id=id).first()
+        role_specific = endpoint_profile().query().filter_by(id=id).first()
         if role_specific:
-            return make_response(jsonify(role_specific.to_dict()), 200)
+            return json_response(endpoint_profile().serialize(role_specific), 200)
         return make_response(jsonify({"message": "Role not found"}), 404)
 
     def patch(self, id):
-        role_specific = Role.query.filter_by(id=id).first()
+        role_specific = endpoint_profile().query().filter_by(id=id).first()
         if role_specific:
             data = request.get_json()
             for key, value in data.items():
                 setattr(role_specific, key, value)
             db.session.commit()
-            return make_response(jsonify(role_specific.to_dict()), 200)
+            clear_principals()
+            return json_response(endpoint_profile().serialize(role_specific), 200)
         return make_response(jsonify({"message": "Role not found"}), 404)
 
     def delete(self, id):
@@ -260,20 +283,39 @@ class RolesByID(Resource):
         if role_specific:
             db.session.delete(role_specific)
             db.session.commit()
+            clear_principals()
             return make_response({}, 204)
         return make_response(jsonify({"message": "Role not found"}), 404)
 
 api.add_resource(RolesByID, '/roles/<int:id>')
 
 # Recipient resource
+def recipients_by_ids(ids):
+    # One IN query for the whole batch, keyed by id. Ids that don't exist map to null
+    profile = endpoint_profile()
+    found = db.session.execute(profile.select().where(Recipient.id.in_(ids))).scalars()
+    recipients = {recipient.id: profile.serialize(recipient) for recipient in found}
+    return json_response({str(id): recipients.get(id) for id in ids}, 200)
+
+
 class Recipients(Resource):
     def get(self):
-        response_dict_list = [recipient.to_dict() for recipient in Recipient.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # ?ids=1,2,3 resolves a batch of recipients, see RecipientsBatch for longer lists.
+        # Otherwise keyset paginated (?after_id=&limit=), or streamed as NDJSON with ?format=ndjson
+        # Filters, ?sort=, ?fields= and ?include= as allowed by the endpoint's CollectionSpec (listing.py)
+        profile = endpoint_profile()
+        if 'ids' in request.args:
+            try:
+                ids = parse_ids(request.args['ids'], limit=MAX_FILTER_VALUES)
+            except QueryArgsError as e:
+                return make_response(jsonify({"message": str(e)}), 400)
+            return recipients_by_ids(ids)
+        return paginated_response(Recipient, profile.serialize, profile.select(), profile.collection)
 
     def post(self):
+        # Upsert into the caller's address book: an address they already have comes back with 200, not a new row
         data = request.get_json()
-        new_recipient = Recipient(
+        recipient, created = upsert_recipient(current_principal().id, dict(
             first_name=data['first_name'],
             last_name=data['last_name'],
             email=data['email'],
@@ -285,29 +327,54 @@ class Recipients(Resource):
             country=data['country'],
             latitude=data.get('latitude'),
             longitude=data.get('longitude')
-        )
-        db.session.add(new_recipient)
-        db.session.commit()
-        return make_response(jsonify(new_recipient.to_dict()), 201)
+        ))
+        return json_response(endpoint_profile().serialize(recipient), 201 if created else 200)
 
 api.add_resource(Recipients, '/recipients')
 
+class RecipientsBatch(Resource):
+    def post(self):
+        # {"ids": [1, 2, 3]}, same response as GET /recipients?ids= for lists too long for a URL
+        data = request.get_json(silent=True) or {}
+        try:
+            ids = parse_ids(data.get('ids'))
+        except QueryArgsError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        return recipients_by_ids(ids)
+
+api.add_resource(RecipientsBatch, '/recipients/batch')
+
 class RecipientsByID(Resource):
     def get(self, id):
-        recipient_specific = Recipient.query.filter_by(id=id).first()
+        recipient_specific = endpoint_profile().query().filter_by(id=id).first()
         if recipient_specific:
-            return make_response(jsonify(recipient_specific.to_dict()), 200)
+            return json_response(endpoint_profile().serialize(recipient_specific), 200)
         return make_response(jsonify({"message": "Recipient not found"}), 404)
 
     def patch(self, id):
-        recipient_specific = Recipient.query.filter_by(id=id).first()
-        if recipient_specific:
-            data = request.get_json()
-            for key, value in data.items():
-                setattr(recipient_specific, key, value)
-            db.session.commit()
-            return make_response(jsonify(recipient_specific.to_dict()), 200)
-        return make_response(jsonify({"message": "Recipient not found"}), 404)
+        # Only the owner or an admin. {"parcel_id": ...} changes that order's destination without touching the
+        # other parcels sent to this recipient (edit_recipient), the response is then the recipient it now has
+        current_user = current_principal()
+        recipient_specific = endpoint_profile().query().filter_by(id=id).first()
+        if recipient_specific is None:
+            return make_response(jsonify({"message": "Recipient not found"}), 404)
+        data = request.get_json(silent=True) or {}
+        parcel = None
+        if data.get('parcel_id') is not None:
+            if not isinstance(data['parcel_id'], int) or isinstance(data['parcel_id'], bool):
+                return make_response(jsonify({"message": "'parcel_id' must be an integer"}), 400)
+            parcel = db.session.get(Parcel, data['parcel_id'])
+            if (parcel is None or parcel.recipient_id != id
+                    or not (current_user.is_admin or parcel.user_id == current_user.id)):
+                return make_response(jsonify({"message": "Parcel not found"}), 404)
+        # Rows from before address books have no owner yet, whoever sent the parcel being edited may change them
+        owner_id = recipient_specific.user_id if recipient_specific.user_id is not None else (parcel and parcel.user_id)
+        if not (current_user.is_admin or owner_id == current_user.id):
+            return make_response(jsonify({"message": "Recipient not found"}), 404)
+        recipient, created = edit_recipient(recipient_specific, data, owner_id or current_user.id, parcel)
+        if parcel is not None:
+            invalidate_tracking(parcel.tracking_number)
+        return json_response(endpoint_profile().serialize(recipient), 201 if created else 200)
 
     def delete(self, id):
         recipient_specific = Recipient.query.filter_by(id=id).first()
@@ -322,12 +389,14 @@ api.add_resource(RecipientsByID, '/recipients/<int:id>')
 # Parcel resource
 class Parcels(Resource):
     def get(self):
-        response_dict_list = [parcel.to_dict() for parcel in Parcel.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Keyset paginated (?after_id=&limit=), or streamed as NDJSON with ?format=ndjson
+        # Filters, ?sort=, ?fields= and ?include= as allowed by the endpoint's CollectionSpec (listing.py)
+        profile = endpoint_profile()
+        return paginated_response(Parcel, profile.serialize, profile.select(), profile.collection)
 
     def post(self):
         data = request.get_json()
-        current_user = load_user()
+        current_user = current_principal()
         new_parcel = Parcel(
             user_id=current_user.id,  # Automatically set the user_id from the current session user
             recipient_id=data['recipient_id'],
@@ -338,27 +407,68 @@ class Parcels(Resource):
             cost=data.get('cost'),  # Make cost optional
             status=data['status']
         )
+        # The parcel is delivered to its recipient's address, copied so the parcel has coordinates to be found by
+        recipient = db.session.get(Recipient, new_parcel.recipient_id)
+        if recipient is not None:
+            for field in LOCATION_FIELDS:
+                setattr(new_parcel, field, getattr(recipient, field))
         db.session.add(new_parcel)
         db.session.commit()
-        return make_response(jsonify(new_parcel.to_dict()), 201)
+        return json_response(endpoint_profile().serialize(new_parcel), 201)
 
 api.add_resource(Parcels, '/parcels')
 
+class ParcelsNearby(Resource):
+    def get(self):
+        # Dispatch: open parcels within ?radius= km of ?lat=&lng=, or the ?k= nearest, nearest first (spatial.py).
+        # ?scope=all also searches delivered parcels
+        profile = endpoint_profile()
+        try:
+            found = find_nearby(request.args)
+        except QueryArgsError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        if not found:
+            return json_response([], 200)
+        parcels = {parcel.id: parcel for parcel in db.session.execute(
+            profile.select().where(Parcel.id.in_([id for _, id in found]))).scalars()}
+        return json_response([dict(profile.serialize(parcels[id]), distance_km=round(distance, 3))
+                              for distance, id in found if id in parcels], 200)
+
+api.add_resource(ParcelsNearby, '/parcels/nearby')
+
+class ParcelsBulk(Resource):
+    def post(self):
+        # JSON array or NDJSON (Content-Type: application/x-ndjson) of parcels, inserted in chunks
+        current_user = current_principal()
+        try:
+            results = ingest_parcels(iter_request_rows(), current_user.id)
+        except BulkPayloadError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        created = sum(1 for result in results if 'id' in result)
+        return json_response({"created": created, "failed": len(results) - created, "results": results}, 200)
+
+api.add_resource(ParcelsBulk, '/parcels/bulk')
+
 class ParcelsByID(Resource):
     def get(self, id):
-        parcel_specific = Parcel.query.filter_by(id=id).first()
+        parcel_specific = endpoint_profile().query().filter_by(id=id).first()
         if parcel_specific:
-            return make_response(jsonify(parcel_specific.to_dict()), 200)
+            return json_response(endpoint_profile().serialize(parcel_specific), 200)
         return make_response(jsonify({"message": "Parcel not found"}), 404)
 
     def patch(self, id):
-        parcel_specific = Parcel.query.filter_by(id=id).first()
+        parcel_specific = endpoint_profile().query().filter_by(id=id).first()
         if parcel_specific:
             data = request.get_json()
+            notify = data.pop('notify', False) # Opt in, the admin client still sends its own emails through /send-email
+            old_status = parcel_specific.status
             for key, value in data.items():
                 setattr(parcel_specific, key, value)
+            if notify and parcel_specific.status != old_status:
+                enqueue_status_emails(parcel_specific)
             db.session.commit()
-            return make_response(jsonify(parcel_specific.to_dict()), 200)
+            invalidate_tracking(parcel_specific.tracking_number)
+            return json_response(endpoint_profile().serialize(parcel_specific), 200)
         return make_response(jsonify({"message": "Parcel not found"}), 404)
 
     def delete(self, id):
@@ -366,20 +476,64 @@ class ParcelsByID(Resource):
         if parcel_specific:
             db.session.delete(parcel_specific)
             db.session.commit()
+            invalidate_tracking(parcel_specific.tracking_number)
             return make_response({}, 204)
         return make_response(jsonify({"message": "Parcel not found"}), 404)
 
 api.add_resource(ParcelsByID, '/parcels/<int:id>')
 
+class TrackParcel(Resource):
+    def get(self, tracking_number):
+        # Public, polled by customers. Served from cache and answered with a 304 when nothing changed
+        entry = lookup_tracking(tracking_number)
+        if entry is None:
+            return make_response(jsonify({"message": "Parcel not found"}), 404)
+        payload, etag = entry
+        if request.if_none_match.contains_weak(etag):
+            return make_response('', 304, {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+        return json_response(payload, 200, {'ETag': f'"{etag}"', 'Cache-Control': 'no-cache'})
+
+api.add_resource(TrackParcel, '/track/<string:tracking_number>', endpoint='track')
+
+class Quotes(Resource):
+    def post(self):
+        # One quote object, or a JSON array of them priced in a single batch
+        current_user = current_principal()
+        data = request.get_json(silent=True)
+        if isinstance(data, list):
+            return json_response(quote_batch(data, current_user.id), 200)
+        try:
+            return json_response(quote(data or {}, current_user.id), 200)
+        except QuoteError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+
+api.add_resource(Quotes, '/quotes')
+
+def enqueue_status_emails(parcel):
+    # Same wording as the admin client's notifications, committed together with the status change
+    user, recipient = parcel.user, parcel.recipient
+    if user:
+        enqueue_email(user.email, 'Parcel Status Update',
+                      f"Dear {user.first_name} {user.last_name}, the status of your parcel to "
+                      f"{recipient.first_name if recipient else ''} {recipient.last_name if recipient else ''} is now {parcel.status}. "
+                      f"Tracking Number: {parcel.tracking_number} Got a Package? Let's SendIT!", commit=False)
+    if recipient:
+        enqueue_email(recipient.email, 'Parcel Status Update',
+                      f"Dear {recipient.first_name} {recipient.last_name}, the status of your parcel from "
+                      f"{user.first_name if user else ''} {user.last_name if user else ''} is now {parcel.status}. "
+                      f"Tracking Number: {parcel.tracking_number} Got a Package? Let's SendIT!", commit=False)
+
 # BillingAddress resource
 class BillingAddresses(Resource):
     def get(self):
-        response_dict_list = [billing_address.to_dict() for billing_address in BillingAddress.query.all()]
-        return make_response(jsonify(response_dict_list), 200)
+        # Keyset paginated (?after_id=&limit=), or streamed as NDJSON with ?format=ndjson
+        # Filters, ?sort=, ?fields= and ?include= as allowed by the endpoint's CollectionSpec (listing.py)
+        profile = endpoint_profile()
+        return paginated_response(BillingAddress, profile.serialize, profile.select(), profile.collection)
 
     def post(self):
         data = request.get_json()
-        current_user = load_user()
+        current_user = current_principal()
         if not current_user:
             return make_response(jsonify({"message": "Unauthorized"}), 401)
 
@@ -395,25 +549,25 @@ class BillingAddresses(Resource):
         )
         db.session.add(new_billing_address)
         db.session.commit()
-        return make_response(jsonify(new_billing_address.to_dict()), 201)
+        return json_response(endpoint_profile().serialize(new_billing_address), 201)
 
 api.add_resource(BillingAddresses, '/billing_addresses')
 
 class BillingAddressesByID(Resource):
     def get(self, id):
-        billing_address_specific = BillingAddress.query.filter_by(id=id).first()
+        billing_address_specific = endpoint_profile().query().filter_by(id=id).first()
         if billing_address_specific:
-            return make_response(jsonify(billing_address_specific.to_dict()), 200)
+            return json_response(endpoint_profile().serialize(billing_address_specific), 200)
         return make_response(jsonify({"message": "BillingAddress not found"}), 404)
 
     def patch(self, id):
-        billing_address_specific = BillingAddress.query.filter_by(id=id).first()
+        billing_address_specific = endpoint_profile().query().filter_by(id=id).first()
         if billing_address_specific:
             data = request.get_json()
             for key, value in data.items():
                 setattr(billing_address_specific, key, value)
             db.session.commit()
-            return make_response(jsonify(billing_address_specific.to_dict()), 200)
+            return json_response(endpoint_profile().serialize(billing_address_specific), 200)
         return make_response(jsonify({"message": "BillingAddress not found"}), 404)
 
     def delete(self, id):
@@ -440,20 +594,9 @@ class SendEmail(Resource):
         subject = data['subject']
         body = data['body']
         
-        try:
-            # Create a new email message
-            # Ensured recipients is a list, even if a single email address is provided.
-            msg = Message(subject=subject,
-                          recipients=[recipients] if isinstance(recipients, str) else recipients,
-                          body=body,
-                          sender=app.config['MAIL_USERNAME'])
-            
-            # Send the email
-            mail.send(msg)
-            return {"message": "Email sent successfully"}, 200
-        
-        except Exception as e:
-            return {"message": f"Error sending email: {str(e)}"}, 500
+        # Queued in the outbox and sent by the outbox workers, the request doesn't wait on SMTP
+        message = enqueue_email(recipients, subject, body)
+        return {"message": "Email queued", "id": message.id}, 202
 
 # Add the SendEmail resource to the API
 api.add_resource(SendEmail, '/send-email')
@@ -461,8 +604,8 @@ api.add_resource(SendEmail, '/send-email')
 def admin_required(f):
     @functools.wraps(f)
     def decorated_function(*args, **kwargs):
-        user = load_user()
-        if user and any(role.name == 'admin' for role in user.roles):
+        principal = current_principal()
+        if principal and principal.is_admin:
             return f(*args, **kwargs)
         return {"message": "Admin access required"}, 403
     return decorated_function
@@ -470,22 +613,144 @@ def admin_required(f):
 class AdminDashboard(Resource):
     @admin_required
     def get(self):
-        # I will see what admin-specific logic to add here
-        return {"message": "Welcome to the admin dashboard"}, 200
+        # Totals from the parcel_stats counters, ?days= of daily volumes and the ?top= destination countries
+        days = min(max(request.args.get('days', 30, type=int), 1), 366)
+        top = min(max(request.args.get('top', 10, type=int), 1), 100)
+        return json_response(dashboard_summary(days=days, top=top), 200)
 
 api.add_resource(AdminDashboard, '/admin/dashboard')
 
+class AdminRoutes(Resource):
+    @admin_required
+    def post(self):
+        # Vehicle routes for the parcels waiting for delivery, see dispatch.py for the body
+        try:
+            options = route_options(request.get_json(silent=True) or {}, stops_limit=app.config['ROUTE_STOPS_LIMIT'])
+            plan = plan_day(options, workers=app.config['ROUTE_WORKERS'], limit=app.config['ROUTE_MAX_PARCELS'])
+        except RoutePlanError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        return json_response(plan, 200)
+
+api.add_resource(AdminRoutes, '/admin/routes')
+
 class ParcelsByUserID(Resource):
     def get(self):
-        current_user = load_user()
+        current_user = current_principal()
         if not current_user:
             return make_response(jsonify({"message": "Unauthorized"}), 401)
         
-        parcels = Parcel.query.filter_by(user_id=current_user.id).all()
-        return jsonify([parcel.to_dict() for parcel in parcels])
+        profile = endpoint_profile()
+        # Takes the same ?status=&sort=&fields=&include= as /parcels (listing.py) but still returns every parcel.
+        # ?fields=id,status,tracking_number&include=recipient is two queries however many parcels there are
+        try:
+            listing = profile.collection.parse(request.args)
+        except QueryArgsError as e:
+            return make_response(jsonify({"message": str(e)}), 400)
+        if listing is None:
+            parcels = profile.query().filter_by(user_id=current_user.id).all()
+            return json_response([profile.serialize(parcel) for parcel in parcels])
+
+        stmt = listing.statement(profile.select().where(Parcel.user_id == current_user.id))
+        order = [column.desc() if descending else column for column, descending in listing.sort]
+        result = db.session.execute(stmt.order_by(*order, Parcel.id))
+        rows = result.all() if listing.projected else result.scalars().all()
+        listing.prepare(rows)
+        serialize = listing.serializer(profile.serialize)
+        return json_response([serialize(row) for row in rows])
 
 api.add_resource(ParcelsByUserID, '/user/parcels')
 
+class RecipientsByUserID(Resource):
+    def get(self):
+        # The current user's address book, paginated and filtered like /recipients
+        current_user = current_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+
+        profile = endpoint_profile()
+        stmt = profile.select().where(Recipient.user_id == current_user.id)
+        return paginated_response(Recipient, profile.serialize, stmt, profile.collection)
+
+api.add_resource(RecipientsByUserID, '/user/recipients')
+
+class ParcelChanges(Resource):
+    def get(self):
+        # ?since=<cursor> returns parcel events after the cursor, without since just the current cursor.
+        # ?wait=<seconds> turns it into a long poll that returns as soon as something changes
+        current_user = current_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+
+        since = request.args.get('since', type=int)
+        if since is None:
+            return json_response({"changes": [], "cursor": head_cursor(current_user.id)})
+        wait = min(max(request.args.get('wait', 0, type=float), 0), MAX_LONG_POLL_WAIT)
+        headers = None
+        if not wait:
+            changes = fetch_changes(current_user.id, since)
+        elif feed_waiters.acquire(app.config['FEED_MAX_WAITERS']):
+            try:
+                changes = wait_for_changes(current_user.id, since, timeout=wait)
+            finally:
+                feed_waiters.release()
+        else:
+            # Too many requests already waiting in this worker, answer now and let the client come back later
+            changes = fetch_changes(current_user.id, since)
+            headers = {'Retry-After': str(FEED_RETRY_AFTER)}
+        return json_response({"changes": changes, "cursor": changes[-1]['id'] if changes else since}, 200, headers)
+
+api.add_resource(ParcelChanges, '/user/parcels/changes')
+
+class ParcelChangesStream(Resource):
+    def get(self):
+        # Server-Sent Events version of the change feed, resumes from Last-Event-ID on reconnect
+        current_user = current_principal()
+        if not current_user:
+            return make_response(jsonify({"message": "Unauthorized"}), 401)
+
+        since = request.headers.get('Last-Event-ID', type=int)
+        if since is None:
+            since = request.args.get('since', type=int)
+        if since is None:
+            since = head_cursor(current_user.id)
+        if not feed_waiters.acquire(app.config['FEED_MAX_WAITERS']):
+            return make_response(jsonify({"message": "Too many open change streams, poll /user/parcels/changes"}),
+                                 503, {'Retry-After': str(FEED_RETRY_AFTER)})
+        stream = sse_stream(current_user.id, since, app.config['FEED_STREAM_DURATION'])
+        response = Response(stream_with_context(stream), mimetype='text/event-stream')
+        response.call_on_close(feed_waiters.release) # Also when the client goes away mid stream
+        response.headers['Cache-Control'] = 'no-cache'
+        response.headers['X-Accel-Buffering'] = 'no' # Stop proxies from buffering the stream
+        return response
+
+api.add_resource(ParcelChangesStream, '/user/parcels/changes/stream')
+
+class HealthDB(Resource):
+    def get(self):
+        # For load balancers and dashboards: one round trip plus this worker's pool counters
+        pool = db.engine.pool
+        stats = {
+            "pool": pool.__class__.__name__,
+            "size": pool.size() if hasattr(pool, 'size') else None,
+            "checked_in": pool.checkedin() if hasattr(pool, 'checkedin') else None,
+            "checked_out": pool.checkedout() if hasattr(pool, 'checkedout') else None,
+            "overflow": pool.overflow() if hasattr(pool, 'overflow') else None,
+            "max_overflow": getattr(pool, '_max_overflow', None),
+        }
+        started = time.perf_counter()
+        try:
+            db.session.execute(text('SELECT 1'))
+        except SQLAlchemyError as e:
+            db.session.rollback()
+            return make_response(jsonify({"status": "unavailable", "error": e.__class__.__name__, **stats}), 503)
+        stats["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        return make_response(jsonify({"status": "ok", **stats}), 200)
+
+api.add_resource(HealthDB, '/health/db', endpoint='health_db')
+
+# Auth gate, built from every endpoint registered above
+init_route_policies(app)
+
 if __name__ == '__main__':
     #app.run(port=5555, debug=True) # Commenting out so that it doesn't conflict with deployment server
     #app.run(host='0.0.0.0', port=int(os.getenv('PORT', 5555)), debug=False)
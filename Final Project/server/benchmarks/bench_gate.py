@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+# /server/benchmarks/bench_gate.py
+
+# Checks the route policy table against the app and measures what the auth gate costs per request.
+# First every authenticated/admin endpoint is called anonymously and must answer 401 (and admin endpoints 403
+# for a plain user), then the gate is timed on its own against the old startswith/whitelist scan:
+#   cd server && python benchmarks/bench_gate.py --requests 100000
+
+import argparse
+import os
+import sys
+import tempfile
+import timeit
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_gate.db'))
+
+from flask import g
+from flask_migrate import upgrade
+from sqlalchemy.orm import selectinload
+from werkzeug.security import generate_password_hash
+
+from config import app, db
+from models import User, Role
+from policy import PUBLIC, ADMIN, build_route_policies, route_policy
+from principal import remember_principal
+import app as application # Registers every resource and the gate
+
+
+def sample_url(rule):
+    values = {name: 1 if rule._converters[name].__class__.__name__ == 'IntegerConverter' else 'x'
+              for name in rule.arguments}
+    return app.url_map.bind('localhost').build(rule.endpoint, values)
+
+
+def create_schema():
+    with app.app_context():
+        upgrade(directory=os.path.join(SERVER_DIR, 'migrations'))
+        if not db.session.get(Role, 2):
+            db.session.add_all([Role(id=1, name='admin'), Role(id=2, name='user')])
+            user = User(first_name='Plain', last_name='User', email='plain@example.com',
+                        password=generate_password_hash('secret1'))
+            user.roles.append(db.session.get(Role, 2))
+            db.session.add(user)
+            db.session.commit()
+
+
+def check_policies():
+    policies = build_route_policies(app)
+    client = app.test_client()
+    failures = []
+    checked = 0
+    for rule in app.url_map.iter_rules():
+        policy = policies[rule.endpoint]
+        if policy == PUBLIC:
+            continue
+        url = sample_url(rule)
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            checked += 1
+            status = client.open(url, method=method).status_code
+            if status != 401:
+                failures.append(f"anonymous {method} {url} ({rule.endpoint}) answered {status}, expected 401")
+
+    with app.app_context():
+        user = db.session.execute(db.select(User).where(User.email == 'plain@example.com')).scalar_one()
+        remember_principal(user)
+        user_id = user.id
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    for rule in app.url_map.iter_rules():
+        if policies[rule.endpoint] != ADMIN:
+            continue
+        for method in sorted(rule.methods - {'HEAD', 'OPTIONS'}):
+            checked += 1
+            status = client.open(sample_url(rule), method=method).status_code
+            if status != 403:
+                failures.append(f"user {method} {rule.rule} ({rule.endpoint}) answered {status}, expected 403")
+    return checked, failures
+
+
+def old_gate(path, endpoint, principal):
+    # The previous check_if_logged_in, minus the '/' entry that let every request through
+    static_paths = ['/static', '/favicon.ico']
+    if any(path.startswith(p) for p in static_paths):
+        return None
+    whitelist = ['index', 'signup', 'login', 'check_session', 'logout', 'serve_static_files', 'track', 'health_db', 'metrics']
+    if endpoint is None:
+        return 404
+    if endpoint not in whitelist and not endpoint.startswith('admin'):
+        if not principal:
+            return 401
+        if endpoint.startswith('admin') and not any(role.name == 'admin' for role in principal.roles):
+            return 403
+    return None
+
+
+def new_gate(endpoint, principal):
+    policy = route_policy(endpoint)
+    if policy is None:
+        return 404
+    if policy == PUBLIC:
+        return None
+    if not principal:
+        return 401
+    if policy == ADMIN and not principal.is_admin:
+        return 403
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    create_schema()
+    checked, failures = check_policies()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{checked} protected endpoint/method pairs checked, {len(failures)} failures")
+
+    with app.app_context():
+        user = db.session.execute(
+            db.select(User).options(selectinload(User.roles)).where(User.email == 'plain@example.com')
+        ).scalar_one()
+        principal = remember_principal(user)
+        samples = [('/parcels/1', 'parcelsbyid'), ('/admin/dashboard', 'admindashboard'), ('/login', 'login'),
+                   ('/user/parcels', 'parcelsbyuserid')]
+        with app.test_request_context():
+            g.principal = principal
+            principal.is_admin # Warm the admin role id cache
+            cases = {
+                'old whitelist scan': lambda: [old_gate(path, endpoint, user) for path, endpoint in samples],
+                'policy table': lambda: [new_gate(endpoint, principal) for _, endpoint in samples],
+            }
+            calls = max(1, args.requests // len(samples))
+            for name, case in cases.items():
+                best = min(timeit.repeat(case, number=calls, repeat=args.repeat))
+                print(f"{name:<20} {best / (calls * len(samples)) * 1e9:8.0f} ns/request")
+
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
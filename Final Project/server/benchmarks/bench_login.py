@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# /server/benchmarks/bench_login.py
+
+# Login throughput at different PASSWORD_HASH_METHOD costs, hashing inline versus in the thread and process pools.
+# Client threads log in as fast as they can while a probe thread keeps calling GET /health/db, whose latency
+# shows what a login storm does to everything else in the same worker:
+#   cd server && python benchmarks/bench_login.py --clients 8 --seconds 5
+# Also checks that a hash made with outdated settings is replaced on the first login.
+
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_login.db'))
+
+from flask_migrate import upgrade
+from sqlalchemy import update
+from werkzeug.security import generate_password_hash
+
+from config import app, db
+from models import User
+from passwords import HashingPool, normalized_method
+from seed import seed_database
+import app as application # Registers every resource and the gate
+
+PASSWORD = 'password'
+METHODS = ['pbkdf2:sha256:100000', 'pbkdf2:sha256:600000', 'scrypt:16384:8:1', 'scrypt:32768:8:1']
+
+
+def set_stored_hashes(method):
+    with app.app_context():
+        db.session.execute(update(User).values(password=generate_password_hash(PASSWORD, method=method)))
+        db.session.commit()
+
+
+def configure(method, workers, kind='thread'):
+    app.config['PASSWORD_HASH_METHOD'] = method
+    pool = app.extensions.pop('password_pool', None)
+    if pool is not None:
+        pool.shutdown()
+    if workers:
+        pool = HashingPool(workers, workers * 4, app.config['PASSWORD_HASH_TIMEOUT'], kind)
+        app.extensions['password_pool'] = pool
+        with app.app_context():
+            pool.run(normalized_method, method) # Starts the pool outside the measurement
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] * 1000 if values else float('nan')
+
+
+def storm(emails, clients, seconds):
+    deadline = time.perf_counter() + seconds
+    logins, probes, statuses = [], [], {}
+    lock = threading.Lock()
+
+    def login(number):
+        client = app.test_client()
+        email = emails[number % len(emails)]
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            status = client.post('/login', json={'email': email, 'password': PASSWORD}).status_code
+            elapsed = time.perf_counter() - started
+            with lock:
+                statuses[status] = statuses.get(status, 0) + 1
+                if status == 200:
+                    logins.append(elapsed)
+            if status == 503:
+                time.sleep(0.05) # Backs off like a client honouring Retry-After would, without the full second
+
+    def probe():
+        client = app.test_client()
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            client.get('/health/db')
+            probes.append(time.perf_counter() - started)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=login, args=(number,)) for number in range(clients)]
+    threads.append(threading.Thread(target=probe))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return logins, probes, statuses
+
+
+def check_rehash(email):
+    set_stored_hashes('pbkdf2:sha256:1000')
+    configure('scrypt:16384:8:1', 0)
+    client = app.test_client()
+    assert client.post('/login', json={'email': email, 'password': PASSWORD}).status_code == 200
+    with app.app_context():
+        stored = db.session.execute(db.select(User.password).where(User.email == email)).scalar_one()
+    assert stored.startswith('scrypt:16384:8:1$'), f"Outdated hash wasn't replaced on login: {stored[:30]}"
+    assert client.post('/login', json={'email': email, 'password': PASSWORD}).status_code == 200
+    assert client.post('/login', json={'email': email, 'password': 'wrong'}).status_code == 401
+    print("outdated hash replaced on login: ok")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--seconds', type=float, default=5)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2, help='Pool threads/processes')
+    parser.add_argument('--methods', nargs='+', default=METHODS)
+    args = parser.parse_args()
+
+    with app.app_context():
+        upgrade(directory=os.path.join(SERVER_DIR, 'migrations'))
+        configure(app.config['PASSWORD_HASH_METHOD'], 0)
+        seed_database(users=args.clients, recipients=1, parcels=0, echo=lambda message: None)
+        emails = list(db.session.execute(db.select(User.email)).scalars())
+
+    check_rehash(emails[0])
+
+    print(f"{args.clients} clients, {args.seconds}s each, pools of {args.workers}")
+    print(f"{'method':<22} {'hashing':<8} {'logins/s':>9} {'login p50':>10} {'login p95':>10} "
+          f"{'probe p50':>10} {'probe p99':>10} {'503s':>5}")
+    for method in args.methods:
+        set_stored_hashes(method)
+        for kind, workers in (('inline', 0), ('thread', args.workers), ('process', args.workers)):
+            configure(method, workers, kind)
+            logins, probes, statuses = storm(emails, args.clients, args.seconds)
+            print(f"{method:<22} {kind:<8} {len(logins) / args.seconds:>9.1f} "
+                  f"{percentile(logins, 0.5):>8.1f}ms {percentile(logins, 0.95):>8.1f}ms "
+                  f"{percentile(probes, 0.5):>8.1f}ms {percentile(probes, 0.99):>8.1f}ms {statuses.get(503, 0):>5}")
+    configure(app.config['PASSWORD_HASH_METHOD'], 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+# /server/benchmarks/bench_nearby.py
+
+# Nearby parcel searches on the KD-tree (spatial.py) versus measuring every open parcel, at growing index
+# sizes. Points are generated in memory, so no database is needed:
+#   cd server && python benchmarks/bench_nearby.py --sizes 10000 100000 500000
+# The tree's query time should barely move as the index grows while the scan grows linearly.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from geo import haversine_km, unit_vector, chord_for_km
+from spatial import KDTree
+
+# Rough depot areas the points cluster around, like the seeded data does
+CENTRES = [(-1.2921, 36.8219), (-4.0435, 39.6682), (0.3476, 32.5825), (-6.7924, 39.2083), (6.5244, 3.3792)]
+
+
+def generate(count, rng):
+    points = []
+    for id in range(count):
+        latitude, longitude = rng.choice(CENTRES)
+        points.append((id, latitude + rng.gauss(0, 0.4), longitude + rng.gauss(0, 0.4)))
+    return points
+
+
+def scan_nearest(points, latitude, longitude, k):
+    return sorted((haversine_km(latitude, longitude, lat, lon), id) for id, lat, lon in points)[:k]
+
+
+def scan_within(points, latitude, longitude, radius_km):
+    return sorted(item for item in ((haversine_km(latitude, longitude, lat, lon), id) for id, lat, lon in points)
+                  if item[0] <= radius_km)
+
+
+def tree_nearest(tree, coordinates, latitude, longitude, k):
+    ids = [id for _, id in tree.nearest(unit_vector(latitude, longitude), k)]
+    return sorted((haversine_km(latitude, longitude, *coordinates[id]), id) for id in ids)
+
+
+def tree_within(tree, coordinates, latitude, longitude, radius_km):
+    ids = tree.within(unit_vector(latitude, longitude), chord_for_km(radius_km) * 1.000001)
+    return sorted(item for item in ((haversine_km(latitude, longitude, *coordinates[id]), id) for id in ids)
+                  if item[0] <= radius_km)
+
+
+def per_query_ms(function, queries):
+    started = time.perf_counter()
+    results = [function(*query) for query in queries]
+    return (time.perf_counter() - started) / len(queries) * 1000, results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 300000])
+    parser.add_argument('--queries', type=int, default=50)
+    parser.add_argument('--k', type=int, default=20)
+    parser.add_argument('--radius', type=float, default=5, help='km')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"{'open parcels':>12} {'build':>9} {'k-NN tree':>10} {'k-NN scan':>10} "
+          f"{'radius tree':>12} {'radius scan':>12} {'in radius':>10}")
+    for size in args.sizes:
+        points = generate(size, rng)
+        coordinates = {id: (lat, lon) for id, lat, lon in points}
+        started = time.perf_counter()
+        tree = KDTree((id, unit_vector(lat, lon)) for id, lat, lon in points)
+        build = time.perf_counter() - started
+        queries = [(lat + rng.gauss(0, 0.1), lon + rng.gauss(0, 0.1))
+                   for lat, lon in (rng.choice(CENTRES) for _ in range(args.queries))]
+
+        knn_tree, found = per_query_ms(lambda lat, lon: tree_nearest(tree, coordinates, lat, lon, args.k), queries)
+        knn_scan, expected = per_query_ms(lambda lat, lon: scan_nearest(points, lat, lon, args.k), queries)
+        assert found == expected, "k-NN results differ from the scan"
+        radius_tree, found = per_query_ms(lambda lat, lon: tree_within(tree, coordinates, lat, lon, args.radius), queries)
+        radius_scan, expected = per_query_ms(lambda lat, lon: scan_within(points, lat, lon, args.radius), queries)
+        assert found == expected, "Radius results differ from the scan"
+        average = sum(len(result) for result in found) / len(found)
+        print(f"{size:>12} {build:>8.2f}s {knn_tree:>8.2f}ms {knn_scan:>8.1f}ms "
+              f"{radius_tree:>10.2f}ms {radius_scan:>10.1f}ms {average:>10.0f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+# /server/benchmarks/bench_responses.py
+
+# Bytes on the wire and time per request for GET /parcels pages, for each Accept-Encoding a client may send.
+# Seeds a scratch SQLite database and calls the app through the test client, so the time is the app's own
+# (query, serialize, encode, compress) without the network:
+#   cd server && python benchmarks/bench_responses.py --limits 20 100 1000
+# Every variant is decoded and checked against the uncompressed body.
+
+import argparse
+import gzip
+import json
+import os
+import sys
+import tempfile
+import time
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+os.environ.setdefault('DATABASE_URI', 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'bench_responses.db'))
+
+from flask_migrate import upgrade
+
+from config import app
+from seed import seed_database
+import app as application # Registers every resource
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+DECODERS = {'identity': lambda body: body, 'gzip': gzip.decompress}
+if brotli is not None:
+    DECODERS['br'] = brotli.decompress
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--limits', type=int, nargs='+', default=[20, 100, 1000])
+    parser.add_argument('--parcels', type=int, default=5000)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    with app.app_context():
+        upgrade(directory=os.path.join(SERVER_DIR, 'migrations'))
+        seed_database(users=50, recipients=500, parcels=args.parcels, echo=lambda message: None)
+    client = app.test_client()
+    assert client.post('/login', json={'email': 'admin@example.com', 'password': 'password'}).status_code == 200
+
+    print(f"{'limit':>6} {'encoding':>9} {'bytes':>9} {'ms/request':>11}")
+    for limit in args.limits:
+        url = f'/parcels?limit={limit}'
+        expected = None
+        for encoding, decode in DECODERS.items():
+            headers = {'Accept-Encoding': encoding}
+            client.get(url, headers=headers) # Warm up
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                response = client.get(url, headers=headers)
+            elapsed = (time.perf_counter() - started) / args.requests * 1000
+            sent = response.headers.get('Content-Encoding', 'identity')
+            body = DECODERS[sent](response.get_data())
+            if expected is None:
+                expected = json.loads(body)
+            assert json.loads(body) == expected, f"{encoding} body differs"
+            print(f"{limit:>6} {encoding:>9} {len(response.get_data()):>9} {elapsed:>11.2f}"
+                  + (f"  (sent {sent})" if sent != encoding else ''))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# /server/benchmarks/bench_routes.py
+
+# Route planning (routing.py) for a day of generated stops around one depot, solved inline and with a
+# process pool. No database is needed:
+#   cd server && python benchmarks/bench_routes.py --sizes 10000 30000 --workers 4
+# Prints the time taken, the vehicles used and how much shorter 2-opt made the nearest neighbour routes.
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from routing import Stop, plan_routes, np
+
+DEPOT = (-1.2921, 36.8219)
+
+
+def generate(count, rng):
+    # Stops scattered over ~50km around the depot, denser towards a few neighbourhoods
+    centres = [(DEPOT[0] + rng.gauss(0, 0.2), DEPOT[1] + rng.gauss(0, 0.2)) for _ in range(20)]
+    stops = []
+    for id in range(1, count + 1):
+        latitude, longitude = rng.choice(centres)
+        stops.append(Stop(id, latitude + rng.gauss(0, 0.05), longitude + rng.gauss(0, 0.05), rng.uniform(0.5, 30),
+                          rng.uniform(10, 60) * rng.uniform(10, 60) * rng.uniform(5, 40)))
+    return stops
+
+
+def run(stops, args, workers):
+    started = time.perf_counter()
+    plan = plan_routes(DEPOT, stops, args.max_weight, args.max_volume, args.max_stops, workers=workers)
+    return time.perf_counter() - started, plan
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 30000])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--max-weight', type=float, default=1000)
+    parser.add_argument('--max-volume', type=float, default=8000000)
+    parser.add_argument('--max-stops', type=int, default=60)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    print(f"NumPy distance matrices: {'yes' if np is not None else 'no'}, {os.cpu_count()} CPUs")
+    print(f"{'stops':>8} {'vehicles':>9} {'inline':>8} {f'{args.workers} workers':>10} {'km':>10} {'2-opt saved':>12}")
+    for size in args.sizes:
+        stops = generate(size, rng)
+        inline, plan = run(stops, args, 0)
+        pooled, pooled_plan = run(stops, args, args.workers)
+        assert pooled_plan == plan, "The pool planned different routes"
+        assert sorted(stop['parcel_id'] for route in plan['routes'] for stop in route['stops']) == list(range(1, size + 1))
+        first = sum(route['nearest_neighbour_km'] for route in plan['routes'])
+        print(f"{size:>8} {plan['vehicles']:>9} {inline:>7.2f}s {pooled:>9.2f}s {plan['distance_km']:>10.0f} "
+              f"{(1 - plan['distance_km'] / first) * 100:>11.1f}%")
+
+
+if __name__ == '__main__':
+    main()
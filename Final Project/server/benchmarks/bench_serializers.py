@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+# /server/benchmarks/bench_serializers.py
+
+# Per-row cost of SerializerMixin.to_dict() + jsonify versus the precompiled serializers + fast encoder.
+# Runs on transient objects so no database is needed:
+#   cd server && python benchmarks/bench_serializers.py --rows 2000
+
+import argparse
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+from flask import json
+from sqlalchemy.orm.attributes import set_committed_value
+
+from config import app
+from models import User, Recipient, Parcel
+from loading import PARCEL_PROFILE
+from serializers import get_serializer, dumps
+
+
+def build_parcels(count):
+    now = datetime.now(timezone.utc)
+    user = User(id=1, first_name='Jane', last_name='Doe', password='x' * 60, city='Nairobi', country='Kenya',
+                latitude=Decimal('-1.292066'), longitude=Decimal('36.821945'), created_at=now, updated_at=now)
+    # Set directly so the email validator doesn't go looking for a users table
+    set_committed_value(user, 'email', 'jane@example.com')
+    recipient = Recipient(id=1, first_name='John', last_name='Roe', email='john@example.com', city='Mombasa',
+                          country='Kenya', latitude=Decimal('-4.043477'), longitude=Decimal('39.668206'),
+                          created_at=now, updated_at=now)
+    return [
+        Parcel(id=i, user=user, recipient=recipient, length=Decimal('10.00'), width=Decimal('5.50'),
+               height=Decimal('3.25'), weight=Decimal('2.00'), cost=Decimal('12.40'), status='Pending',
+               tracking_number=f'{i:032x}', created_at=now, updated_at=now)
+        for i in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    parcels = build_parcels(args.rows)
+    serialize = get_serializer(PARCEL_PROFILE.view)
+
+    with app.app_context():
+        old = [parcel.to_dict(rules=PARCEL_PROFILE.exclude) for parcel in parcels]
+        new = [serialize(parcel) for parcel in parcels]
+        assert old == new, "Compiled serializer output differs from to_dict()"
+
+        cases = {
+            'to_dict': lambda: [parcel.to_dict(rules=PARCEL_PROFILE.exclude) for parcel in parcels],
+            'compiled': lambda: [serialize(parcel) for parcel in parcels],
+            'to_dict + json.dumps': lambda: json.dumps([parcel.to_dict(rules=PARCEL_PROFILE.exclude) for parcel in parcels]),
+            'compiled + dumps': lambda: dumps([serialize(parcel) for parcel in parcels]),
+        }
+        results = {}
+        for name, case in cases.items():
+            best = min(timeit.repeat(case, number=1, repeat=args.repeat))
+            results[name] = best / args.rows * 1e6
+            print(f"{name:<22} {results[name]:8.2f} us/row")
+
+    print(f"serialize speedup:      {results['to_dict'] / results['compiled']:.1f}x")
+    print(f"end to end speedup:     {results['to_dict + json.dumps'] / results['compiled + dumps']:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+# /server/benchmarks/check_query_plans.py
+
+# Query plan regression check for the hot parcel queries, a command line wrapper around tests/test_query_plans.py
+# for running it against another database or dataset size. Exits with 1 when any of them reads parcels (or
+# parcel_events, recipients) with a full table scan instead of an index.
+#   cd server && python benchmarks/check_query_plans.py                 # scratch SQLite database
+#   cd server && python benchmarks/check_query_plans.py --database-uri postgresql://.../scratch
+# On PostgreSQL everything runs in one transaction that is rolled back, so point it at a scratch database anyway
+# but nothing is left behind. The migrations are applied first, so this also checks they create the indexes.
+
+import argparse
+import os
+import sys
+
+import pytest
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--database-uri', help='Defaults to a scratch SQLite file')
+    parser.add_argument('--parcels', type=int, default=50000)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--recipients', type=int, default=5000)
+    parser.add_argument('--verbose', action='store_true', help='Print every plan')
+    args = parser.parse_args()
+
+    if args.database_uri:
+        os.environ['TEST_DATABASE_URI'] = args.database_uri
+    os.environ['QUERY_PLAN_PARCELS'] = str(args.parcels)
+    os.environ['QUERY_PLAN_USERS'] = str(args.users)
+    os.environ['QUERY_PLAN_RECIPIENTS'] = str(args.recipients)
+    options = ['-v', '-s'] if args.verbose else ['-q']
+    sys.exit(pytest.main([os.path.join(SERVER_DIR, 'tests', 'test_query_plans.py'), '--rootdir', SERVER_DIR, *options]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python3
+# /server/benchmarks/load_test.py
+
+# Load test: concurrent clients drive the user journey (signup, login, create a recipient, create a parcel,
+# list my parcels, track it) plus an admin watching the dashboard, and the latency percentiles, throughput and
+# SQL statements per endpoint are printed and saved as JSON so runs can be compared across commits.
+#   cd server && python benchmarks/load_test.py --clients 8 --iterations 20
+#   cd server && python benchmarks/load_test.py --url http://localhost:5555 --admin-email ... --admin-password ...
+#   cd server && python benchmarks/load_test.py --compare load_test_1a2b3c4.json load_test_5d6e7f8.json
+# Without --url a scratch SQLite database (or --database-uri) is migrated and filled by flask seed, and the app is
+# started under gunicorn with INSTRUMENTATION=true, whose Server-Timing header gives the query counts.
+
+import argparse
+import http.client
+import json
+import os
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from urllib.parse import urlsplit
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+
+QUERIES = re.compile(r'desc="(\d+) queries"')
+PASSWORD = 'load-test-password'
+
+
+class Client:
+    # One keep-alive connection and one session cookie per simulated user
+    def __init__(self, host, port, recorder):
+        self.host, self.port = host, port
+        self.recorder = recorder
+        self.connection = None
+        self.cookie = None
+
+    def _connect(self):
+        self.connection = http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def _record(self, name, elapsed, status, queries):
+        if self.recorder is not None:
+            self.recorder.record(name, elapsed, status, queries)
+
+    def request(self, name, method, path, payload=None):
+        body = json.dumps(payload) if payload is not None else None
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        if self.cookie:
+            headers['Cookie'] = self.cookie
+        for attempt in range(2):
+            if self.connection is None:
+                self._connect()
+            started = time.perf_counter()
+            try:
+                self.connection.request(method, path, body=body, headers=headers)
+                response = self.connection.getresponse()
+                data = response.read()
+                break
+            except (http.client.HTTPException, OSError):
+                # The server closed a kept alive connection, reconnect once before counting it as an error
+                self.connection.close()
+                self.connection = None
+                if attempt:
+                    self._record(name, time.perf_counter() - started, 0, None)
+                    return 0, None
+        elapsed = time.perf_counter() - started
+
+        cookie = response.getheader('Set-Cookie')
+        if cookie:
+            self.cookie = cookie.split(';', 1)[0]
+        if response.getheader('Connection', '').lower() == 'close':
+            self.connection.close()
+            self.connection = None
+        timing = ', '.join(value for key, value in response.getheaders() if key.lower() == 'server-timing')
+        match = QUERIES.search(timing)
+        self._record(name, elapsed, response.status, int(match.group(1)) if match else None)
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = defaultdict(list) # name -> [(seconds, status, queries)]
+
+    def record(self, name, elapsed, status, queries):
+        with self.lock:
+            self.samples[name].append((elapsed, status, queries))
+
+
+def percentile(values, fraction):
+    # Nearest rank on sorted values
+    if not values:
+        return None
+    index = min(len(values) - 1, max(0, int(round(fraction * len(values) + 0.5)) - 1))
+    return values[index]
+
+
+def summarize(samples, duration):
+    endpoints = {}
+    total_requests = total_errors = 0
+    for name, rows in sorted(samples.items()):
+        latencies = sorted(elapsed * 1000 for elapsed, _, _ in rows)
+        errors = sum(1 for _, status, _ in rows if not 200 <= status < 400)
+        queries = [count for _, _, count in rows if count is not None]
+        endpoints[name] = {
+            'requests': len(rows),
+            'errors': errors,
+            'p50_ms': round(percentile(latencies, 0.50), 2),
+            'p95_ms': round(percentile(latencies, 0.95), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'mean_ms': round(sum(latencies) / len(latencies), 2),
+            'max_ms': round(latencies[-1], 2),
+            'throughput_rps': round(len(rows) / duration, 1),
+            'queries_mean': round(sum(queries) / len(queries), 2) if queries else None,
+        }
+        total_requests += len(rows)
+        total_errors += errors
+    return {
+        'requests': total_requests,
+        'errors': total_errors,
+        'duration_s': round(duration, 2),
+        'throughput_rps': round(total_requests / duration, 1),
+    }, endpoints
+
+
+def user_journey(client, admin, run_id, number, iterations, recorder, warmup):
+    for iteration in range(warmup + iterations):
+        client.recorder = admin.recorder = recorder if iteration >= warmup else None # Warmup isn't recorded
+
+        email = f"load-{run_id}-{number}-{iteration}@example.com"
+        client.request('POST /signup', 'POST', '/signup', {
+            'first_name': 'Load', 'last_name': f'User {number}', 'email': email, 'password': PASSWORD,
+        })
+        client.request('POST /login', 'POST', '/login', {'email': email, 'password': PASSWORD})
+        status, recipient = client.request('POST /recipients', 'POST', '/recipients', {
+            'first_name': 'Load', 'last_name': 'Recipient', 'email': f"recipient-{email}",
+            'phone_number': '+254700000000', 'street': '1 Moi Avenue', 'city': 'Nairobi', 'state': 'Nairobi',
+            'zip_code': '00100', 'country': 'Kenya', 'latitude': -1.2864, 'longitude': 36.8172,
+        })
+        if status == 201:
+            status, parcel = client.request('POST /parcels', 'POST', '/parcels', {
+                'recipient_id': recipient['id'], 'length': 30, 'width': 20, 'height': 10, 'weight': 2,
+                'cost': '12.50', 'status': 'Pending',
+            })
+            client.request('GET /user/parcels', 'GET', '/user/parcels?limit=50')
+            if status == 201:
+                client.request('GET /track/<tracking_number>', 'GET', f"/track/{parcel['tracking_number']}")
+        admin.request('GET /admin/dashboard', 'GET', '/admin/dashboard')
+        client.cookie = None # Next iteration is a new visitor
+
+
+def wait_until_up(host, port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            connection = http.client.HTTPConnection(host, port, timeout=2)
+            connection.request('GET', '/health/db')
+            if connection.getresponse().status == 200:
+                return
+        except (http.client.HTTPException, OSError):
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"The server on {host}:{port} didn't come up within {timeout}s")
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def prepare_database(database_uri, users, parcels):
+    os.environ['DATABASE_URI'] = database_uri
+    from flask_migrate import upgrade
+    from config import app
+    from seed import seed_database
+    with app.app_context():
+        upgrade(directory=os.path.join(SERVER_DIR, 'migrations'))
+        seed_database(users=users, recipients=users * 3, parcels=parcels, echo=lambda message: print(f"seed: {message}"))
+
+
+def start_server(database_uri, port, workers, threads):
+    env = dict(os.environ, DATABASE_URI=database_uri, INSTRUMENTATION='true')
+    # --preload so every worker shares the SECRET_KEY generated at import and accepts the others' sessions
+    command = [sys.executable, '-m', 'gunicorn', '--preload', '--workers', str(workers), '--threads', str(threads),
+               '--bind', f'127.0.0.1:{port}', '--log-level', 'warning', 'app:app']
+    return subprocess.Popen(command, cwd=SERVER_DIR, env=env)
+
+
+def git_commit():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=SERVER_DIR, text=True).strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--', '.'], cwd=SERVER_DIR, text=True).strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def print_report(totals, endpoints):
+    print(f"{'endpoint':<30} {'reqs':>6} {'err':>4} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'req/s':>7} {'queries':>7}")
+    for name, row in endpoints.items():
+        queries = '-' if row['queries_mean'] is None else f"{row['queries_mean']:.1f}"
+        print(f"{name:<30} {row['requests']:>6} {row['errors']:>4} {row['p50_ms']:>8.1f} {row['p95_ms']:>8.1f} "
+              f"{row['p99_ms']:>8.1f} {row['throughput_rps']:>7.1f} {queries:>7}")
+    print(f"{totals['requests']} requests, {totals['errors']} errors in {totals['duration_s']}s: "
+          f"{totals['throughput_rps']} req/s")
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    print(f"{before.get('commit')} -> {after.get('commit')}")
+    print(f"{'endpoint':<30} {'p50 ms':>17} {'p95 ms':>17} {'p99 ms':>17} {'queries':>11}")
+    for name in sorted(set(before['endpoints']) | set(after['endpoints'])):
+        old, new = before['endpoints'].get(name), after['endpoints'].get(name)
+        if not old or not new:
+            print(f"{name:<30} only in {'after' if new else 'before'}")
+            continue
+        cells = [f"{old[key]:>7.1f} -> {new[key]:<7.1f}" for key in ('p50_ms', 'p95_ms', 'p99_ms')]
+        queries = f"{old['queries_mean']} -> {new['queries_mean']}" if old['queries_mean'] is not None else '-'
+        print(f"{name:<30} {' '.join(cells)} {queries:>11}")
+    old, new = before['totals']['throughput_rps'], after['totals']['throughput_rps']
+    print(f"throughput: {old} -> {new} req/s ({(new / old - 1) * 100:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--url', help='An already running server, nothing is seeded or started')
+    parser.add_argument('--database-uri', help='Database to migrate, seed and serve, a scratch SQLite file by default')
+    parser.add_argument('--clients', type=int, default=8, help='Concurrent simulated users')
+    parser.add_argument('--iterations', type=int, default=20, help='Journeys per client')
+    parser.add_argument('--warmup', type=int, default=1, help='Journeys per client that are not recorded')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--seed-users', type=int, default=1000)
+    parser.add_argument('--seed-parcels', type=int, default=50000)
+    parser.add_argument('--admin-email', default='admin@example.com')
+    parser.add_argument('--admin-password', default='password')
+    parser.add_argument('--output', help='Where to save the JSON results, load_test_<commit>.json by default')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='Compare two saved results and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    server = None
+    if args.url:
+        parts = urlsplit(args.url)
+        host, port = parts.hostname, parts.port or 80
+    else:
+        database_uri = args.database_uri or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'load_test.db')
+        prepare_database(database_uri, args.seed_users, args.seed_parcels)
+        host, port = '127.0.0.1', free_port()
+        server = start_server(database_uri, port, args.workers, args.threads)
+
+    try:
+        wait_until_up(host, port)
+        recorder = Recorder()
+        admin = Client(host, port, recorder)
+        status, _ = admin.request('POST /login (admin)', 'POST', '/login',
+                                  {'email': args.admin_email, 'password': args.admin_password})
+        if status != 200:
+            raise SystemExit(f"Admin login as {args.admin_email} failed with {status}")
+        recorder.samples.clear()
+
+        run_id = f"{int(time.time())}-{os.getpid()}"
+        threads = []
+        for number in range(args.clients):
+            # Each simulated user gets its own admin connection too, the session cookie is shared
+            user_admin = Client(host, port, recorder)
+            user_admin.cookie = admin.cookie
+            threads.append(threading.Thread(
+                target=user_journey,
+                args=(Client(host, port, recorder), user_admin, run_id, number, args.iterations, recorder, args.warmup),
+            ))
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=30)
+
+    totals, endpoints = summarize(recorder.samples, duration)
+    print_report(totals, endpoints)
+
+    commit, dirty = git_commit()
+    result = {
+        'commit': commit,
+        'dirty': dirty,
+        'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'config': {key: value for key, value in vars(args).items() if key not in ('admin_password', 'compare', 'output')},
+        'totals': totals,
+        'endpoints': endpoints,
+    }
+    output = args.output or f"load_test_{commit or 'unknown'}{'-dirty' if dirty else ''}.json"
+    with open(output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Saved {output}")
+
+
+if __name__ == '__main__':
+    main()
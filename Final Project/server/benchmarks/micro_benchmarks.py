@@ -0,0 +1,91 @@
+# /server/benchmarks/micro_benchmarks.py
+
+# pytest-benchmark microbenchmarks for the per-row and per-request hot spots. No database is needed:
+#   cd server && pytest benchmarks/micro_benchmarks.py --benchmark-autosave
+#   cd server && pytest benchmarks/micro_benchmarks.py --benchmark-compare
+# The file is named so a plain pytest run doesn't collect it, pass it explicitly.
+# The old check_if_logged_in is kept as old_gate in bench_gate.py, so it's measured next to the route policy gate.
+
+import os
+import sys
+
+import pytest
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIR))
+sys.path.insert(0, BENCHMARKS_DIR)
+os.environ.setdefault('DATABASE_URI', 'sqlite://')
+
+pytest.importorskip('pytest_benchmark')
+
+from flask import g, json, request
+from sqlalchemy.orm.attributes import set_committed_value
+
+from config import app
+from models import User, Role
+from loading import PARCEL_PROFILE
+from serializers import get_serializer, dumps
+from principal import Principal, _admin_role_ids
+from bench_serializers import build_parcels
+from bench_gate import old_gate
+import app as application # Registers every resource and the gate
+
+ROWS = 100
+
+
+@pytest.fixture(scope='module')
+def parcels():
+    with app.app_context():
+        yield build_parcels(ROWS)
+
+
+@pytest.fixture(scope='module')
+def user():
+    user = User(id=1, first_name='Jane', last_name='Doe', password='x' * 60)
+    set_committed_value(user, 'email', 'jane@example.com')
+    set_committed_value(user, 'roles', [Role(id=2, name='user')])
+    _admin_role_ids.set('admin', frozenset({1})) # What admin_role_ids() would have loaded
+    return user
+
+
+@pytest.fixture
+def gate():
+    # check_route_policy, the before_request hook init_route_policies registered
+    return next(hook for hook in app.before_request_funcs[None] if hook.__name__ == 'check_route_policy')
+
+
+def test_parcel_to_dict(benchmark, parcels):
+    with app.app_context():
+        benchmark(lambda: [parcel.to_dict(rules=PARCEL_PROFILE.exclude) for parcel in parcels])
+
+
+def test_parcel_compiled_serializer(benchmark, parcels):
+    serialize = get_serializer(PARCEL_PROFILE.view)
+    with app.app_context():
+        benchmark(lambda: [serialize(parcel) for parcel in parcels])
+
+
+def test_parcel_to_dict_json(benchmark, parcels):
+    with app.app_context():
+        benchmark(lambda: json.dumps([parcel.to_dict(rules=PARCEL_PROFILE.exclude) for parcel in parcels]))
+
+
+def test_parcel_compiled_dumps(benchmark, parcels):
+    serialize = get_serializer(PARCEL_PROFILE.view)
+    with app.app_context():
+        benchmark(lambda: dumps([serialize(parcel) for parcel in parcels]))
+
+
+@pytest.mark.parametrize('path', ['/user/parcels', '/admin/dashboard', '/login'])
+def test_old_check_if_logged_in(benchmark, user, path):
+    with app.test_request_context(path):
+        # Reads the request the way the hook did, so both gates pay for the request proxies
+        benchmark(lambda: old_gate(request.path, request.endpoint, user))
+
+
+@pytest.mark.parametrize('path,expected', [('/user/parcels', None), ('/admin/dashboard', 403), ('/login', None)])
+def test_route_policy_gate(benchmark, user, gate, path, expected):
+    with app.test_request_context(path):
+        g.principal = Principal(user)
+        result = benchmark(gate)
+        assert (result.status_code if result is not None else None) == expected
@@ -6,18 +6,110 @@ from flask_migrate import Migrate
 from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
+from sqlalchemy.engine import make_url
 from dotenv import load_dotenv
 import os
+import shlex
+import tempfile
 
 load_dotenv()
 
 DATABASE_URI = os.getenv("DATABASE_URI")
 
-app = Flask(__name__)
+app = Flask(__name__, static_folder=None) # The React build is served by static_assets.py, from STATIC_FOLDER
 app.config['SECRET_KEY'] = os.urandom(24)
 app.config['SQLALCHEMY_DATABASE_URI'] = f'{DATABASE_URI}'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-app.json.compact = False
+app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', 10)) # Max SQL statements per request, enforced while testing
+app.config['ENFORCE_QUERY_BUDGET'] = os.getenv('ENFORCE_QUERY_BUDGET', 'false').lower() == 'true'
+app.config['PRINCIPAL_CACHE_SIZE'] = int(os.getenv('PRINCIPAL_CACHE_SIZE', 10000)) # Logged in users kept in memory per worker
+app.config['PRINCIPAL_CACHE_TTL'] = int(os.getenv('PRINCIPAL_CACHE_TTL', 300)) # Seconds, also bounds staleness across workers
+app.config['TRACKING_CACHE_SIZE'] = int(os.getenv('TRACKING_CACHE_SIZE', 50000))
+app.config['TRACKING_CACHE_TTL'] = int(os.getenv('TRACKING_CACHE_TTL', 30)) # Seconds, other workers only see patches after this
+app.config['INSTRUMENTATION'] = os.getenv('INSTRUMENTATION', 'false').lower() == 'true' # Per endpoint metrics on /metrics and Server-Timing headers
+app.config['METRICS_TOKEN'] = os.getenv('METRICS_TOKEN') # Bearer token for scraping /metrics, without it only admins can read it
+app.config['PROFILE_SAMPLE_RATE'] = float(os.getenv('PROFILE_SAMPLE_RATE', 0)) # Fraction of requests run under cProfile
+app.config['PROFILE_DIR'] = os.getenv('PROFILE_DIR', 'profiles')
+app.config['PROFILE_KEEP'] = int(os.getenv('PROFILE_KEEP', 20)) # Only the slowest sampled requests are kept
+app.config['STATIC_FOLDER'] = os.getenv('STATIC_FOLDER', os.path.join(app.root_path, '..', 'client', 'build'))
+app.config['STATIC_CACHE_DIR'] = os.getenv('STATIC_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'sendit-static')) # Compressed variants
+app.config['PASSWORD_HASH_METHOD'] = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1') # werkzeug's default, older hashes are upgraded on login
+app.config['PASSWORD_HASH_POOL'] = os.getenv('PASSWORD_HASH_POOL', 'thread') # Or "process", see passwords.py
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', os.cpu_count() or 2)) # Hashers per app worker, 0 hashes inline
+app.config['PASSWORD_HASH_PENDING'] = int(os.getenv('PASSWORD_HASH_PENDING', 0)) # Hashes in flight before 503s, 4 per hasher when 0
+app.config['PASSWORD_HASH_TIMEOUT'] = float(os.getenv('PASSWORD_HASH_TIMEOUT', 10))
+app.config['QUOTE_BASE_FEE'] = float(os.getenv('QUOTE_BASE_FEE', 0))
+app.config['QUOTE_RATE_PER_KM'] = float(os.getenv('QUOTE_RATE_PER_KM', 0.05)) # Same $0.05 per km the client used to charge
+app.config['QUOTE_RATE_PER_WEIGHT'] = float(os.getenv('QUOTE_RATE_PER_WEIGHT', 0.5)) # Per kg of chargeable weight
+app.config['QUOTE_DIM_DIVISOR'] = float(os.getenv('QUOTE_DIM_DIVISOR', 5000)) # cm^3 per kg of dimensional weight
+app.config['QUOTE_DISTANCE_CACHE_SIZE'] = int(os.getenv('QUOTE_DISTANCE_CACHE_SIZE', 100000)) # Memoized origin to destination distances, see pricing.py
+app.config['NEARBY_INDEX_REFRESH'] = float(os.getenv('NEARBY_INDEX_REFRESH', 1)) # Seconds between reads of new parcel events, see spatial.py
+app.config['NEARBY_INDEX_RELOAD'] = float(os.getenv('NEARBY_INDEX_RELOAD', 300)) # Seconds between full reloads of the open parcel index
+app.config['ROUTE_DEPOT_LAT'] = float(os.getenv('ROUTE_DEPOT_LAT')) if os.getenv('ROUTE_DEPOT_LAT') else None # Where routes start and end, see dispatch.py
+app.config['ROUTE_DEPOT_LNG'] = float(os.getenv('ROUTE_DEPOT_LNG')) if os.getenv('ROUTE_DEPOT_LNG') else None
+app.config['ROUTE_MAX_WEIGHT'] = float(os.getenv('ROUTE_MAX_WEIGHT', 1000)) # Per vehicle, same unit as parcel weights
+app.config['ROUTE_MAX_VOLUME'] = float(os.getenv('ROUTE_MAX_VOLUME', 8000000)) # cm^3 per vehicle, 8m^3
+app.config['ROUTE_MAX_STOPS'] = int(os.getenv('ROUTE_MAX_STOPS', 60)) # Per vehicle
+app.config['ROUTE_STOPS_LIMIT'] = int(os.getenv('ROUTE_STOPS_LIMIT', 300)) # Highest max_stops POST /admin/routes plans with, longer routes through `flask routes-plan`
+app.config['ROUTE_MAX_PARCELS'] = int(os.getenv('ROUTE_MAX_PARCELS', 50000)) # Per POST /admin/routes, the CLI has no limit
+app.config['ROUTE_WORKERS'] = int(os.getenv('ROUTE_WORKERS', 0)) # Processes per POST /admin/routes, 0 solves inline
+app.config['JSON_COMPRESSION'] = os.getenv('JSON_COMPRESSION', 'true').lower() == 'true' # br/gzip for large JSON bodies, off when a proxy compresses
+app.config['JSON_COMPRESS_MIN_SIZE'] = int(os.getenv('JSON_COMPRESS_MIN_SIZE', 1400)) # Bytes, smaller bodies fit in one packet anyway
+
+def _env_flag(name, default):
+    return os.getenv(name, str(default)).lower() == 'true'
+
+
+def gunicorn_concurrency():
+    # (workers, threads) from the same settings gunicorn reads, WEB_CONCURRENCY and GUNICORN_CMD_ARGS
+    workers = int(os.getenv('WEB_CONCURRENCY', 1))
+    threads = int(os.getenv('GUNICORN_THREADS', 1))
+    args = shlex.split(os.getenv('GUNICORN_CMD_ARGS', ''))
+    for index, arg in enumerate(args):
+        name, _, value = arg.partition('=')
+        if not value and index + 1 < len(args):
+            value = args[index + 1]
+        if name in ('-w', '--workers') and value.isdigit():
+            workers = int(value)
+        elif name == '--threads' and value.isdigit():
+            threads = int(value)
+    return max(1, workers), max(1, threads)
+
+
+def engine_options(database_uri):
+    # Every worker thread can hold one connection, and all workers together stay under DB_MAX_CONNECTIONS
+    # (Postgres allows 100 by default, the rest is left for migrations, psql and the outbox workers)
+    options = {
+        'pool_pre_ping': _env_flag('DB_POOL_PRE_PING', True), # Stale connections after idle periods are replaced, not raised
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)), # Seconds, below most proxies' and PaaS idle timeouts
+    }
+    if not database_uri:
+        return options
+
+    url = make_url(database_uri)
+    if url.get_backend_name() == 'sqlite':
+        return options # SQLite gets its own pool classes, which don't take the sizing options
+
+    workers, threads = gunicorn_concurrency()
+    per_worker = max(1, int(os.getenv('DB_MAX_CONNECTIONS', 90)) // workers)
+    pool_size = int(os.getenv('DB_POOL_SIZE', min(threads, per_worker)))
+    options.update(
+        pool_size=pool_size,
+        max_overflow=int(os.getenv('DB_MAX_OVERFLOW', max(0, min(threads, per_worker - pool_size)))),
+        pool_timeout=int(os.getenv('DB_POOL_TIMEOUT', 10)), # Seconds, fail fast at peaks instead of queueing for 30
+    )
+    if url.get_backend_name() == 'postgresql':
+        options['connect_args'] = {
+            'application_name': os.getenv('DB_APPLICATION_NAME', 'send-it-api'),
+            'connect_timeout': int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+            'options': f"-c statement_timeout={int(os.getenv('DB_STATEMENT_TIMEOUT', 30000))}", # Milliseconds
+        }
+    return options
+
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(DATABASE_URI)
+app.config['FEED_MAX_WAITERS'] = int(os.getenv('FEED_MAX_WAITERS', max(1, gunicorn_concurrency()[1] // 2))) # Long polls and streams waiting per worker, at least one, see events.py
+app.config['FEED_STREAM_DURATION'] = float(os.getenv('FEED_STREAM_DURATION', 25)) # Seconds before an SSE stream ends and the browser reconnects
 
 metadata = MetaData(naming_convention={
     "fk": "fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s",
@@ -33,6 +125,6 @@ CORS(app,
      supports_credentials=True,
      allow_headers=['Content-Type', 'Authorization'],
      methods=['GET', 'POST', 'PUT', 'DELETE', 'OPTIONS'],
-     expose_headers=['Set-Cookie'])
+     expose_headers=['Set-Cookie', 'X-Next-After-Id', 'X-Next-Cursor', 'Link', 'Server-Timing'])
 
 
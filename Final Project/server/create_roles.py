@@ -1,15 +1,9 @@
 # /server/create_roles.py
-from app import Role, User, db
-
-def create_roles():
-    admin = Role(id=1, name='admin')
-    user = Role(id=2, name='user')
-
-    db.session.add(admin)
-    db.session.add(user)
-
-    db.session.commit()
-    print("Roles created successfully!")
-
-# Function calling will create 2 roles as planned!
-create_roles()
+# Creates the "admin" and "user" roles if they're missing. flask seed does this too
+from app import app
+from seed import ensure_roles
+
+if __name__ == '__main__':
+    with app.app_context():
+        ensure_roles()
+        print("Roles created successfully!")
@@ -0,0 +1,123 @@
+# /server/dispatch.py
+
+# Daily delivery routes: POST /admin/routes and `flask routes-plan`.
+# Takes the parcels still waiting for delivery (Pending or Accepted), optionally only those created on one day,
+# and hands them to the planner in routing.py with the vehicle limits. Weight is the parcel's weight, volume its
+# length x width x height in cm^3. Parcels without coordinates can't be routed and are listed as unlocated.
+# The endpoint holds a web worker while it plans, so it takes at most ROUTE_MAX_PARCELS parcels and
+# ROUTE_STOPS_LIMIT stops per vehicle. Bigger plans go through the CLI, e.g. from a nightly job.
+
+import json
+from datetime import date, datetime, time, timedelta, timezone
+
+import click
+from sqlalchemy import select
+
+from config import app, db
+from models import Parcel
+from routing import Stop, plan_routes
+
+ROUTE_STATUSES = ('Pending', 'Accepted')
+
+
+class RoutePlanError(ValueError):
+    pass
+
+
+def _number(data, key, low, high, cast=float):
+    try:
+        value = cast(data[key])
+    except (TypeError, ValueError):
+        raise RoutePlanError(f"'{key}' must be a number")
+    if not low <= value <= high:
+        raise RoutePlanError(f"'{key}' must be between {low} and {high}")
+    return value
+
+
+def _day(value):
+    try:
+        return date.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise RoutePlanError("'day' must be a date like 2024-05-31")
+
+
+def route_options(data, stops_limit=None):
+    # Planner arguments from the request body. The depot and vehicle limits default to the ROUTE_* settings.
+    # 2-opt is quadratic in the stops per vehicle, so the endpoint clamps max_stops to stops_limit
+    if not isinstance(data, dict):
+        raise RoutePlanError("Expected a JSON object")
+    data = {key: value for key, value in data.items() if value is not None}
+    defaults = {'lat': app.config['ROUTE_DEPOT_LAT'], 'lng': app.config['ROUTE_DEPOT_LNG']}
+    for key, value in defaults.items():
+        if value is not None:
+            data.setdefault(key, value)
+    if 'lat' not in data or 'lng' not in data:
+        raise RoutePlanError("The depot's 'lat' and 'lng' are required")
+    max_stops = _number(data, 'max_stops', 1, 10000, int) if 'max_stops' in data else app.config['ROUTE_MAX_STOPS']
+    return {
+        'depot': (_number(data, 'lat', -90, 90), _number(data, 'lng', -180, 180)),
+        'day': _day(data['day']) if 'day' in data else None,
+        'max_weight': _number(data, 'max_weight', 0, 1e9) if 'max_weight' in data else app.config['ROUTE_MAX_WEIGHT'],
+        'max_volume': _number(data, 'max_volume', 0, 1e12) if 'max_volume' in data else app.config['ROUTE_MAX_VOLUME'],
+        'max_stops': min(max_stops, stops_limit) if stops_limit else max_stops,
+    }
+
+
+def pending_stops_statement(day=None):
+    # The redundant != Delivered lets the planner use the ix_parcels_status_open partial index
+    statement = select(Parcel.id, Parcel.latitude, Parcel.longitude, Parcel.weight, Parcel.length, Parcel.width,
+                       Parcel.height).where(Parcel.status.in_(ROUTE_STATUSES), Parcel.status != 'Delivered')
+    if day is not None:
+        start = datetime.combine(day, time.min, tzinfo=timezone.utc)
+        statement = statement.where(Parcel.created_at >= start, Parcel.created_at < start + timedelta(days=1))
+    return statement
+
+
+def pending_stops(day=None, limit=None):
+    # ([Stop], [unlocated parcel id]). Raises RoutePlanError past limit parcels
+    statement = pending_stops_statement(day)
+    if limit is not None:
+        statement = statement.limit(limit + 1)
+    stops, unlocated = [], []
+    for id, latitude, longitude, weight, length, width, height in db.session.execute(statement):
+        if latitude is None or longitude is None:
+            unlocated.append(id)
+        else:
+            volume = float(length) * float(width) * float(height) if None not in (length, width, height) else 0.0
+            stops.append(Stop(id, latitude, longitude, weight, volume))
+    if limit is not None and len(stops) + len(unlocated) > limit:
+        raise RoutePlanError(f"More than {limit} parcels to route, plan one 'day' at a time")
+    return stops, unlocated
+
+
+def plan_day(options, workers=0, limit=None):
+    stops, unlocated = pending_stops(options['day'], limit)
+    plan = plan_routes(options['depot'], stops, options['max_weight'], options['max_volume'], options['max_stops'],
+                       workers=workers)
+    plan['day'] = options['day'].isoformat() if options['day'] else None
+    plan['max_stops'] = options['max_stops'] # After clamping, so the caller sees what was planned with
+    plan['unlocated'] = sorted(unlocated)
+    return plan
+
+
+def init_dispatch(app):
+    @app.cli.command('routes-plan')
+    @click.option('--lat', type=float, help="Depot latitude, ROUTE_DEPOT_LAT by default")
+    @click.option('--lng', type=float, help="Depot longitude, ROUTE_DEPOT_LNG by default")
+    @click.option('--day', help='Only parcels created on this day (YYYY-MM-DD)')
+    @click.option('--max-weight', type=float, help='Per vehicle, ROUTE_MAX_WEIGHT by default')
+    @click.option('--max-volume', type=float, help='cm^3 per vehicle, ROUTE_MAX_VOLUME by default')
+    @click.option('--max-stops', type=int, help='Per vehicle, ROUTE_MAX_STOPS by default')
+    @click.option('--workers', default=0, help='Processes solving routes in parallel, 0 solves them inline')
+    @click.option('--output', type=click.File('w'), help='Write the full plan as JSON to this file')
+    def routes_plan(lat, lng, day, max_weight, max_volume, max_stops, workers, output):
+        try:
+            options = route_options({'lat': lat, 'lng': lng, 'day': day, 'max_weight': max_weight,
+                                     'max_volume': max_volume, 'max_stops': max_stops})
+        except RoutePlanError as e:
+            raise click.UsageError(str(e))
+        plan = plan_day(options, workers=workers)
+        if output:
+            json.dump(plan, output)
+        click.echo(f"Planned {plan['stops']} stops on {plan['vehicles']} vehicles, {plan['distance_km']} km"
+                   f" ({len(plan['unlocated'])} parcels without coordinates)")
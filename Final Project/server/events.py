@@ -0,0 +1,157 @@
+# /server/events.py
+
+# Append-only parcel event log and the change feed built on it.
+# Every flush that creates, deletes or changes the status/location of a Parcel also writes a parcel_events row,
+# so clients can ask for "what changed since cursor N" instead of downloading all their parcels again.
+# Long polls and the SSE stream wait on a condition that's notified when this worker commits new events,
+# and fall back to polling the table every EVENT_POLL_INTERVAL seconds for events written by other workers.
+#
+# A waiting request holds its worker thread, so each worker lets at most FEED_MAX_WAITERS of them wait at once
+# (half the gunicorn threads by default, none with a single threaded sync worker) and only for a short time:
+# long polls up to MAX_LONG_POLL_WAIT seconds, streams for FEED_STREAM_DURATION before the browser reconnects
+# with Last-Event-ID. Over the cap a long poll answers at once and a stream gets a 503, both with Retry-After.
+# Under an async worker class (gevent) waiting is cheap, raise FEED_MAX_WAITERS there.
+
+import threading
+import time
+
+from sqlalchemy import event, insert, select, func, inspect
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Parcel, ParcelEvent
+from serializers import get_serializer, register_view, dumps
+
+LOCATION_FIELDS = ('street', 'city', 'state', 'zip_code', 'country', 'latitude', 'longitude')
+EVENT_POLL_INTERVAL = 1.0
+MAX_LONG_POLL_WAIT = 25
+FEED_RETRY_AFTER = 5 # Seconds, sent to clients turned away by the FEED_MAX_WAITERS cap
+FEED_LIMIT = 500
+
+register_view('parcel_event', ParcelEvent)
+
+_new_events = threading.Condition()
+
+
+class FeedWaiters:
+    # Long polls and streams waiting in this worker
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.active = 0
+
+    def acquire(self, limit):
+        with self._lock:
+            if self.active >= limit:
+                return False
+            self.active += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+
+feed_waiters = FeedWaiters()
+
+
+def event_row(parcel, event_type, previous_status=None):
+    row = {field: getattr(parcel, field) for field in LOCATION_FIELDS}
+    row.update(parcel_id=parcel.id, user_id=parcel.user_id, event_type=event_type, status=parcel.status,
+               previous_status=previous_status)
+    return row
+
+
+def _changed(state, field):
+    return state.attrs[field].history.has_changes()
+
+
+@event.listens_for(Session, 'after_flush')
+def record_parcel_events(session, flush_context):
+    # Runs after the INSERT/UPDATE/DELETE statements, so new parcels already have their ids. Attribute history
+    # still holds the pre-flush values here, which tells status changes apart from location changes
+    rows = []
+    for obj in session.new:
+        if isinstance(obj, Parcel):
+            rows.append(event_row(obj, 'created'))
+    for obj in session.dirty:
+        if not isinstance(obj, Parcel):
+            continue
+        state = inspect(obj)
+        if _changed(state, 'status'):
+            deleted = state.attrs.status.history.deleted
+            rows.append(event_row(obj, 'status', previous_status=deleted[0] if deleted else None))
+        elif any(_changed(state, field) for field in LOCATION_FIELDS):
+            rows.append(event_row(obj, 'location'))
+    for obj in session.deleted:
+        if isinstance(obj, Parcel):
+            rows.append(event_row(obj, 'deleted'))
+
+    if rows:
+        session.connection().execute(insert(ParcelEvent), rows)
+        session.info['parcel_events'] = True
+
+
+@event.listens_for(Session, 'after_commit')
+def notify_parcel_events(session):
+    if session.info.pop('parcel_events', False):
+        with _new_events:
+            _new_events.notify_all()
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_parcel_events(session):
+    session.info.pop('parcel_events', None)
+
+
+def mark_events_written(session=None):
+    # For code paths that insert parcels with Core statements (bulk ingestion) and write their own events
+    (session or db.session).info['parcel_events'] = True
+
+
+def head_cursor(user_id):
+    return db.session.execute(
+        select(func.coalesce(func.max(ParcelEvent.id), 0)).where(ParcelEvent.user_id == user_id)
+    ).scalar_one()
+
+
+def fetch_changes(user_id, since, limit=FEED_LIMIT):
+    stmt = (
+        select(ParcelEvent)
+        .where(ParcelEvent.user_id == user_id, ParcelEvent.id > since)
+        .order_by(ParcelEvent.id)
+        .limit(limit)
+    )
+    serialize = get_serializer('parcel_event')
+    return [serialize(row) for row in db.session.execute(stmt).scalars()]
+
+
+def wait_for_changes(user_id, since, timeout, limit=FEED_LIMIT):
+    deadline = time.monotonic() + timeout
+    while True:
+        changes = fetch_changes(user_id, since, limit)
+        remaining = deadline - time.monotonic()
+        if changes or remaining <= 0:
+            return changes
+        # Hand the connection back to the pool while we wait
+        db.session.close()
+        with _new_events:
+            _new_events.wait(min(EVENT_POLL_INTERVAL, remaining))
+
+
+def sse_stream(user_id, since, max_duration, heartbeat=15):
+    # Yields Server-Sent Events until max_duration, then the browser's EventSource reconnects with Last-Event-ID.
+    # The cursor is sent first, so a stream that ended without changes still resumes where it started
+    started = last_write = time.monotonic()
+    yield f'retry: 2000\nid: {since}\n\n'
+    deadline = started + max_duration
+    while time.monotonic() < deadline:
+        changes = wait_for_changes(user_id, since, timeout=min(heartbeat, deadline - time.monotonic()))
+        db.session.close()
+        if changes:
+            for change in changes:
+                yield f"id: {change['id']}\nevent: parcel\ndata: {dumps(change, pretty=False).decode()}\n\n"
+            since = changes[-1]['id']
+            last_write = time.monotonic()
+        elif time.monotonic() - last_write >= heartbeat:
+            yield ': keep-alive\n\n'
+            last_write = time.monotonic()
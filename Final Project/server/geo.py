@@ -0,0 +1,132 @@
+# /server/geo.py
+
+# Great-circle distances and geohashes for the latitude/longitude columns.
+# Also the unit sphere vectors the nearby parcel index (spatial.py) is built on: the straight line distance
+# between two of them grows with the great-circle distance, so nearest and within-radius searches can run in
+# plain 3-d space and still come out in the right order.
+
+from math import radians, sin, cos, asin, sqrt, floor, pi
+
+EARTH_RADIUS_KM = 6371.0088 # Mean earth radius
+KM_PER_DEGREE = pi * EARTH_RADIUS_KM / 180 # Of latitude, and of longitude at the equator
+GEOHASH_PRECISION = 9 # Stored on rows, ~5m x 5m cells
+
+_BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+_DECODE = {char: index for index, char in enumerate(_BASE32)}
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(radians, (float(lat1), float(lon1), float(lat2), float(lon2)))
+    a = sin((lat2 - lat1) / 2) ** 2 + cos(lat1) * cos(lat2) * sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * asin(min(1.0, sqrt(a)))
+
+
+def _spread(value):
+    # Moves bit i of a 32 bit int to bit 2i
+    value &= 0xFFFFFFFF
+    value = (value | (value << 16)) & 0x0000FFFF0000FFFF
+    value = (value | (value << 8)) & 0x00FF00FF00FF00FF
+    value = (value | (value << 4)) & 0x0F0F0F0F0F0F0F0F
+    value = (value | (value << 2)) & 0x3333333333333333
+    return (value | (value << 1)) & 0x5555555555555555
+
+
+def geohash_encode(latitude, longitude, precision=7):
+    # Precision 6 is a ~1.2km x 0.6km cell, 7 is ~150m x 150m. Both coordinates are quantized to the cell grid
+    # and their bits interleaved in one go (longitude first), instead of bisecting one bit at a time
+    bits = 5 * precision
+    lon_bits, lat_bits = (bits + 1) // 2, bits // 2
+    lat_index = min(int((float(latitude) + 90.0) / 180.0 * (1 << lat_bits)), (1 << lat_bits) - 1)
+    lon_index = min(int((float(longitude) + 180.0) / 360.0 * (1 << lon_bits)), (1 << lon_bits) - 1)
+    if lon_bits > lat_bits:
+        code = _spread(lon_index) | (_spread(lat_index) << 1)
+    else:
+        code = (_spread(lon_index) << 1) | _spread(lat_index)
+    return ''.join(_BASE32[(code >> shift) & 31] for shift in range(bits - 5, -1, -5))
+
+
+def geohash_bounds(geohash):
+    # Returns (min_lat, min_lon, max_lat, max_lon) of the cell
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash:
+        value = _DECODE[char]
+        for shift in range(4, -1, -1):
+            bit = (value >> shift) & 1
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bit:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+
+def geohash_decode(geohash):
+    # Centre of the cell as (latitude, longitude)
+    min_lat, min_lon, max_lat, max_lon = geohash_bounds(geohash)
+    return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+
+def geohash_cell_size(precision):
+    # (degrees of latitude, degrees of longitude) a cell spans
+    bits = 5 * precision
+    return 180.0 / (1 << (bits // 2)), 360.0 / (1 << ((bits + 1) // 2))
+
+
+def geohash_prefix_end(prefix):
+    # Smallest string above every geohash starting with prefix, so a prefix is the range [prefix, end).
+    # None when there is no upper bound ("zz...")
+    prefix = prefix.rstrip(_BASE32[-1])
+    if not prefix:
+        return None
+    return prefix[:-1] + _BASE32[_DECODE[prefix[-1]] + 1]
+
+
+def _longitude_ranges(min_lon, max_lon):
+    if max_lon - min_lon >= 360:
+        return [(-180.0, 180.0)]
+    if min_lon < -180:
+        return [(min_lon + 360, 180.0), (-180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lon, 180.0), (-180.0, max_lon - 360)]
+    return [(min_lon, max_lon)]
+
+
+def geohash_cover(latitude, longitude, radius_km, max_cells=16):
+    # Geohash prefixes whose cells together cover the circle, at the finest precision that needs no more than
+    # max_cells of them. [''] when only the whole world will do
+    latitude, longitude = float(latitude), float(longitude)
+    lat_delta = radius_km / KM_PER_DEGREE
+    min_lat, max_lat = max(-90.0, latitude - lat_delta), min(90.0, latitude + lat_delta)
+    widest = cos(radians(max(abs(min_lat), abs(max_lat))))
+    lon_delta = 360.0 if widest < 1e-9 else min(360.0, radius_km / (KM_PER_DEGREE * widest))
+    lon_ranges = _longitude_ranges(longitude - lon_delta, longitude + lon_delta)
+
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        cell_lat, cell_lon = geohash_cell_size(precision)
+        rows = (min(int((max_lat + 90) / cell_lat), int(180 / cell_lat) - 1), int((min_lat + 90) / cell_lat))
+        columns = [(int((low + 180) / cell_lon), min(int((high + 180) / cell_lon), int(360 / cell_lon) - 1))
+                   for low, high in lon_ranges]
+        count = (rows[0] - rows[1] + 1) * sum(last - first + 1 for first, last in columns)
+        if count > max_cells:
+            continue
+        cells = set()
+        for row in range(rows[1], rows[0] + 1):
+            for first, last in columns:
+                for column in range(first, last + 1):
+                    cells.add(geohash_encode(-90 + (row + 0.5) * cell_lat, -180 + (column + 0.5) * cell_lon,
+                                             precision))
+        return sorted(cells)
+    return ['']
+
+
+def unit_vector(latitude, longitude):
+    latitude, longitude = radians(float(latitude)), radians(float(longitude))
+    return cos(latitude) * cos(longitude), cos(latitude) * sin(longitude), sin(latitude)
+
+
+def chord_for_km(distance_km):
+    # Straight line distance between two points of the unit sphere that are distance_km apart along the surface
+    return 2 * sin(min(distance_km / EARTH_RADIUS_KM, pi) / 2)
@@ -0,0 +1,213 @@
+# /server/ingest.py
+
+# Bulk parcel ingestion for POST /parcels/bulk.
+# Rows are validated and inserted in chunks: one IN query to resolve the chunk's recipients, one multi-row
+# INSERT for any recipients not yet in the user's address book (addressbook.py), one for the parcels, and one
+# commit per chunk. A bad row only fails itself, every row gets back either its id and tracking number or the
+# reason it was rejected.
+
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from flask import request, json
+from sqlalchemy import insert, select, func
+
+from config import db
+from models import Recipient, Parcel, ParcelEvent
+from addressbook import recipient_fingerprint
+from spatial import parcel_geohash
+from pagination import NDJSON_MIMETYPE
+from events import LOCATION_FIELDS, mark_events_written
+from stats import apply_deltas, created_deltas
+
+BULK_CHUNK_SIZE = 500
+
+PARCEL_DIMENSIONS = ('length', 'width', 'height', 'weight')
+RECIPIENT_FIELDS = ('first_name', 'last_name', 'email', 'phone_number', 'street', 'city', 'state', 'zip_code',
+                    'country', 'latitude', 'longitude')
+PARCEL_ADDRESS_FIELDS = ('street', 'city', 'state', 'zip_code', 'country', 'latitude', 'longitude')
+
+
+class BulkPayloadError(ValueError):
+    pass
+
+
+def iter_request_rows():
+    # Accepts a JSON array, or NDJSON which is read line by line so the body is never parsed in one go
+    if request.mimetype == NDJSON_MIMETYPE:
+        for line in request.stream:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                yield None # Reported as an invalid row, the rest of the stream is still ingested
+        return
+
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        raise BulkPayloadError("Expected a JSON array of parcels or an NDJSON stream")
+    yield from data
+
+
+def chunked(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _decimal(row, key, required=True):
+    value = row.get(key)
+    if value is None:
+        if required:
+            raise ValueError(f"Missing required field '{key}'")
+        return None
+    try:
+        number = Decimal(str(value))
+    except InvalidOperation:
+        raise ValueError(f"'{key}' must be a number")
+    if not number.is_finite() or number < 0:
+        raise ValueError(f"'{key}' must be a positive number")
+    return number
+
+
+def validate_row(row):
+    # Returns (parcel values, recipient reference, recipient object or None) where the reference is a recipient
+    # id, an email, or the fingerprint of the recipient object
+    if not isinstance(row, dict):
+        raise ValueError("Row must be a JSON object")
+
+    values = {key: _decimal(row, key) for key in PARCEL_DIMENSIONS}
+    values['cost'] = _decimal(row, 'cost', required=False)
+    values['status'] = row.get('status') or 'Pending'
+    for key in PARCEL_ADDRESS_FIELDS:
+        if row.get(key) is not None:
+            values[key] = row[key]
+
+    recipient = row.get('recipient')
+    if row.get('recipient_id') is not None:
+        try:
+            return values, int(row['recipient_id']), None
+        except (TypeError, ValueError):
+            raise ValueError("'recipient_id' must be an integer")
+    if isinstance(recipient, dict) and recipient.get('email'):
+        recipient = dict({key: recipient.get(key) for key in RECIPIENT_FIELDS}, email=recipient['email'].strip().lower())
+        return values, recipient_fingerprint(recipient), recipient
+    if row.get('recipient_email'):
+        return values, row['recipient_email'].strip().lower(), None
+    raise ValueError("Each parcel needs a recipient_id, recipient_email or recipient object")
+
+
+def _resolve_recipients(ids, emails, fingerprints, new_recipients, user_id):
+    # ids -> set of existing ids, emails and fingerprints -> {reference: id}. Every reference is looked up in the
+    # user's own address book only. Recipient objects not in it yet are added
+    found_ids = set()
+    if ids:
+        stmt = select(Recipient.id).where(Recipient.user_id == user_id, Recipient.id.in_(ids))
+        found_ids = set(db.session.execute(stmt).scalars())
+
+    by_reference = {}
+    if emails:
+        # Stored emails keep the case they were typed in. Recipient.email isn't unique, the oldest row wins
+        email = func.lower(Recipient.email)
+        stmt = (select(email, Recipient.id).where(Recipient.user_id == user_id, email.in_(emails))
+                .order_by(Recipient.id.desc()))
+        by_reference = dict(db.session.execute(stmt).all())
+
+    if fingerprints:
+        stmt = select(Recipient.fingerprint, Recipient.id).where(Recipient.user_id == user_id,
+                                                                 Recipient.fingerprint.in_(fingerprints))
+        by_reference.update(db.session.execute(stmt).all())
+
+    to_create = [dict(details, user_id=user_id, fingerprint=fingerprint)
+                 for fingerprint, details in new_recipients.items() if fingerprint not in by_reference]
+    if to_create:
+        stmt = insert(Recipient).returning(Recipient.id, Recipient.fingerprint, sort_by_parameter_order=True)
+        for recipient_id, fingerprint in db.session.execute(stmt, to_create):
+            by_reference[fingerprint] = recipient_id
+    return found_ids, by_reference
+
+
+def _fill_addresses(parcel_rows):
+    # Rows without coordinates are delivered to their recipient's address, like POST /parcels does. Every row
+    # ends up with all the address columns and the geohash the ORM would have set (spatial.py)
+    missing = {row['recipient_id'] for row in parcel_rows if row.get('latitude') is None or row.get('longitude') is None}
+    addresses = {}
+    if missing:
+        columns = [getattr(Recipient, field) for field in PARCEL_ADDRESS_FIELDS]
+        stmt = select(Recipient.id, *columns).where(Recipient.id.in_(missing))
+        addresses = {recipient_id: address for recipient_id, *address in db.session.execute(stmt)}
+    for row in parcel_rows:
+        address = addresses.get(row['recipient_id']) if row['recipient_id'] in missing else None
+        for position, field in enumerate(PARCEL_ADDRESS_FIELDS):
+            if row.get(field) is None:
+                row[field] = address[position] if address is not None else None
+        row['geohash'] = parcel_geohash(row['latitude'], row['longitude'])
+
+
+def _ingest_chunk(chunk, user_id, offset):
+    results = [None] * len(chunk)
+    pending = [] # (position, parcel values, recipient reference)
+    ids, emails, fingerprints, new_recipients = set(), set(), set(), {}
+
+    for position, row in enumerate(chunk):
+        try:
+            values, reference, recipient = validate_row(row)
+        except ValueError as e:
+            results[position] = {"index": offset + position, "error": str(e)}
+            continue
+        if recipient is not None:
+            # Without names it can still match an address book entry, it just can't create one
+            if recipient['first_name'] and recipient['last_name']:
+                new_recipients.setdefault(reference, recipient)
+            fingerprints.add(reference)
+        else:
+            (ids if isinstance(reference, int) else emails).add(reference)
+        pending.append((position, values, reference))
+
+    if not pending:
+        return results
+
+    try:
+        found_ids, by_reference = _resolve_recipients(ids, emails, fingerprints, new_recipients, user_id)
+        parcel_rows, positions = [], []
+        for position, values, reference in pending:
+            recipient_id = reference if isinstance(reference, int) else by_reference.get(reference)
+            if recipient_id is None or (isinstance(reference, int) and recipient_id not in found_ids):
+                results[position] = {"index": offset + position, "error": "Recipient not found"}
+                continue
+            parcel_rows.append(dict(values, user_id=user_id, recipient_id=recipient_id))
+            positions.append(position)
+
+        if parcel_rows:
+            _fill_addresses(parcel_rows)
+            stmt = insert(Parcel).returning(Parcel.id, Parcel.tracking_number, sort_by_parameter_order=True)
+            created = db.session.execute(stmt, parcel_rows).all()
+            for position, (parcel_id, tracking_number) in zip(positions, created):
+                results[position] = {"index": offset + position, "id": parcel_id, "tracking_number": tracking_number}
+            # Core inserts skip the ORM flush hooks, so the "created" events and dashboard counters are written here
+            db.session.execute(insert(ParcelEvent), [
+                dict({field: row.get(field) for field in LOCATION_FIELDS}, parcel_id=parcel_id, user_id=user_id,
+                     event_type='created', status=row['status'], previous_status=None)
+                for row, (parcel_id, _) in zip(parcel_rows, created)
+            ])
+            mark_events_written()
+            apply_deltas(db.session.connection(), created_deltas(parcel_rows))
+        db.session.commit()
+    except Exception as e:
+        # One transaction per chunk, so nothing from this chunk was kept
+        db.session.rollback()
+        for position, _, _ in pending:
+            results[position] = {"index": offset + position, "error": f"Chunk failed: {e.__class__.__name__}"}
+    return results
+
+
+def ingest_parcels(rows, user_id, chunk_size=BULK_CHUNK_SIZE):
+    results = []
+    for chunk in chunked(rows, chunk_size):
+        results.extend(_ingest_chunk(chunk, user_id, len(results)))
+    return results
@@ -0,0 +1,223 @@
+# /server/instrumentation.py
+
+# Opt-in request instrumentation (INSTRUMENTATION=true).
+# For every request it records wall time, time spent in the database, the number of statements, the rows
+# they returned and the size of the response, aggregated per endpoint. The numbers are served in the
+# Prometheus text format on /metrics and sent back on each response as a Server-Timing header, which shows
+# up in the browser's network panel.
+#
+# With PROFILE_SAMPLE_RATE > 0 a sample of requests also runs under cProfile, and the PROFILE_KEEP slowest
+# of them are kept in PROFILE_DIR as .prof files (open with `python -m pstats` or snakeviz).
+#
+# Metrics are per process, so with several gunicorn workers each scrape sees the worker that answered it.
+
+import cProfile
+import heapq
+import os
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+
+from flask import request, g, has_request_context, Response
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+PROMETHEUS_MIMETYPE = 'text/plain; version=0.0.4'
+
+
+class EndpointStats:
+    __slots__ = ('requests', 'wall', 'db', 'queries', 'rows', 'bytes', 'buckets')
+
+    def __init__(self):
+        self.requests = 0
+        self.wall = 0.0
+        self.db = 0.0
+        self.queries = 0
+        self.rows = 0
+        self.bytes = 0
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1) # Last one is +Inf
+
+    def copy(self):
+        copy = EndpointStats()
+        for field in self.__slots__:
+            setattr(copy, field, getattr(self, field))
+        copy.buckets = list(self.buckets)
+        return copy
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, endpoint, method, status, wall, db, queries, rows, size):
+        key = (endpoint, method, str(status))
+        with self._lock:
+            stats = self._stats.get(key)
+            if stats is None:
+                stats = self._stats[key] = EndpointStats()
+            stats.requests += 1
+            stats.wall += wall
+            stats.db += db
+            stats.queries += queries
+            stats.rows += rows
+            stats.bytes += size
+            stats.buckets[bisect_left(DURATION_BUCKETS, wall)] += 1
+
+    def clear(self):
+        with self._lock:
+            self._stats.clear()
+
+    def render(self):
+        with self._lock:
+            snapshot = [(key, stats.copy()) for key, stats in sorted(self._stats.items())]
+
+        lines = []
+        counters = (
+            ('sendit_http_requests_total', 'Requests handled', 'requests'),
+            ('sendit_http_request_seconds_total', 'Wall time spent handling requests', 'wall'),
+            ('sendit_db_seconds_total', 'Time spent executing SQL statements', 'db'),
+            ('sendit_db_queries_total', 'SQL statements executed', 'queries'),
+            ('sendit_db_rows_total', 'Rows returned or affected by SQL statements', 'rows'),
+            ('sendit_response_bytes_total', 'Response body bytes, streamed responses excluded', 'bytes'),
+        )
+        for name, help_text, field in counters:
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} counter')
+            for (endpoint, method, status), stats in snapshot:
+                labels = _labels(endpoint=endpoint, method=method, status=status)
+                lines.append(f'{name}{{{labels}}} {_number(getattr(stats, field))}')
+
+        name = 'sendit_http_request_duration_seconds'
+        lines.append(f'# HELP {name} Request wall time')
+        lines.append(f'# TYPE {name} histogram')
+        for (endpoint, method, status), stats in snapshot:
+            labels = _labels(endpoint=endpoint, method=method, status=status)
+            cumulative = 0
+            for bound, count in zip(DURATION_BUCKETS + ('+Inf',), stats.buckets):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_sum{{{labels}}} {_number(stats.wall)}')
+            lines.append(f'{name}_count{{{labels}}} {stats.requests}')
+        return '\n'.join(lines) + '\n'
+
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+
+def _number(value):
+    return f'{value:.6f}' if isinstance(value, float) else str(value)
+
+
+metrics = Metrics()
+
+
+# SQL timing
+# The listeners are always registered but only do work for requests that instrumentation started.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def start_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'instrumentation' in g:
+        conn.info.setdefault('statement_started', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def end_statement(conn, cursor, statement, parameters, context, executemany):
+    if not (has_request_context() and 'instrumentation' in g):
+        return
+    started = conn.info.get('statement_started')
+    if not started:
+        return
+    sample = g.instrumentation
+    sample['db'] += time.perf_counter() - started.pop()
+    sample['queries'] += 1
+    # psycopg2 reports the row count of SELECTs too, sqlite3 only of writes (-1 otherwise)
+    if cursor.rowcount and cursor.rowcount > 0:
+        sample['rows'] += cursor.rowcount
+
+
+# Sampled profiling
+
+class SlowestProfiles:
+    # Keeps the `keep` slowest sampled requests on disk, evicting the fastest one when a slower request comes in
+
+    def __init__(self, directory, keep):
+        self.directory = directory
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._heap = [] # (seconds, path)
+
+    def offer(self, profiler, seconds, label):
+        with self._lock:
+            if len(self._heap) >= self.keep and seconds <= self._heap[0][0]:
+                return None
+            os.makedirs(self.directory, exist_ok=True)
+            filename = f"{int(seconds * 1000):07d}ms-{re.sub(r'[^A-Za-z0-9_.-]+', '_', label)}-{time.time_ns()}.prof"
+            path = os.path.join(self.directory, filename)
+            profiler.dump_stats(path)
+            if len(self._heap) >= self.keep:
+                _, evicted = heapq.heapreplace(self._heap, (seconds, path))
+                try:
+                    os.remove(evicted)
+                except OSError:
+                    pass
+            else:
+                heapq.heappush(self._heap, (seconds, path))
+            return path
+
+
+def init_instrumentation(app):
+    # Registered first, so its before_request runs before the auth gate and its after_request runs last
+    if not app.config.get('INSTRUMENTATION'):
+        return
+
+    sample_rate = app.config.get('PROFILE_SAMPLE_RATE', 0)
+    profiles = SlowestProfiles(app.config.get('PROFILE_DIR', 'profiles'), app.config.get('PROFILE_KEEP', 20))
+
+    @app.before_request
+    def start_instrumentation():
+        g.instrumentation = {'started': time.perf_counter(), 'db': 0.0, 'queries': 0, 'rows': 0}
+        if sample_rate and random.random() < sample_rate:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError: # Another profiler is already active on this thread
+                return
+            g.instrumentation['profiler'] = profiler
+
+    @app.after_request
+    def finish_instrumentation(response):
+        sample = g.pop('instrumentation', None)
+        if sample is None:
+            return response
+        wall = time.perf_counter() - sample['started']
+
+        profiler = sample.get('profiler')
+        if profiler is not None:
+            profiler.disable()
+            profiles.offer(profiler, wall, f"{request.method}-{request.endpoint}")
+
+        if response.is_streamed:
+            size = 0
+        else:
+            size = response.calculate_content_length() or 0
+        endpoint = request.endpoint or 'unmatched'
+        metrics.record(endpoint, request.method, response.status_code, wall, sample['db'], sample['queries'],
+                       sample['rows'], size)
+
+        response.headers.add('Server-Timing', f'app;dur={wall * 1000:.1f}')
+        response.headers.add('Server-Timing', f'db;dur={sample["db"] * 1000:.1f};desc="{sample["queries"]} queries"')
+        return response
+
+    @app.route('/metrics', endpoint='metrics')
+    def metrics_endpoint():
+        # Set METRICS_TOKEN to require "Authorization: Bearer <token>" from the scraper, without one only admins'
+        # sessions get through the auth gate (policy.py)
+        token = app.config.get('METRICS_TOKEN')
+        if token and request.headers.get('Authorization') != f'Bearer {token}':
+            return Response('Unauthorized\n', 401, mimetype='text/plain')
+        return Response(metrics.render(), mimetype=PROMETHEUS_MIMETYPE)
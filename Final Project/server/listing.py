@@ -0,0 +1,191 @@
+# /server/listing.py
+
+# Query parameter grammar for the collection endpoints:
+#   ?status=Pending,Accepted     filter on an allowed column, a comma separated list becomes IN (...)
+#   ?created_after=2024-08-01    created_at >= (also created_before, updated_after, updated_before), ISO 8601
+#   ?sort=-created_at,status     order on allowed columns, "-" for descending; the id breaks ties, NULLs sort
+#                                the way the database does (last ascending on PostgreSQL, first on SQLite)
+#   ?fields=id,status,tracking_number
+#                                only these columns are SELECTed and returned (the id always is)
+#   ?include=recipient           nest many-to-one relations, loaded with one IN query per page
+# Without fields/include an endpoint keeps returning its usual full payload, just filtered and sorted.
+
+from datetime import datetime, timezone
+from decimal import Decimal, InvalidOperation
+
+from sqlalchemy import select, inspect, DateTime, Integer, Numeric
+
+from config import db
+from serializers import get_serializer, get_field_serializer, serializable_fields
+
+RANGE_FILTERS = {
+    'created_after': ('created_at', '>='),
+    'created_before': ('created_at', '<'),
+    'updated_after': ('updated_at', '>='),
+    'updated_before': ('updated_at', '<'),
+}
+MAX_FILTER_VALUES = 100
+MAX_BATCH_IDS = 1000 # Per POST body, a GET ?ids= list is capped at MAX_FILTER_VALUES to keep URLs short
+
+
+class QueryArgsError(ValueError):
+    pass
+
+
+def _split(value):
+    return [part.strip() for part in value.split(',') if part.strip()]
+
+
+def parse_ids(values, limit=MAX_BATCH_IDS):
+    # "1,2,3" or a JSON list -> distinct ints in the order given
+    if isinstance(values, str):
+        values = _split(values)
+    if not isinstance(values, list) or not values:
+        raise QueryArgsError("'ids' takes a comma separated list or a JSON array of ids")
+    try:
+        ids = list(dict.fromkeys(int(value) for value in values))
+    except (TypeError, ValueError):
+        raise QueryArgsError("'ids' must all be integers")
+    if len(ids) > limit:
+        raise QueryArgsError(f"'ids' takes at most {limit} ids")
+    return ids
+
+
+def parse_value(column, raw):
+    # Query string -> Python value of the column's type
+    column_type = column.type
+    try:
+        if isinstance(column_type, DateTime):
+            value = datetime.fromisoformat(raw.replace('Z', '+00:00'))
+            if column_type.timezone and value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            return value
+        if isinstance(column_type, Integer):
+            return int(raw)
+        if isinstance(column_type, Numeric):
+            return Decimal(raw)
+    except (ValueError, InvalidOperation):
+        raise QueryArgsError(f"Invalid value '{raw}' for {column.key}")
+    return raw
+
+
+class CollectionSpec:
+    # What a collection endpoint lets clients filter, sort and include
+
+    def __init__(self, model, filters=(), sortable=('id',), includes=None, partial_indexes=None):
+        self.model = model
+        self.filters = set(filters)
+        self.sortable = set(sortable) | {'id'}
+        self.includes = includes or {} # relationship name -> serializer view
+        # column -> value a partial index leaves out (WHERE column <> value). Filters that can't match the value
+        # repeat the index's predicate, so planners that don't prove implication (SQLite) can still use it
+        self.partial_indexes = partial_indexes or {}
+
+    def parse(self, args):
+        # Returns a Listing, or None when none of the grammar's parameters are used
+        if not any(key in args for key in ('sort', 'fields', 'include', *RANGE_FILTERS, *self.filters)):
+            return None
+        return Listing(self, args)
+
+
+class Listing:
+    def __init__(self, spec, args):
+        self.spec = spec
+        model = spec.model
+        mapper = inspect(model)
+
+        self.conditions = []
+        for key in spec.filters:
+            if key not in args:
+                continue
+            column = getattr(model, key)
+            values = [parse_value(column, raw) for raw in _split(args[key])]
+            if not values or len(values) > MAX_FILTER_VALUES:
+                raise QueryArgsError(f"'{key}' takes between 1 and {MAX_FILTER_VALUES} values")
+            self.conditions.append(column == values[0] if len(values) == 1 else column.in_(values))
+            excluded = spec.partial_indexes.get(key)
+            if excluded is not None and excluded not in values:
+                self.conditions.append(column != excluded)
+        for key, (field, operator) in RANGE_FILTERS.items():
+            if key in args and field in mapper.columns:
+                column = getattr(model, field)
+                value = parse_value(column, args[key])
+                self.conditions.append(column >= value if operator == '>=' else column < value)
+
+        self.sort = []
+        for name in _split(args.get('sort', '')):
+            descending = name.startswith('-')
+            name = name.lstrip('-+')
+            if name not in spec.sortable:
+                raise QueryArgsError(f"Can't sort on '{name}', allowed: {', '.join(sorted(spec.sortable))}")
+            self.sort.append((getattr(model, name), descending))
+
+        self.include = _split(args.get('include', ''))
+        for name in self.include:
+            if name not in spec.includes:
+                raise QueryArgsError(f"Can't include '{name}', allowed: {', '.join(sorted(spec.includes)) or 'nothing'}")
+
+        allowed = serializable_fields(model)
+        if 'fields' in args:
+            self.fields = _split(args['fields'])
+            unknown = [name for name in self.fields if name not in allowed]
+            if unknown:
+                raise QueryArgsError(f"Unknown fields: {', '.join(unknown)}")
+            if 'id' not in self.fields:
+                self.fields.insert(0, 'id')
+        elif self.include:
+            self.fields = list(allowed)
+        else:
+            self.fields = None
+
+        self._included = {}
+
+    @property
+    def projected(self):
+        return self.fields is not None
+
+    def statement(self, stmt):
+        if self.projected:
+            # Only the requested columns, plus what the sort cursor and the includes need
+            model = self.spec.model
+            names = list(dict.fromkeys(
+                self.fields + [column.key for column, _ in self.sort] +
+                [self._foreign_key(name).key for name in self.include]
+            ))
+            projected = select(*[getattr(model, name) for name in names])
+            if stmt is not None and stmt.whereclause is not None:
+                projected = projected.where(stmt.whereclause)
+            stmt = projected
+        elif stmt is None:
+            stmt = select(self.spec.model)
+        return stmt.where(*self.conditions) if self.conditions else stmt
+
+    def _foreign_key(self, name):
+        relationship = inspect(self.spec.model).relationships[name]
+        return next(iter(relationship.local_columns))
+
+    def prepare(self, rows):
+        # Loads the included relations of a page of rows with one IN query each
+        self._included = {}
+        for name in self.include:
+            relationship = inspect(self.spec.model).relationships[name]
+            target = relationship.mapper.class_
+            key = self._foreign_key(name).key
+            ids = {getattr(row, key) for row in rows} - {None}
+            serialize = get_serializer(self.spec.includes[name])
+            found = db.session.execute(select(target).where(target.id.in_(ids))).scalars() if ids else ()
+            self._included[name] = (key, {obj.id: serialize(obj) for obj in found})
+
+    def serializer(self, default):
+        if not self.projected:
+            return default
+        base = get_field_serializer(self.spec.model, self.fields)
+        if not self.include:
+            return base
+
+        def serialize(row):
+            payload = base(row)
+            for name, (key, objects) in self._included.items():
+                payload[name] = objects.get(getattr(row, key))
+            return payload
+        return serialize
@@ -0,0 +1,152 @@
+# /server/loading.py
+
+# Declarative loading profiles for the API endpoints.
+# Every relationship that ends up in a response is loaded up front (selectinload for collections,
+# joinedload for many-to-one), and relationships the clients never read are cut out of the payload
+# so SerializerMixin doesn't lazy load them one row at a time (the old N+1 on GET /parcels).
+
+from flask import request, g, has_request_context
+from sqlalchemy import select, event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import selectinload, joinedload
+
+from models import User, Role, Recipient, Parcel, BillingAddress
+from serializers import get_serializer
+from listing import CollectionSpec
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class LoadProfile:
+    def __init__(self, model, selectin=(), joined=(), exclude=(), view=None, query_budget=None, collection=None):
+        self.model = model
+        self.selectin = selectin # Dotted relationship paths e.g. 'parcels.recipient'
+        self.joined = joined
+        self.exclude = exclude # Extra serializer rules e.g. '-user.billing_addresses'
+        self.view = view # Precompiled serializer from serializers.py, must produce the same payload as exclude
+        self.query_budget = query_budget # Overrides app.config['QUERY_BUDGET'] when set
+        self.collection = collection # CollectionSpec for the list endpoint's filters, sorts and includes
+
+    def _loader(self, path, strategy):
+        option = None
+        cls = self.model
+        for name in path.split('.'):
+            attr = getattr(cls, name)
+            option = strategy(attr) if option is None else getattr(option, strategy.__name__)(attr)
+            cls = attr.property.mapper.class_
+        return option
+
+    def options(self):
+        return ([self._loader(path, selectinload) for path in self.selectin] +
+                [self._loader(path, joinedload) for path in self.joined])
+
+    def select(self):
+        return select(self.model).options(*self.options())
+
+    def query(self):
+        # Legacy Query so the existing filter_by(...).first() handlers keep their shape
+        return self.model.query.options(*self.options())
+
+    def serialize(self, instance):
+        if self.view:
+            return get_serializer(self.view)(instance)
+        return instance.to_dict(rules=self.exclude)
+
+
+# Clients only read the flat columns of parcel.user and parcel.recipient
+PARCEL_PROFILE = LoadProfile(
+    Parcel,
+    joined=('user', 'recipient'),
+    exclude=('-user.parcels', '-user.billing_addresses', '-user.roles'),
+    view='parcel',
+    collection=CollectionSpec(
+        Parcel,
+        filters=('status', 'country', 'city', 'user_id', 'recipient_id', 'tracking_number'),
+        sortable=('created_at', 'updated_at', 'status', 'cost', 'weight'),
+        includes={'recipient': 'recipient', 'user': 'user'},
+        partial_indexes={'status': 'Delivered'}, # ix_parcels_status_open
+    ),
+)
+
+USER_LIST_PROFILE = LoadProfile(
+    User,
+    selectin=('roles', 'billing_addresses'),
+    exclude=('-parcels', '-roles.users', '-billing_addresses.user'),
+    view='user_summary',
+    collection=CollectionSpec(User, filters=('email', 'country', 'city'), sortable=('created_at', 'last_name', 'email')),
+)
+
+USER_DETAIL_PROFILE = LoadProfile(
+    User,
+    selectin=('roles', 'billing_addresses', 'parcels.recipient'),
+    exclude=('-roles.users', '-billing_addresses.user', '-parcels.user', '-parcels.recipient.parcels'),
+    view='user_detail',
+)
+
+RECIPIENT_PROFILE = LoadProfile(
+    Recipient,
+    exclude=('-parcels',),
+    view='recipient',
+    collection=CollectionSpec(Recipient, filters=('email', 'country', 'city'), sortable=('created_at', 'last_name', 'email')),
+)
+
+BILLING_ADDRESS_PROFILE = LoadProfile(
+    BillingAddress,
+    joined=('user',),
+    exclude=('-user.parcels', '-user.billing_addresses', '-user.roles'),
+    view='billing_address_with_user',
+    collection=CollectionSpec(BillingAddress, filters=('user_id', 'country', 'city'), sortable=('country', 'city'),
+                              includes={'user': 'user'}),
+)
+
+ROLE_PROFILE = LoadProfile(Role, exclude=('-users',), view='role', collection=CollectionSpec(Role, filters=('name',), sortable=('name',)))
+
+# Keyed by flask_restful endpoint name
+ENDPOINT_PROFILES = {
+    'users': USER_LIST_PROFILE,
+    'usersbyid': USER_DETAIL_PROFILE,
+    'roles': ROLE_PROFILE,
+    'rolesbyid': ROLE_PROFILE,
+    'recipients': RECIPIENT_PROFILE,
+    'recipientsbyid': RECIPIENT_PROFILE,
+    'recipientsbatch': RECIPIENT_PROFILE,
+    'recipientsbyuserid': RECIPIENT_PROFILE,
+    'parcels': PARCEL_PROFILE,
+    'parcelsbyid': PARCEL_PROFILE,
+    'parcelsbyuserid': PARCEL_PROFILE,
+    'parcelsnearby': PARCEL_PROFILE,
+    'billingaddresses': BILLING_ADDRESS_PROFILE,
+    'billingaddressesbyid': BILLING_ADDRESS_PROFILE,
+}
+
+
+def endpoint_profile():
+    return ENDPOINT_PROFILES[request.endpoint]
+
+
+# Query budget guard
+# Counts the statements each request runs and fails the request when it goes over budget.
+# Only enforced while testing (or with ENFORCE_QUERY_BUDGET) so a regression back to N+1 shows up in tests.
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def count_query(conn, cursor, statement, parameters, context, executemany):
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+
+def init_query_budget(app):
+    @app.before_request
+    def start_query_count():
+        g.query_count = 0
+
+    @app.after_request
+    def check_query_budget(response):
+        if not (app.config.get('TESTING') or app.config.get('ENFORCE_QUERY_BUDGET')):
+            return response
+        profile = ENDPOINT_PROFILES.get(request.endpoint)
+        budget = profile.query_budget if profile and profile.query_budget is not None else app.config['QUERY_BUDGET']
+        if g.get('query_count', 0) > budget:
+            raise QueryBudgetExceeded(f"{request.method} {request.path} ran {g.query_count} queries, budget is {budget}")
+        return response
@@ -0,0 +1,40 @@
+"""Parcel ids autoincrement on SQLite
+
+Revision ID: e7a2c4b9d518
+Revises: d41b8e6f2c93
+Create Date: 2026-10-18 16:05:12.418306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7a2c4b9d518'
+down_revision = 'd41b8e6f2c93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # SQLite only autoincrements an INTEGER PRIMARY KEY, so parcels.id BIGINT left new parcels without an id there.
+    # Nothing changes on PostgreSQL
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('parcels', schema=None, recreate='always') as batch_op:
+        batch_op.alter_column('id', existing_type=sa.BigInteger(), type_=sa.Integer(), existing_nullable=False)
+    _restore_descending_index()
+
+
+def _restore_descending_index():
+    # The copy is made from the reflected table, which loses the DESC of this index
+    op.drop_index('ix_parcels_user_id_created_at', table_name='parcels')
+    op.create_index('ix_parcels_user_id_created_at', 'parcels', ['user_id', sa.text('created_at DESC')], unique=False)
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'sqlite':
+        return
+    with op.batch_alter_table('parcels', schema=None, recreate='always') as batch_op:
+        batch_op.alter_column('id', existing_type=sa.Integer(), type_=sa.BigInteger(), existing_nullable=False)
+    _restore_descending_index()
@@ -1,16 +1,18 @@
 # /server/models.py
 
-from sqlalchemy import DateTime, func, Column, Integer, String, Float, ForeignKey, Text, BigInteger, Numeric
+from sqlalchemy import DateTime, func, Column, Integer, String, Float, ForeignKey, Text, BigInteger, Numeric, Index, UniqueConstraint
 from sqlalchemy.orm import relationship, validates
 from sqlalchemy.ext.associationproxy import association_proxy
 from sqlalchemy_serializer import SerializerMixin
-from werkzeug.security import generate_password_hash, check_password_hash
+from passwords import hash_password, verify_password
 from flask_security import UserMixin, RoleMixin
 import uuid
 import re
 
 from config import db
 
+EMAIL_FORMAT = re.compile(r"[^@]+@[^@]+\.[^@]+")
+
 # Association tables for many-to-many relationships
 roles_users = db.Table('roles_users',
     Column('user_id', Integer, ForeignKey('users.id')),
@@ -66,10 +68,9 @@ class User(db.Model, UserMixin, SerializerMixin):
 
     @validates('email')
     def validate_email(self, key, email):
-        if not re.match(r"[^@]+@[^@]+\.[^@]+", email):
+        # Format only, uniqueness is the unique index on users.email (a duplicate raises IntegrityError on flush)
+        if not EMAIL_FORMAT.match(email):
             raise ValueError("Invalid email format")
-        if User.query.filter(User.email == email).first():
-            raise ValueError("Email must be unique")
         return email
 
     @validates('password')
@@ -79,10 +80,10 @@ class User(db.Model, UserMixin, SerializerMixin):
         return password
     
     def set_password(self, password):
-        self.password = generate_password_hash(password)
+        self.password = hash_password(password)
     
     def check_password(self, password):
-        return check_password_hash(self.password, password)
+        return verify_password(self.password, password)[0]
     
     @classmethod
     def create_with_default_role(cls, **kwargs):
@@ -103,7 +104,14 @@ class User(db.Model, UserMixin, SerializerMixin):
 class Recipient(db.Model, SerializerMixin):
     __tablename__ = 'recipients'
     
+    __table_args__ = (
+        # The address book: one row per normalized address per user (addressbook.py)
+        Index('ix_recipients_user_id_fingerprint', 'user_id', 'fingerprint', unique=True),
+    )
+
     id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id')) # The address book it belongs to, NULL until compacted for old rows
+    fingerprint = Column(String(64)) # sha256 of the normalized email, phone, street, zip and country
     first_name = Column(String(130), nullable=False)
     last_name = Column(String(130), nullable=False)
     email = Column(String(130), unique=False, nullable=False, index=True)
@@ -122,13 +130,15 @@ class Recipient(db.Model, SerializerMixin):
     # One-to-many relationship with parcels
     parcels = relationship('Parcel', back_populates='recipient')
 
+    serialize_rules = ('-fingerprint',) # Internal dedup key
+
     def __repr__(self):
         return f"<Recipient(id={self.id}, full_name='{self.first_name} {self.last_name}', email='{self.email}', phone_number='{self.phone_number}')>"
 
 class Parcel(db.Model, SerializerMixin):
     __tablename__ = 'parcels'
     
-    id = Column(BigInteger, primary_key=True) # We expect that with scale the parcels will be significantly more than the users and recipients
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True) # We expect that with scale the parcels will be significantly more than the users and recipients
     user_id = Column(Integer, ForeignKey('users.id'))
     recipient_id = Column(Integer, ForeignKey('recipients.id'))
     length = Column(Numeric(10, 2)) # Precision = 10 digits total. Scale = 2 digits to the right of the decimal point
@@ -145,6 +155,7 @@ class Parcel(db.Model, SerializerMixin):
     country = Column(String(100), nullable=True) # Will see whether to handle as nullable based on google maps API
     latitude = Column(Numeric(10, 6)) # Accurate to one micrometer)
     longitude = Column(Numeric(10, 6)) # Accurate to one micrometer)
+    geohash = Column(String(12)) # Of latitude/longitude, kept in step on write (spatial.py)
     created_at = Column(DateTime(timezone=True), server_default=func.current_timestamp())
     updated_at = Column(DateTime(timezone=True), server_default=func.current_timestamp(), onupdate=func.current_timestamp())
 
@@ -154,7 +165,19 @@ class Parcel(db.Model, SerializerMixin):
     # Many-to-one relationship with Recipient
     recipient = relationship('Recipient', back_populates='parcels')
 
-    serialize_rules = ('-user.parcels', '-recipient.parcels')
+    serialize_rules = ('-user.parcels', '-recipient.parcels', '-geohash') # geohash is an index key, not part of the API
+
+    # Hot filters: a user's parcels newest first, a recipient's parcels, date ranges/newest first, and the open
+    # (not yet delivered) parcels, which stay a small slice of the table so that index is partial. Area searches
+    # scan geohash prefix ranges.
+    # tests/test_query_plans.py fails when one of these queries goes back to a full table scan
+    __table_args__ = (
+        Index('ix_parcels_user_id_created_at', user_id, created_at.desc()),
+        Index('ix_parcels_recipient_id', recipient_id),
+        Index('ix_parcels_created_at', created_at),
+        Index('ix_parcels_status_open', status, postgresql_where=(status != 'Delivered'), sqlite_where=(status != 'Delivered')),
+        Index('ix_parcels_geohash', geohash),
+    )
 
     def __repr__(self):
         return f"<Parcel(id={self.id}, length={self.length}, width={self.width}, height={self.height}, weight={self.weight}, cost={self.cost}, tracking_number='{self.tracking_number}')>"
@@ -178,4 +201,70 @@ class BillingAddress(db.Model, SerializerMixin):
     serialize_rules = ('-user.billing_addresses',)
 
     def __repr__(self):
-        return f"<BillingAddress(id={self.id}, user_id={self.user_id}, street={self.street}, city={self.city}, state={self.state}, zip_code={self.zip_code}, country={self.country})>"
\ No newline at end of file
+        return f"<BillingAddress(id={self.id}, user_id={self.user_id}, street={self.street}, city={self.city}, state={self.state}, zip_code={self.zip_code}, country={self.country})>"
+
+class EmailOutbox(db.Model, SerializerMixin):
+    __tablename__ = 'email_outbox'
+
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True) # SQLite only autoincrements INTEGER primary keys
+    recipients = Column(Text, nullable=False) # JSON encoded list of addresses
+    subject = Column(Text, nullable=False)
+    body = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default='pending') # "pending", "sending", "sent" or "dead" once retries run out
+    attempts = Column(Integer, nullable=False, default=0)
+    last_error = Column(Text)
+    next_attempt_at = Column(DateTime(timezone=True), server_default=func.current_timestamp())
+    locked_at = Column(DateTime(timezone=True)) # Set when a worker claims the message so crashed claims can be retried
+    created_at = Column(DateTime(timezone=True), server_default=func.current_timestamp())
+    sent_at = Column(DateTime(timezone=True))
+
+    # Workers claim due messages with WHERE status = 'pending' AND next_attempt_at <= now
+    __table_args__ = (Index('ix_email_outbox_status_next_attempt_at', 'status', 'next_attempt_at'),)
+
+    def __repr__(self):
+        return f"<EmailOutbox(id={self.id}, status='{self.status}', attempts={self.attempts}, subject='{self.subject}')>"
+
+
+class ParcelEvent(db.Model, SerializerMixin):
+    __tablename__ = 'parcel_events'
+
+    # Append only, the id doubles as the cursor for the change feed
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True)
+    # No foreign keys on purpose, the log (and "deleted" events) outlive the rows it describes
+    parcel_id = Column(BigInteger, nullable=False)
+    user_id = Column(Integer, nullable=True) # Copied from the parcel so a user's feed is a single index range scan
+    event_type = Column(String(20), nullable=False) # "created", "status", "location" or "deleted"
+    status = Column(String(50))
+    previous_status = Column(String(50))
+    street = Column(Text)
+    city = Column(Text)
+    state = Column(Text)
+    zip_code = Column(String(20))
+    country = Column(String(100))
+    latitude = Column(Numeric(10, 6))
+    longitude = Column(Numeric(10, 6))
+    created_at = Column(DateTime(timezone=True), server_default=func.current_timestamp())
+
+    __table_args__ = (
+        Index('ix_parcel_events_user_id_id', 'user_id', 'id'),
+        Index('ix_parcel_events_parcel_id', 'parcel_id'),
+    )
+
+    def __repr__(self):
+        return f"<ParcelEvent(id={self.id}, parcel_id={self.parcel_id}, event_type='{self.event_type}', status='{self.status}')>"
+
+
+class ParcelStat(db.Model, SerializerMixin):
+    __tablename__ = 'parcel_stats'
+
+    # Running totals behind the admin dashboard, kept up to date by stats.py as parcels are written
+    id = Column(Integer, primary_key=True)
+    dimension = Column(String(20), nullable=False) # "total", "status", "day" (YYYY-MM-DD created, UTC) or "country"
+    key = Column(String(100), nullable=False, default='') # The status, day or destination country, '' for total/unknown
+    parcels = Column(BigInteger, nullable=False, default=0)
+    revenue = Column(Numeric(14, 2), nullable=False, default=0)
+
+    __table_args__ = (UniqueConstraint('dimension', 'key', name='uq_parcel_stats_dimension_key'),)
+
+    def __repr__(self):
+        return f"<ParcelStat(dimension='{self.dimension}', key='{self.key}', parcels={self.parcels}, revenue={self.revenue})>"
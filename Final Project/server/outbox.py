@@ -0,0 +1,209 @@
+# /server/outbox.py
+
+# Persistent email outbox.
+# Requests only insert a row (enqueue_email) and return straight away. A pool of worker threads drains the
+# outbox in batches, sending each batch over a single reused SMTP connection (mail.connect()), retrying failures
+# with exponential backoff and dead-lettering a message once it runs out of attempts.
+#
+# Run the workers next to gunicorn with:
+#   flask --app app outbox-worker --workers 2
+# To try it locally against a debug SMTP server instead of a real one:
+#   python -m aiosmtpd -n -l localhost:1025
+#   mail_server=localhost mail_port=1025 mail_use_tls=false flask --app app outbox-worker --once
+
+import json
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import click
+from flask import current_app
+from flask_mail import Message
+from sqlalchemy import select, update, or_, and_, case
+
+from config import db
+from models import EmailOutbox
+
+OUTBOX_BATCH_SIZE = 50
+OUTBOX_MAX_ATTEMPTS = 5
+OUTBOX_BACKOFF_BASE = 30 # Seconds, doubled on every failed attempt
+OUTBOX_BACKOFF_MAX = 3600
+OUTBOX_CLAIM_TIMEOUT = 600 # A message stuck in "sending" this long belongs to a worker that died, retry it
+
+
+def utcnow():
+    return datetime.now(timezone.utc)
+
+
+def enqueue_email(recipients, subject, body, commit=True):
+    if isinstance(recipients, str):
+        recipients = [recipients]
+    message = EmailOutbox(
+        recipients=json.dumps(list(recipients)),
+        subject=subject,
+        body=body,
+        status='pending',
+        attempts=0,
+        next_attempt_at=utcnow()
+    )
+    db.session.add(message)
+    if commit:
+        db.session.commit()
+    return message
+
+
+def claim_batch(batch_size=OUTBOX_BATCH_SIZE):
+    # Claimed rows are marked "sending" in their own short transaction, SKIP LOCKED lets several workers
+    # claim side by side on PostgreSQL. Other dialects ignore it, so the UPDATE checks again that each row is
+    # still claimable and only the rows it actually changed (RETURNING) are sent: two workers that picked the
+    # same rows never both get them
+    # A stale claim counts as an attempt, so a message that keeps killing its worker runs out of attempts and is
+    # dead-lettered instead of being reclaimed forever
+    now = utcnow()
+    stale = now - timedelta(seconds=OUTBOX_CLAIM_TIMEOUT)
+    reclaimed = and_(EmailOutbox.status == 'sending', EmailOutbox.locked_at < stale)
+    claimable = or_(
+        and_(EmailOutbox.status == 'pending', EmailOutbox.next_attempt_at <= now),
+        reclaimed,
+    )
+    stmt = (
+        select(EmailOutbox.id)
+        .where(claimable)
+        .order_by(EmailOutbox.id)
+        .limit(batch_size)
+        .with_for_update(skip_locked=True)
+    )
+    ids = db.session.execute(stmt).scalars().all()
+    batch = []
+    if ids:
+        batch = db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(ids), claimable)
+            .values(status='sending', locked_at=now,
+                    attempts=case((reclaimed, EmailOutbox.attempts + 1), else_=EmailOutbox.attempts))
+            .returning(EmailOutbox.id, EmailOutbox.recipients, EmailOutbox.subject, EmailOutbox.body,
+                       EmailOutbox.attempts)
+        ).all()
+    dead = [row.id for row in batch if row.attempts >= OUTBOX_MAX_ATTEMPTS] # Only reclaimed rows get this far
+    if dead:
+        db.session.execute(
+            update(EmailOutbox).where(EmailOutbox.id.in_(dead))
+            .values(status='dead', locked_at=None, last_error='The worker sending it stopped before it was sent')
+        )
+    db.session.commit()
+    if dead and len(dead) == len(batch):
+        return claim_batch(batch_size) # Those weren't worth sending, look for some that are
+    return sorted((row for row in batch if row.id not in dead), key=lambda row: row.id)
+
+
+def _backoff(attempts):
+    return timedelta(seconds=min(OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1), OUTBOX_BACKOFF_MAX))
+
+
+def _record_failure(row, error):
+    attempts = row.attempts + 1
+    values = {'attempts': attempts, 'last_error': str(error)[:1000], 'locked_at': None}
+    if attempts >= OUTBOX_MAX_ATTEMPTS:
+        values['status'] = 'dead'
+    else:
+        values.update(status='pending', next_attempt_at=utcnow() + _backoff(attempts))
+    db.session.execute(update(EmailOutbox).where(EmailOutbox.id == row.id).values(**values))
+
+
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    # Sends one batch, returns how many messages were attempted
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0
+
+    mail = current_app.extensions['mail']
+    # Same sender SendEmail has always used
+    sender = current_app.config.get('MAIL_USERNAME') or current_app.config.get('MAIL_DEFAULT_SENDER')
+    sent_ids = []
+    remaining = list(batch)
+    try:
+        with mail.connect() as connection:
+            while remaining:
+                row = remaining[0]
+                msg = Message(subject=row.subject, recipients=json.loads(row.recipients), body=row.body, sender=sender)
+                try:
+                    connection.send(msg)
+                    sent_ids.append(row.id)
+                except Exception as e:
+                    # Rejected message (bad address...), the connection itself is still usable
+                    _record_failure(row, e)
+                remaining.pop(0)
+    except Exception as e:
+        # Couldn't connect, or the connection dropped: everything not sent yet goes back with a backoff
+        for row in remaining:
+            _record_failure(row, e)
+
+    if sent_ids:
+        db.session.execute(
+            update(EmailOutbox)
+            .where(EmailOutbox.id.in_(sent_ids))
+            .values(status='sent', sent_at=utcnow(), locked_at=None)
+        )
+    db.session.commit()
+    return len(batch)
+
+
+class OutboxWorkerPool:
+    def __init__(self, app, workers=2, poll_interval=2.0, batch_size=OUTBOX_BATCH_SIZE):
+        self.app = app
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _run(self):
+        while not self._stop.is_set():
+            with self.app.app_context():
+                try:
+                    attempted = drain_outbox(self.batch_size)
+                except Exception:
+                    self.app.logger.exception("Outbox worker failed to drain a batch")
+                    db.session.rollback()
+                    attempted = 0
+                finally:
+                    db.session.remove()
+            if not attempted:
+                self._stop.wait(self.poll_interval)
+
+    def start(self):
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'outbox-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+
+def init_outbox(app):
+    @app.cli.command('outbox-worker')
+    @click.option('--workers', default=2, help='Number of worker threads')
+    @click.option('--poll-interval', default=2.0, help='Seconds to wait when the outbox is empty')
+    @click.option('--once', is_flag=True, help='Drain whatever is due and exit')
+    def outbox_worker(workers, poll_interval, once):
+        if once:
+            total = 0
+            while True:
+                attempted = drain_outbox()
+                if not attempted:
+                    break
+                total += attempted
+            click.echo(f"Attempted {total} messages")
+            return
+
+        pool = OutboxWorkerPool(app, workers=workers, poll_interval=poll_interval)
+        pool.start()
+        click.echo(f"Outbox worker pool started with {workers} workers")
+        try:
+            while True:
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pool.stop()
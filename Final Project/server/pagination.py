@@ -0,0 +1,181 @@
+# /server/pagination.py
+
+# Keyset (cursor) pagination and NDJSON streaming for the collection endpoints.
+# Pages are ordered on the primary key (or on ?sort= columns with the id as tie breaker) so a cursor stays
+# stable while rows are being inserted, and we never use OFFSET which gets slower the deeper a client pages.
+
+import base64
+import json
+from datetime import datetime
+from decimal import Decimal
+from urllib.parse import urlencode
+
+from flask import request, Response, stream_with_context, make_response, jsonify
+from sqlalchemy import select, and_, or_, false, func, DateTime
+
+from config import db
+from serializers import dumps, json_response
+from listing import QueryArgsError, parse_value
+
+DEFAULT_PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+STREAM_BATCH_SIZE = 500 # Rows fetched from the server side cursor per round trip when streaming
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+
+def wants_ndjson():
+    # Streaming is opt-in, either ?format=ndjson or an Accept header asking for NDJSON
+    if request.args.get('format') == 'ndjson':
+        return True
+    return request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def parse_page_args():
+    after_id = request.args.get('after_id', type=int)
+    limit = request.args.get('limit', DEFAULT_PAGE_LIMIT, type=int)
+    limit = max(1, min(limit, MAX_PAGE_LIMIT))
+    return after_id, limit
+
+
+# Cursors for ?sort= orders: the sort values of the last row plus its id, as url safe base64 JSON.
+# The default id order keeps using the plain ?after_id= cursor.
+
+def encode_cursor(values):
+    plain = [value.isoformat() if isinstance(value, datetime) else str(value) if isinstance(value, Decimal) else value
+             for value in values]
+    return base64.urlsafe_b64encode(dumps(plain, pretty=False)).decode().rstrip('=')
+
+
+def decode_cursor(token, columns):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+    except ValueError:
+        raise QueryArgsError("Invalid cursor")
+    if not isinstance(values, list) or len(values) != len(columns):
+        raise QueryArgsError("Cursor doesn't match the sort order")
+    return [value if value is None else parse_value(column, str(value)) for column, value in zip(columns, values)]
+
+
+def _comparable(column, value):
+    # SQLite keeps timestamps as text in more than one format, compare them as numbers there
+    if isinstance(column.type, DateTime) and db.session.get_bind().dialect.name == 'sqlite':
+        return func.julianday(column), func.julianday(value) if value is not None else None
+    return column, value
+
+
+def _nulls_high():
+    # PostgreSQL sorts NULLs as larger than any value (last ascending, first descending), SQLite as smaller.
+    # Keeping the database's own NULL order lets a plain btree index serve both directions
+    return db.session.get_bind().dialect.name != 'sqlite'
+
+
+def _after(column, descending, value):
+    # Rows that come after `value` in this column's order
+    nulls_after = _nulls_high() != descending # NULLs sort after every value in this direction
+    if value is None:
+        return column.is_not(None) if not nulls_after else false()
+    column, value = _comparable(column, value)
+    after = column < value if descending else column > value
+    return or_(after, column.is_(None)) if nulls_after else after
+
+
+def _equal(column, value):
+    if value is None:
+        return column.is_(None)
+    column, value = _comparable(column, value)
+    return column == value
+
+
+def keyset_statement(model, after_id=None, stmt=None, sort=None, cursor=None):
+    if stmt is None:
+        stmt = select(model)
+    if not sort:
+        if after_id is not None:
+            stmt = stmt.where(model.id > after_id)
+        return stmt.order_by(model.id)
+
+    # The id is appended as a tie breaker so every row has a unique position
+    keys = list(sort) + [(model.id, sort[-1][1])]
+    if cursor is not None:
+        # (a after x) or (a = x and b after y) or ...
+        clauses = []
+        for index, (column, descending) in enumerate(keys):
+            equal = [_equal(previous, cursor[position]) for position, (previous, _) in enumerate(keys[:index])]
+            clauses.append(and_(*equal, _after(column, descending, cursor[index])))
+        stmt = stmt.where(or_(*clauses))
+    return stmt.order_by(*[column.desc() if descending else column.asc() for column, descending in keys])
+
+
+def _next_url(**cursor):
+    args = request.args.to_dict()
+    args.pop('after_id', None)
+    args.pop('cursor', None)
+    args.update(cursor)
+    return request.base_url + '?' + urlencode(args)
+
+
+def paginated_response(model, serialize=None, stmt=None, collection=None):
+    # Single entry point used by the list endpoints: streams when asked to, pages otherwise.
+    # collection is the endpoint's CollectionSpec for ?status=&sort=&fields=&include= (see listing.py)
+    serialize = serialize or (lambda row: row.to_dict())
+    try:
+        listing = collection.parse(request.args) if collection else None
+        sort = listing.sort if listing else None
+        columns = [column for column, _ in sort] + [model.id] if sort else None
+        cursor = decode_cursor(request.args['cursor'], columns) if sort and request.args.get('cursor') else None
+    except QueryArgsError as e:
+        return make_response(jsonify({"message": str(e)}), 400)
+    if listing:
+        stmt = listing.statement(stmt)
+        serialize = listing.serializer(serialize)
+
+    if wants_ndjson():
+        return ndjson_response(model, serialize, stmt, listing, cursor)
+
+    after_id, limit = parse_page_args()
+    # Fetch one extra row so we know whether there is a next page without running a COUNT(*)
+    result = db.session.execute(keyset_statement(model, after_id, stmt, sort, cursor).limit(limit + 1))
+    rows = result.all() if listing and listing.projected else result.scalars().all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    if listing:
+        listing.prepare(rows)
+
+    response = json_response([serialize(row) for row in rows], 200)
+    if has_more:
+        last = rows[-1]
+        if sort:
+            next_cursor = encode_cursor([getattr(last, column.key) for column in columns])
+            response.headers['X-Next-Cursor'] = next_cursor
+            next_url = _next_url(cursor=next_cursor, limit=limit)
+        else:
+            response.headers['X-Next-After-Id'] = str(last.id)
+            next_url = _next_url(after_id=last.id, limit=limit)
+        response.headers['Link'] = f'<{next_url}>; rel="next"'
+    return response
+
+
+def ndjson_response(model, serialize=None, stmt=None, listing=None, cursor=None):
+    serialize = serialize or (lambda row: row.to_dict())
+    after_id = request.args.get('after_id', type=int)
+    sort = listing.sort if listing else None
+    # yield_per makes the ORM use a server side cursor and only hydrate a batch of rows at a time
+    statement = keyset_statement(model, after_id, stmt, sort, cursor).execution_options(yield_per=STREAM_BATCH_SIZE)
+    # Unbounded by default, it's an export, but ?limit= still stops after that many rows. Not capped at
+    # MAX_PAGE_LIMIT since nothing is buffered
+    limit = request.args.get('limit', type=int)
+    if limit is not None:
+        statement = statement.limit(max(limit, 1))
+
+    def generate():
+        result = db.session.execute(statement)
+        if not (listing and listing.projected):
+            result = result.scalars()
+        for batch in result.partitions():
+            if listing:
+                listing.prepare(batch)
+            for row in batch:
+                yield dumps(serialize(row), pretty=False) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
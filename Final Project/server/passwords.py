@@ -0,0 +1,138 @@
+# /server/passwords.py
+
+# Password hashing with the algorithm and cost from config, run in a small bounded pool.
+#   PASSWORD_HASH_METHOD   werkzeug method, e.g. scrypt:32768:8:1 (the default) or pbkdf2:sha256:600000
+#   PASSWORD_HASH_POOL     "thread" (default) or "process"
+#   PASSWORD_HASH_WORKERS  threads/processes per app worker, 0 hashes on the request thread
+#   PASSWORD_HASH_PENDING  hashes allowed in flight per app worker, more answer 503 with Retry-After
+#   PASSWORD_HASH_TIMEOUT  seconds to wait for a result
+# A login storm then queues on a fixed number of hashers instead of spreading over every request thread, and
+# once the queue is full new logins are turned away quickly instead of making everyone else wait.
+# hashlib's scrypt and pbkdf2 release the GIL, so threads already hash on every core. The process pool is there
+# for methods that don't; its processes are spawned, which re-imports __main__, so only use it from entry points
+# that guard their top level (gunicorn, flask run).
+# Hashes made with older settings still verify and are replaced on the next successful login (verify_password).
+#
+# Only the standard library, werkzeug and flask are imported here, the pool's processes import this module.
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+from functools import lru_cache
+
+from flask import current_app
+from werkzeug.exceptions import ServiceUnavailable
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class PasswordHashingBusy(ServiceUnavailable):
+    description = "Too many sign ins right now, try again shortly"
+
+
+def _method_of(stored_hash):
+    return stored_hash.split('$', 1)[0]
+
+
+@lru_cache(maxsize=8)
+def normalized_method(method):
+    # "scrypt" -> "scrypt:32768:8:1", the form werkzeug writes into the hash, so stored hashes can be compared
+    return _method_of(generate_password_hash('x', method=method, salt_length=1))
+
+
+def _verify(stored_hash, password, method):
+    # Runs in the pool: checks the password and, when the hash was made with other settings, makes a new one
+    if not check_password_hash(stored_hash, password):
+        return False, None
+    if _method_of(stored_hash) != method:
+        return True, generate_password_hash(password, method=method)
+    return True, None
+
+
+class HashingPool:
+    def __init__(self, workers, pending, timeout, kind='thread'):
+        self.kind = kind
+        self.workers = workers
+        self.timeout = timeout
+        self.slots = threading.BoundedSemaphore(pending)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Made on first use in each process, so gunicorn workers forked after import get their own
+        with self._lock:
+            if self._executor is None or self._pid != os.getpid():
+                if self.kind == 'process':
+                    # spawn, not fork: forking a threaded worker with open database connections isn't safe
+                    context = multiprocessing.get_context('spawn')
+                    self._executor = ProcessPoolExecutor(self.workers, mp_context=context)
+                else:
+                    self._executor = ThreadPoolExecutor(self.workers, thread_name_prefix='password-hash')
+                self._pid = os.getpid()
+            return self._executor
+
+    def _release(self, future):
+        self.slots.release()
+
+    def _submit(self, function, *args):
+        # The pending slot is given back when the hash finishes, not when the caller stops waiting for it: a hash
+        # that timed out still keeps a hasher busy, and new ones would only queue up behind it
+        if not self.slots.acquire(blocking=False):
+            raise PasswordHashingBusy(retry_after=1)
+        try:
+            future = self._get_executor().submit(function, *args)
+        except BaseException:
+            self.slots.release()
+            raise
+        future.add_done_callback(self._release)
+        return future
+
+    def run(self, function, *args):
+        try:
+            try:
+                return self._submit(function, *args).result(timeout=self.timeout)
+            except BrokenProcessPool:
+                # A pool process died (OOM killer), start a new pool and try once more
+                with self._lock:
+                    self._executor = None
+                return self._submit(function, *args).result(timeout=self.timeout)
+        except FutureTimeout:
+            raise PasswordHashingBusy(retry_after=1)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+
+def _settings():
+    config = current_app.config
+    return normalized_method(config['PASSWORD_HASH_METHOD']), current_app.extensions.get('password_pool')
+
+
+def hash_password(password):
+    method, pool = _settings()
+    if pool is None:
+        return generate_password_hash(password, method=method)
+    return pool.run(generate_password_hash, password, method)
+
+
+def verify_password(stored_hash, password):
+    # Returns (matches, new hash or None). A new hash means the stored one is outdated and should be saved
+    method, pool = _settings()
+    if not stored_hash:
+        return False, None
+    if pool is None:
+        return _verify(stored_hash, password, method)
+    return pool.run(_verify, stored_hash, password, method)
+
+
+def init_passwords(app):
+    workers = app.config['PASSWORD_HASH_WORKERS']
+    if workers:
+        pending = app.config['PASSWORD_HASH_PENDING'] or workers * 4
+        app.extensions['password_pool'] = HashingPool(workers, pending, app.config['PASSWORD_HASH_TIMEOUT'],
+                                                      app.config['PASSWORD_HASH_POOL'])
@@ -0,0 +1,69 @@
+# /server/policy.py
+
+# Route policies for the auth gate.
+# Every endpoint registered on the app is tagged public, authenticated or admin once at startup, so the gate is
+# a single dict lookup on request.endpoint. Endpoints nobody tagged default to authenticated, so a new resource
+# can't end up public by accident.
+
+from flask import request, make_response, jsonify
+
+from principal import current_principal
+
+PUBLIC = 'public'
+AUTHENTICATED = 'authenticated'
+ADMIN = 'admin'
+
+# Endpoints that differ from the default. Anything whose endpoint starts with "admin" is admin only
+ROUTE_POLICIES = {
+    'home': PUBLIC,
+    'serve': PUBLIC, # The React app and its assets
+    'signup': PUBLIC,
+    'login': PUBLIC,
+    'logout': PUBLIC,
+    'check_session': PUBLIC, # Answers 204 itself when nobody is logged in
+    'track': PUBLIC,
+    'health_db': PUBLIC,
+    'metrics': PUBLIC, # Guarded by METRICS_TOKEN instead of a session, admin only when there is no token
+    'parcelsnearby': ADMIN, # Dispatch, sees every user's parcels
+}
+
+_policies = {}
+
+
+def build_route_policies(app):
+    policies = {}
+    for endpoint in app.view_functions:
+        if endpoint in ROUTE_POLICIES:
+            policies[endpoint] = ROUTE_POLICIES[endpoint]
+        elif endpoint.startswith('admin'):
+            policies[endpoint] = ADMIN
+        else:
+            policies[endpoint] = AUTHENTICATED
+    if 'metrics' in policies and not app.config.get('METRICS_TOKEN'):
+        policies['metrics'] = ADMIN # Per endpoint latencies and query counts aren't for everyone
+    return policies
+
+
+def route_policy(endpoint):
+    return _policies.get(endpoint)
+
+
+def init_route_policies(app):
+    # Call after every resource is registered
+    _policies.clear()
+    _policies.update(build_route_policies(app))
+
+    @app.before_request
+    def check_route_policy():
+        if request.method == 'OPTIONS': # CORS preflights never carry the session cookie
+            return
+        policy = _policies.get(request.endpoint)
+        if policy is None:
+            return make_response(jsonify({"message": "Invalid endpoint"}), 404)
+        if policy == PUBLIC:
+            return
+        principal = current_principal()
+        if not principal:
+            return make_response(jsonify({"message": "Unauthorized access"}), 401)
+        if policy == ADMIN and not principal.is_admin:
+            return make_response(jsonify({"message": "Admin access required"}), 403)
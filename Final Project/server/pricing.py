@@ -0,0 +1,177 @@
+# /server/pricing.py
+
+# Server side quote engine, replacing the client side `distance * 0.05` in GetQuote.js.
+# cost = base fee + great-circle km * rate per km + chargeable weight * rate per weight unit,
+# where the chargeable weight is the larger of the actual weight and the dimensional weight (L x W x H / divisor).
+#
+# Single quotes and batches price through the same function, so a quote costs the same either way. The exact
+# haversine distance is memoized in a bounded cache keyed on the coordinates as stored (6 decimals), which is
+# what makes repeated routes cheap.
+
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from math import isfinite
+
+from sqlalchemy import select
+
+from config import app, db
+from models import User, Recipient, BillingAddress
+from geo import haversine_km
+
+COORDINATE_DECIMALS = 6 # Same as the Numeric(10, 6) columns, ~0.1m
+
+
+class QuoteError(ValueError):
+    pass
+
+
+def rates():
+    return (
+        app.config['QUOTE_BASE_FEE'],
+        app.config['QUOTE_RATE_PER_KM'],
+        app.config['QUOTE_RATE_PER_WEIGHT'],
+        app.config['QUOTE_DIM_DIVISOR'],
+    )
+
+
+@lru_cache(maxsize=app.config['QUOTE_DISTANCE_CACHE_SIZE'])
+def _distance_km(point_a, point_b):
+    return haversine_km(*point_a, *point_b)
+
+
+def distance_km(lat1, lon1, lat2, lon2):
+    point_a = (round(float(lat1), COORDINATE_DECIMALS), round(float(lon1), COORDINATE_DECIMALS))
+    point_b = (round(float(lat2), COORDINATE_DECIMALS), round(float(lon2), COORDINATE_DECIMALS))
+    if point_b < point_a: # Distance is symmetric, halve the number of cache entries
+        point_a, point_b = point_b, point_a
+    return _distance_km(point_a, point_b)
+
+
+def _money(value):
+    return str(Decimal(repr(value)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP))
+
+
+def _number(item, key):
+    try:
+        value = float(item[key])
+    except KeyError:
+        raise QuoteError(f"Missing required field '{key}'")
+    except (TypeError, ValueError):
+        raise QuoteError(f"'{key}' must be a number")
+    if not isfinite(value) or value < 0:
+        raise QuoteError(f"'{key}' must be a positive number")
+    return value
+
+
+def _is_id(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _id(item, key):
+    if not _is_id(item[key]):
+        raise QuoteError(f"'{key}' must be an integer id")
+    return item[key]
+
+
+def _point(value, name):
+    if value is None or value[0] is None or value[1] is None:
+        raise QuoteError(f"No coordinates for the {name}")
+    try:
+        latitude, longitude = float(value[0]), float(value[1])
+    except (TypeError, ValueError):
+        raise QuoteError(f"The {name}'s coordinates must be numbers")
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        raise QuoteError(f"The {name}'s coordinates are out of range")
+    return latitude, longitude
+
+
+def price(distance_km, length, width, height, weight):
+    base_fee, rate_per_km, rate_per_weight, dim_divisor = rates()
+    dimensional_weight = length * width * height / dim_divisor
+    chargeable_weight = max(weight, dimensional_weight)
+    cost = base_fee + distance_km * rate_per_km + chargeable_weight * rate_per_weight
+    return {
+        "distance_km": round(distance_km, 2),
+        "dimensional_weight": round(dimensional_weight, 2),
+        "chargeable_weight": round(chargeable_weight, 2),
+        "cost": _money(cost),
+    }
+
+
+class CoordinateResolver:
+    # Looks up the stored coordinates quotes refer to by id, one IN query per kind for a whole batch
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self._user = None
+        self._recipients = {}
+        self._billing_addresses = {}
+
+    def prefetch(self, items):
+        # Ids that aren't ints are left to _parse to report, they can't go in a set (a list is unhashable)
+        recipient_ids = {item['recipient_id'] for item in items if isinstance(item, dict) and _is_id(item.get('recipient_id'))}
+        billing_ids = {item['billing_address_id'] for item in items if isinstance(item, dict) and _is_id(item.get('billing_address_id'))}
+        if recipient_ids:
+            stmt = select(Recipient.id, Recipient.latitude, Recipient.longitude).where(Recipient.id.in_(recipient_ids))
+            self._recipients = {row.id: (row.latitude, row.longitude) for row in db.session.execute(stmt)}
+        if billing_ids:
+            # Only the caller's own billing addresses can be used as an origin
+            stmt = select(BillingAddress.id, BillingAddress.latitude, BillingAddress.longitude).where(
+                BillingAddress.id.in_(billing_ids), BillingAddress.user_id == self.user_id)
+            self._billing_addresses = {row.id: (row.latitude, row.longitude) for row in db.session.execute(stmt)}
+
+    def user(self):
+        if self._user is None:
+            row = db.session.execute(select(User.latitude, User.longitude).where(User.id == self.user_id)).first()
+            self._user = tuple(row) if row else (None, None)
+        return self._user
+
+    def origin(self, item):
+        if isinstance(item.get('origin'), dict):
+            return _point((item['origin'].get('latitude'), item['origin'].get('longitude')), 'origin')
+        if item.get('billing_address_id') is not None:
+            billing_id = _id(item, 'billing_address_id')
+            if billing_id not in self._billing_addresses:
+                self.prefetch([item])
+            return _point(self._billing_addresses.get(billing_id), 'origin')
+        return _point(self.user(), 'origin')
+
+    def destination(self, item):
+        if isinstance(item.get('destination'), dict):
+            return _point((item['destination'].get('latitude'), item['destination'].get('longitude')), 'destination')
+        if item.get('recipient_id') is not None:
+            recipient_id = _id(item, 'recipient_id')
+            if recipient_id not in self._recipients:
+                self.prefetch([item])
+            return _point(self._recipients.get(recipient_id), 'destination')
+        raise QuoteError("A quote needs a destination or a recipient_id")
+
+
+def _parse(item, resolver):
+    if not isinstance(item, dict):
+        raise QuoteError("Each quote must be a JSON object")
+    origin = resolver.origin(item)
+    destination = resolver.destination(item)
+    dimensions = tuple(_number(item, key) for key in ('length', 'width', 'height', 'weight'))
+    return origin, destination, dimensions
+
+
+def quote(item, user_id):
+    resolver = CoordinateResolver(user_id)
+    (lat1, lon1), (lat2, lon2), dimensions = _parse(item, resolver)
+    return price(distance_km(lat1, lon1, lat2, lon2), *dimensions)
+
+
+def quote_batch(items, user_id):
+    resolver = CoordinateResolver(user_id)
+    resolver.prefetch(items)
+
+    results = []
+    for position, item in enumerate(items):
+        try:
+            (lat1, lon1), (lat2, lon2), dimensions = _parse(item, resolver)
+        except QuoteError as e:
+            results.append({"index": position, "error": str(e)})
+            continue
+        results.append(dict(price(distance_km(lat1, lon1, lat2, lon2), *dimensions), index=position))
+    return results
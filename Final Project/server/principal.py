@@ -0,0 +1,100 @@
+# /server/principal.py
+
+# The logged in user for the current request.
+# Loaded once per request (roles eagerly fetched) and kept as a plain snapshot in a TTL/LRU cache keyed by
+# user id, so a logged in request normally costs no identity queries at all.
+# Anything that changes a user or their roles must call invalidate_principal()/clear_principals().
+
+from flask import g, session
+from sqlalchemy.orm import selectinload
+
+from config import app, db
+from models import User, Role
+from cache import TTLCache
+
+_principals = TTLCache(maxsize=app.config['PRINCIPAL_CACHE_SIZE'], ttl=app.config['PRINCIPAL_CACHE_TTL'])
+_admin_role_ids = TTLCache(maxsize=1, ttl=app.config['PRINCIPAL_CACHE_TTL'])
+
+
+def admin_role_ids():
+    # Ids of the roles that grant admin access, so the gate compares ids instead of walking Role objects
+    role_ids = _admin_role_ids.get('admin')
+    if role_ids is None:
+        role_ids = frozenset(db.session.execute(db.select(Role.id).where(Role.name == 'admin')).scalars())
+        _admin_role_ids.set('admin', role_ids)
+    return role_ids
+
+
+class Principal:
+    __slots__ = ('id', 'email', 'first_name', 'last_name', 'role_ids', 'role_names')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.email = user.email
+        self.first_name = user.first_name
+        self.last_name = user.last_name
+        self.role_ids = frozenset(role.id for role in user.roles)
+        self.role_names = frozenset(role.name for role in user.roles)
+
+    @property
+    def is_admin(self):
+        return not self.role_ids.isdisjoint(admin_role_ids())
+
+    def has_role(self, name):
+        return name in self.role_names
+
+    def to_dict(self):
+        # Same shape Login and CheckSession have always returned
+        roles = sorted(self.role_names)
+        return {
+            "id": self.id,
+            "email": self.email,
+            "first_name": self.first_name,
+            "last_name": self.last_name,
+            "roles": roles,
+            "isAdmin": 'admin' in roles,
+            "isUser": 'user' in roles
+        }
+
+    def __repr__(self):
+        return f"<Principal(id={self.id}, email='{self.email}', roles={sorted(self.role_names)})>"
+
+
+def load_principal(user_id):
+    principal = _principals.get(user_id)
+    if principal is None:
+        user = db.session.execute(
+            db.select(User).options(selectinload(User.roles)).where(User.id == user_id)
+        ).scalar_one_or_none()
+        if user is None:
+            return None
+        principal = Principal(user)
+        _principals.set(user_id, principal)
+    return principal
+
+
+def remember_principal(user):
+    # Login/Signup already have the user and their roles in hand, no need to query again later
+    principal = Principal(user)
+    _principals.set(user.id, principal)
+    return principal
+
+
+def current_principal():
+    if 'principal' not in g:
+        user_id = session.get('user_id')
+        g.principal = load_principal(int(user_id)) if user_id else None
+    return g.principal
+
+
+def invalidate_principal(user_id):
+    _principals.pop(user_id)
+    if g.get('principal') is not None and g.principal.id == user_id:
+        g.pop('principal')
+
+
+def clear_principals():
+    # Role renames/deletes touch every user holding the role
+    _principals.clear()
+    _admin_role_ids.clear()
+    g.pop('principal', None)
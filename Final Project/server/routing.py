@@ -0,0 +1,169 @@
+# /server/routing.py
+
+# Delivery route planner. Stops are split into vehicle loads by a sweep around the depot: sorted by their
+# bearing from the depot, starting after the widest empty gap, and cut into a new load whenever the next stop
+# would go over the vehicle's weight, volume or stop limit. Neighbouring bearings end up in the same load, so
+# each vehicle covers one slice of the map.
+# Every load is then ordered as a round trip from the depot: nearest neighbour first, improved with 2-opt
+# (reversing a stretch of the route whenever that makes it shorter) over the load's haversine distance matrix.
+# Loads are independent, so they can be solved in a process pool (workers=N).
+#
+# Only the standard library, geo.py and optionally NumPy are imported here, the pool's processes import this
+# module. Loading parcels, the admin endpoint and the CLI live in dispatch.py.
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from math import atan2, cos, radians, pi
+
+from geo import haversine_km, EARTH_RADIUS_KM
+
+try:
+    import numpy as np
+except ImportError: # Distance matrices are then filled one pair at a time
+    np = None
+
+MAX_TWO_OPT_PASSES = 50
+
+
+class Stop:
+    __slots__ = ('id', 'latitude', 'longitude', 'weight', 'volume')
+
+    def __init__(self, id, latitude, longitude, weight=0.0, volume=0.0):
+        self.id = id
+        self.latitude = float(latitude)
+        self.longitude = float(longitude)
+        self.weight = float(weight or 0)
+        self.volume = float(volume or 0)
+
+
+def _bearing(depot, stop):
+    # Angle of the stop around the depot on a local flat projection, good enough to order stops by direction
+    east = ((stop.longitude - depot[1] + 540) % 360 - 180) * cos(radians(depot[0]))
+    return atan2(stop.latitude - depot[0], east)
+
+
+def sweep_loads(depot, stops, max_weight, max_volume, max_stops):
+    # [[stop, ...], ...] vehicle loads. A stop over the limits on its own still gets a vehicle of its own
+    if not stops:
+        return []
+    ordered = sorted(stops, key=lambda stop: (_bearing(depot, stop), stop.id))
+    bearings = [_bearing(depot, stop) for stop in ordered]
+    count = len(ordered)
+    gaps = [(bearings[(index + 1) % count] - bearings[index]) % (2 * pi) for index in range(count)]
+    start = (max(range(count), key=gaps.__getitem__) + 1) % count if count > 1 else 0
+    ordered = ordered[start:] + ordered[:start]
+
+    loads, load, weight, volume = [], [], 0.0, 0.0
+    for stop in ordered:
+        if load and (len(load) >= max_stops or weight + stop.weight > max_weight or volume + stop.volume > max_volume):
+            loads.append(load)
+            load, weight, volume = [], 0.0, 0.0
+        load.append(stop)
+        weight += stop.weight
+        volume += stop.volume
+    loads.append(load)
+    return loads
+
+
+def distance_matrix(points):
+    # Haversine km between every pair of (latitude, longitude) points, as a list of rows
+    if np is not None:
+        latitudes, longitudes = np.radians(np.array(points, dtype=np.float64)).T
+        a = (np.sin((latitudes[:, None] - latitudes[None, :]) / 2) ** 2 + np.cos(latitudes[:, None])
+             * np.cos(latitudes[None, :]) * np.sin((longitudes[:, None] - longitudes[None, :]) / 2) ** 2)
+        return (2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))).tolist()
+    count = len(points)
+    matrix = [[0.0] * count for _ in range(count)]
+    for i in range(count):
+        for j in range(i + 1, count):
+            matrix[i][j] = matrix[j][i] = haversine_km(*points[i], *points[j])
+    return matrix
+
+
+def nearest_neighbour(matrix):
+    # Round trip from point 0 (the depot) always driving to the closest stop not yet visited
+    route, unvisited = [0], set(range(1, len(matrix)))
+    while unvisited:
+        row = matrix[route[-1]]
+        closest = min(unvisited, key=row.__getitem__)
+        unvisited.remove(closest)
+        route.append(closest)
+    route.append(0)
+    return route
+
+
+def two_opt(route, matrix, max_passes=MAX_TWO_OPT_PASSES):
+    # Reverses route[i:j + 1] whenever joining a-c and b-e is shorter than a-b and c-e. The depot stays at both ends
+    last = len(route) - 1
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, last - 1):
+            a, b = route[i - 1], route[i]
+            row_a, row_b = matrix[a], matrix[b]
+            current = row_a[b]
+            for j in range(i + 1, last):
+                c, e = route[j], route[j + 1]
+                if row_a[c] + row_b[e] < current + matrix[c][e] - 1e-9:
+                    route[i:j + 1] = route[i:j + 1][::-1]
+                    b = route[i]
+                    row_b = matrix[b]
+                    current = row_a[b]
+                    improved = True
+        if not improved:
+            break
+    return route
+
+
+def route_length(route, matrix):
+    return sum(matrix[route[index]][route[index + 1]] for index in range(len(route) - 1))
+
+
+def solve_load(depot, load, improve=True):
+    # Runs in the pool. load is [(id, latitude, longitude)], returns ([(id, km from the previous stop)], total km,
+    # nearest neighbour km)
+    matrix = distance_matrix([depot] + [(latitude, longitude) for _, latitude, longitude in load])
+    route = nearest_neighbour(matrix)
+    first_km = route_length(route, matrix)
+    if improve and len(route) > 4:
+        route = two_opt(route, matrix)
+    legs = [(load[route[index] - 1][0], matrix[route[index - 1]][route[index]]) for index in range(1, len(route) - 1)]
+    return legs, route_length(route, matrix), first_km
+
+
+def _solve_loads(arguments):
+    return [solve_load(*item) for item in arguments]
+
+
+def plan_routes(depot, stops, max_weight, max_volume, max_stops, workers=0, improve=True):
+    depot = (float(depot[0]), float(depot[1]))
+    loads = sweep_loads(depot, stops, max_weight, max_volume, max_stops)
+    items = [(depot, [(stop.id, stop.latitude, stop.longitude) for stop in load], improve) for load in loads]
+    if workers and len(items) > 1:
+        # A few big tasks per process instead of one per load, the loads are small
+        size = max(1, len(items) // (workers * 4))
+        chunks = [items[index:index + size] for index in range(0, len(items), size)]
+        # spawn, not fork: the caller may be a threaded web worker with open database connections
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+            solved = [result for chunk in executor.map(_solve_loads, chunks) for result in chunk]
+    else:
+        solved = _solve_loads(items)
+
+    routes = []
+    for number, (load, (legs, distance, first_distance)) in enumerate(zip(loads, solved), start=1):
+        weight, volume = sum(stop.weight for stop in load), sum(stop.volume for stop in load)
+        routes.append({
+            "vehicle": number,
+            "stops": [{"parcel_id": id, "leg_km": round(leg, 3)} for id, leg in legs],
+            "distance_km": round(distance, 3),
+            "nearest_neighbour_km": round(first_distance, 3),
+            "weight": round(weight, 2),
+            "volume": round(volume, 2),
+            "over_capacity": weight > max_weight or volume > max_volume,
+        })
+    return {
+        "depot": {"lat": depot[0], "lng": depot[1]},
+        "vehicles": len(routes),
+        "stops": sum(len(route["stops"]) for route in routes),
+        "distance_km": round(sum(route["distance_km"] for route in routes), 3),
+        "routes": routes,
+    }
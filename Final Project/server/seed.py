@@ -1,95 +1,355 @@
-# Made changes to schema so not entirely applicable anymore
-# TO DO: Update seed to reflect schema changes
-'''#!/usr/bin/env python3
+#!/usr/bin/env python3
+# /server/seed.py
 
-# Standard library imports
-from random import randint, choice as rc
+# Synthetic data generator for load tests and query plan work:
+#   flask --app app seed --users 100k --recipients 300k --parcels 5M
+# Rows are generated from a seeded random.Random, so the same arguments give the same data (relative to today),
+# and written with COPY on PostgreSQL or executemany on SQLite in chunks with a commit per chunk. Ids are assigned
+# here and continue after the current maximum, so seeding twice appends instead of colliding.
+#
+# Every recipient is an entry in one user's address book (addressbook.py), that user sends all its parcels.
+# Distributions: senders and recipients are skewed (a few users send most parcels), countries and cities are
+# weighted towards Kenya, parcels are envelopes, small, large or oversize boxes with matching weights, creation
+# times get denser towards today and the status follows the parcel's age, so older parcels are mostly delivered.
+# Costs come from the quote pricing (pricing.py) over the straight line distance. parcel_stats is reconciled at
+# the end, parcel_events aren't generated (the changes feed starts from the newest event anyway).
 
-# Remote library imports
-from faker import Faker
+import csv
+import io
+import math
+import random
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import click
+from sqlalchemy import select, func, text
+
+from config import db
+from models import Role, User, Recipient, Parcel, BillingAddress
+from geo import haversine_km, geohash_encode, GEOHASH_PRECISION
+from addressbook import recipient_fingerprint
+from pricing import price
+from passwords import hash_password
+from stats import reconcile_stats
+
+SEED_CHUNK_SIZE = 10000
+
+# country -> (weight, dialling code, [(city, state, latitude, longitude)])
+COUNTRIES = {
+    'Kenya': (40, '+254', [('Nairobi', 'Nairobi', -1.2864, 36.8172), ('Mombasa', 'Mombasa', -4.0435, 39.6682),
+                           ('Kisumu', 'Kisumu', -0.0917, 34.7680), ('Nakuru', 'Nakuru', -0.3031, 36.0800),
+                           ('Eldoret', 'Uasin Gishu', 0.5143, 35.2698)]),
+    'Uganda': (14, '+256', [('Kampala', 'Central', 0.3476, 32.5825), ('Entebbe', 'Central', 0.0512, 32.4637),
+                            ('Gulu', 'Northern', 2.7724, 32.2881)]),
+    'Tanzania': (14, '+255', [('Dar es Salaam', 'Dar es Salaam', -6.7924, 39.2083), ('Arusha', 'Arusha', -3.3869, 36.6830),
+                              ('Mwanza', 'Mwanza', -2.5164, 32.9175)]),
+    'Rwanda': (8, '+250', [('Kigali', 'Kigali', -1.9441, 30.0619), ('Butare', 'Southern', -2.5967, 29.7394)]),
+    'Ethiopia': (8, '+251', [('Addis Ababa', 'Addis Ababa', 9.0320, 38.7469), ('Dire Dawa', 'Dire Dawa', 9.6009, 41.8501)]),
+    'Nigeria': (7, '+234', [('Lagos', 'Lagos', 6.5244, 3.3792), ('Abuja', 'FCT', 9.0765, 7.3986)]),
+    'South Africa': (5, '+27', [('Johannesburg', 'Gauteng', -26.2041, 28.0473), ('Cape Town', 'Western Cape', -33.9249, 18.4241)]),
+    'Ghana': (4, '+233', [('Accra', 'Greater Accra', 5.6037, -0.1870), ('Kumasi', 'Ashanti', 6.6885, -1.6244)]),
+}
+FIRST_NAMES = ['Amina', 'Brian', 'Caroline', 'David', 'Esther', 'Faith', 'George', 'Halima', 'Ian', 'Joy', 'Kevin',
+               'Lucy', 'Moses', 'Naliaka', 'Otieno', 'Peter', 'Grace', 'Samuel', 'Wanjiru', 'Yusuf', 'Zawadi', 'Achieng']
+LAST_NAMES = ['Otieno', 'Wanjiku', 'Mwangi', 'Kamau', 'Ochieng', 'Njoroge', 'Mutua', 'Kiprop', 'Abdi', 'Nakato',
+              'Mensah', 'Okafor', 'Tesfaye', 'Uwimana', 'Moyo', 'Juma', 'Akinyi', 'Chebet', 'Kariuki', 'Omondi']
+STREETS = ['Moi Avenue', 'Kenyatta Avenue', 'Ngong Road', 'Mombasa Road', 'Uhuru Highway', 'Waiyaki Way',
+           'Station Road', 'Market Street', 'Church Road', 'Hospital Road', 'Airport Road', 'Lake View Drive']
+
+# (weight, (length range), (width range), (height range), (log-normal mu, sigma) of the weight, (min, max) kg)
+PARCEL_KINDS = [
+    (35, (20, 35), (15, 25), (1, 3), (-1.6, 0.5), (0.05, 1)), # Envelopes and documents
+    (40, (15, 45), (10, 35), (5, 25), (0.3, 0.6), (0.2, 15)), # Small boxes
+    (20, (40, 100), (30, 60), (25, 60), (1.8, 0.5), (2, 40)), # Large boxes
+    (5, (100, 150), (60, 100), (60, 120), (3.3, 0.4), (15, 70)), # Oversize
+]
+# Status by age in days: (max age, [(status, weight)])
+STATUS_BY_AGE = [
+    (1, [('Pending', 60), ('Accepted', 30), ('Out For Delivery', 10)]),
+    (3, [('Pending', 10), ('Accepted', 40), ('Out For Delivery', 35), ('Delivered', 15)]),
+    (7, [('Accepted', 10), ('Out For Delivery', 20), ('Delivered', 70)]),
+    (math.inf, [('Accepted', 1), ('Out For Delivery', 1), ('Delivered', 98)]),
+]
+
+USER_COLUMNS = ('id', 'first_name', 'last_name', 'email', 'password', 'phone_number', 'fs_uniquifier', 'street',
+                'city', 'state', 'zip_code', 'country', 'latitude', 'longitude', 'created_at', 'updated_at')
+RECIPIENT_COLUMNS = ('id', 'user_id', 'fingerprint', 'first_name', 'last_name', 'email', 'phone_number', 'fs_uniquifier',
+                     'street', 'city', 'state', 'zip_code', 'country', 'latitude', 'longitude', 'created_at', 'updated_at')
+BILLING_COLUMNS = ('id', 'user_id', 'street', 'city', 'state', 'zip_code', 'country', 'latitude', 'longitude')
+PARCEL_COLUMNS = ('id', 'user_id', 'recipient_id', 'length', 'width', 'height', 'weight', 'cost', 'status',
+                  'tracking_number', 'street', 'city', 'state', 'zip_code', 'country', 'latitude', 'longitude',
+                  'geohash', 'created_at', 'updated_at')
+
+
+def parse_count(value):
+    # "100k", "5M", "2_500" -> int
+    value = str(value).strip().lower().replace('_', '').replace(',', '')
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    if multiplier > 1:
+        value = value[:-1]
+    return int(float(value) * multiplier)
+
+
+class CountType(click.ParamType):
+    name = 'count'
+
+    def convert(self, value, param, ctx):
+        try:
+            count = parse_count(value)
+        except ValueError:
+            self.fail(f"'{value}' isn't a count like 5000, 100k or 5M", param, ctx)
+        if count < 0:
+            self.fail("Counts can't be negative", param, ctx)
+        return count
+
+
+def _cumulative(pairs):
+    values, weights, total = [], [], 0
+    for value, weight in pairs:
+        total += weight
+        values.append(value)
+        weights.append(total)
+    return values, weights
+
+
+def ensure_roles():
+    # The "admin" and "user" roles the app expects (User.create_with_default_role, the admin route policy)
+    existing = set(db.session.scalars(select(Role.name)))
+    for name in ('admin', 'user'):
+        if name not in existing:
+            db.session.add(Role(name=name))
+    db.session.commit()
+    return {role.name: role.id for role in db.session.scalars(select(Role))}
+
+
+class Generator:
+    def __init__(self, seed, days, now=None):
+        self.rng = random.Random(seed)
+        self.days = days
+        self.now = (now or datetime.now(timezone.utc)).replace(microsecond=0)
+        countries = [(name, weight) for name, (weight, _, _) in COUNTRIES.items()]
+        self.countries, self.country_weights = _cumulative(countries)
+        self.kinds, self.kind_weights = _cumulative([(kind[1:], kind[0]) for kind in PARCEL_KINDS])
+        self.statuses = [(max_age, *_cumulative(weights)) for max_age, weights in STATUS_BY_AGE]
+
+    def _uuid(self):
+        return uuid.UUID(int=self.rng.getrandbits(128), version=4)
+
+    def timestamp(self, days_ago_max=None):
+        # Denser towards today: the age's density falls linearly to zero at the start of the window
+        window = (days_ago_max or self.days) * 86400
+        return self.now - timedelta(seconds=int(window * (1 - math.sqrt(self.rng.random()))))
+
+    def address(self):
+        rng = self.rng
+        country = rng.choices(self.countries, cum_weights=self.country_weights)[0]
+        _, dialling_code, cities = COUNTRIES[country]
+        city, state, latitude, longitude = cities[int(len(cities) * rng.random() ** 1.5)] # Bigger cities listed first
+        return {
+            'street': f"{rng.randint(1, 999)} {rng.choice(STREETS)}",
+            'city': city,
+            'state': state,
+            'zip_code': f"{rng.randint(0, 99999):05d}",
+            'country': country,
+            'latitude': round(latitude + rng.gauss(0, 0.05), 6),
+            'longitude': round(longitude + rng.gauss(0, 0.05), 6),
+            'phone_number': f"{dialling_code}{rng.randint(700000000, 799999999)}",
+        }
+
+    def person(self, id, kind):
+        rng = self.rng
+        first_name, last_name = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        created_at = self.timestamp()
+        return {
+            'id': id,
+            'first_name': first_name,
+            'last_name': last_name,
+            'email': f"{first_name.lower()}.{last_name.lower()}.{id}@{kind}.example.com",
+            'fs_uniquifier': str(self._uuid()),
+            'created_at': created_at,
+            'updated_at': created_at,
+            **self.address(),
+        }
+
+    def dimensions(self):
+        rng = self.rng
+        length, width, height, (mu, sigma), (low, high) = rng.choices(self.kinds, cum_weights=self.kind_weights)[0]
+        weight = min(max(rng.lognormvariate(mu, sigma), low), high)
+        return (round(rng.uniform(*length), 1), round(rng.uniform(*width), 1), round(rng.uniform(*height), 1),
+                round(weight, 2))
+
+    def status(self, created_at):
+        age = (self.now - created_at).total_seconds() / 86400
+        for max_age, statuses, weights in self.statuses:
+            if age < max_age:
+                return self.rng.choices(statuses, cum_weights=weights)[0]
+
+    def parcel(self, id, recipient):
+        rng = self.rng
+        user = recipient['owner']
+        length, width, height, weight = self.dimensions()
+        distance = haversine_km(user[0], user[1], recipient['latitude'], recipient['longitude'])
+        created_at = self.timestamp()
+        status = self.status(created_at)
+        updated_at = created_at if status == 'Pending' else min(created_at + timedelta(hours=rng.uniform(1, 96)), self.now)
+        return (
+            id, user[2], recipient['id'], length, width, height, weight,
+            price(distance, length, width, height, weight)['cost'], status, f"{rng.getrandbits(128):032x}",
+            recipient['street'], recipient['city'], recipient['state'], recipient['zip_code'], recipient['country'],
+            recipient['latitude'], recipient['longitude'], recipient['geohash'], created_at, updated_at,
+        )
+
+
+class ChunkWriter:
+    # COPY ... FROM STDIN on PostgreSQL, executemany on anything else, one commit per chunk
+    def __init__(self, raw_connection, dialect):
+        self.connection = raw_connection
+        self.copy = dialect == 'postgresql'
+        self.dialect = dialect
+
+    def _value(self, value):
+        if isinstance(value, datetime):
+            # SQLAlchemy's SQLite DateTime stores naive "YYYY-MM-DD HH:MM:SS" text, PostgreSQL gets an offset
+            return value.isoformat(sep=' ') if self.copy else value.strftime('%Y-%m-%d %H:%M:%S')
+        return value
+
+    def write(self, table, columns, rows):
+        if not rows:
+            return
+        rows = [[self._value(value) for value in row] for row in rows]
+        cursor = self.connection.cursor()
+        try:
+            if self.copy:
+                buffer = io.StringIO()
+                csv.writer(buffer).writerows(rows) # None becomes an empty unquoted field, which COPY reads as NULL
+                buffer.seek(0)
+                cursor.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+            else:
+                placeholders = ', '.join('?' if self.dialect == 'sqlite' else '%s' for _ in columns)
+                cursor.executemany(f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({placeholders})", rows)
+        finally:
+            cursor.close()
+        self.connection.commit()
+
+
+def _next_id(model):
+    return (db.session.scalar(select(func.max(model.id))) or 0) + 1
+
+
+def _pragma(raw_connection, pragma):
+    cursor = raw_connection.cursor()
+    cursor.execute(f'PRAGMA {pragma}')
+    cursor.close()
+
+
+def _skewed(rng, count, power):
+    # An index in [0, count) where low indexes are picked far more often
+    return int(count * rng.random() ** power)
+
+
+def seed_database(users, recipients, parcels, seed=42, days=365, password='password', chunk_size=SEED_CHUNK_SIZE,
+                  echo=print):
+    if parcels and (not users or not recipients):
+        raise ValueError("Parcels need at least one user and one recipient")
+
+    roles = ensure_roles()
+    dialect = db.session.get_bind().dialect.name
+    user_start, recipient_start = _next_id(User), _next_id(Recipient)
+    billing_start, parcel_start = _next_id(BillingAddress), _next_id(Parcel)
+    first_admin = not db.session.scalar(text('SELECT 1 FROM roles_users WHERE role_id = :id LIMIT 1'), {'id': roles['admin']})
+    db.session.commit()
+
+    # The starting ids are part of the seed, so seeding an already seeded database doesn't repeat the unique
+    # values (fs_uniquifier, tracking numbers)
+    generator = Generator(f"{seed}:{user_start}:{recipient_start}:{parcel_start}", days)
+    password_hash = hash_password(password) # One hash for everyone, hashing per user would take hours
+    user_points = [] # (latitude, longitude, id) for the parcel costs
+    recipient_rows = []
+
+    raw = db.engine.raw_connection()
+    if dialect == 'sqlite':
+        _pragma(raw, 'synchronous = OFF') # A crash mid seed means seeding again anyway
+    writer = ChunkWriter(raw, dialect)
+    started = time.perf_counter()
+    try:
+        for offset in range(0, users, chunk_size):
+            rows, billing, memberships = [], [], []
+            for id in range(user_start + offset, user_start + min(offset + chunk_size, users)):
+                user = generator.person(id, 'users')
+                user['password'] = password_hash
+                if first_admin and id == user_start:
+                    user['email'] = 'admin@example.com'
+                    memberships.append((id, roles['admin']))
+                rows.append([user[column] for column in USER_COLUMNS])
+                billing.append([billing_start + id - user_start, id] + [user[column] for column in BILLING_COLUMNS[2:]])
+                memberships.append((id, roles['user']))
+                user_points.append((user['latitude'], user['longitude'], id))
+            writer.write('users', USER_COLUMNS, rows)
+            writer.write('billing_addresses', BILLING_COLUMNS, billing)
+            writer.write('roles_users', ('user_id', 'role_id'), memberships)
+        echo(f"{users} users, {users} billing addresses ({time.perf_counter() - started:.1f}s)")
+
+        for offset in range(0, recipients, chunk_size):
+            rows = []
+            for id in range(recipient_start + offset, recipient_start + min(offset + chunk_size, recipients)):
+                recipient = generator.person(id, 'recipients')
+                # Owned by a skewed pick of the users, so a few address books hold most recipients
+                recipient['owner'] = user_points[_skewed(generator.rng, users, 2)] if users else None
+                recipient['user_id'] = recipient['owner'][2] if users else None
+                recipient['fingerprint'] = recipient_fingerprint(recipient) if users else None
+                recipient['geohash'] = geohash_encode(recipient['latitude'], recipient['longitude'], GEOHASH_PRECISION) # For its parcels
+                recipient_rows.append(recipient)
+                rows.append([recipient[column] for column in RECIPIENT_COLUMNS])
+            writer.write('recipients', RECIPIENT_COLUMNS, rows)
+        echo(f"{recipients} recipients ({time.perf_counter() - started:.1f}s)")
+
+        rng = generator.rng
+        for offset in range(0, parcels, chunk_size):
+            rows = [
+                generator.parcel(id, recipient_rows[_skewed(rng, recipients, 1.5)])
+                for id in range(parcel_start + offset, parcel_start + min(offset + chunk_size, parcels))
+            ]
+            writer.write('parcels', PARCEL_COLUMNS, rows)
+            done = offset + len(rows)
+            if done % (chunk_size * 50) == 0 or done == parcels:
+                echo(f"{done} parcels ({time.perf_counter() - started:.1f}s)")
+    finally:
+        if dialect == 'sqlite':
+            _pragma(raw, 'synchronous = FULL')
+        raw.close()
+
+    if dialect == 'postgresql':
+        # Ids were assigned here, so the sequences have to catch up
+        for table in ('users', 'recipients', 'billing_addresses', 'parcels'):
+            db.session.execute(text(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), "
+                                    f"(SELECT COALESCE(MAX(id), 1) FROM {table}))"))
+    reconcile_stats() # Core writes skip the parcel_stats flush hook
+    db.session.execute(text('ANALYZE'))
+    db.session.commit()
+    echo(f"Done in {time.perf_counter() - started:.1f}s")
+    return {'users': users, 'recipients': recipients, 'parcels': parcels}
+
+
+def init_seed(app):
+    @app.cli.command('seed')
+    @click.option('--users', type=CountType(), default='1000', help='Users to create, e.g. 100k')
+    @click.option('--recipients', type=CountType(), default=None, help='Recipients to create, 3 per user by default')
+    @click.option('--parcels', type=CountType(), default='10k', help='Parcels to create, e.g. 5M')
+    @click.option('--days', default=365, help='Spread parcels over this many days up to now')
+    @click.option('--seed', default=42, help='Random seed, the same seed and counts give the same data')
+    @click.option('--password', default='password', help='Password of every generated user')
+    @click.option('--chunk-size', default=SEED_CHUNK_SIZE, help='Rows per COPY/executemany and commit')
+    def seed_command(users, recipients, parcels, days, seed, password, chunk_size):
+        recipients = users * 3 if recipients is None else recipients
+        try:
+            seed_database(users, recipients, parcels, seed=seed, days=days, password=password,
+                          chunk_size=chunk_size, echo=click.echo)
+        except ValueError as e:
+            raise click.UsageError(str(e))
 
-# Local imports
-from app import app
-from models import db
 
 if __name__ == '__main__':
-    fake = Faker()
+    from app import app
     with app.app_context():
-        # Connect to the database
-        with db.engine.connect() as connection:
-            # Start a transaction
-            with connection.begin():
-                # Insert data into roles
-                connection.execute(text("""
-                INSERT INTO roles (name) VALUES 
-                ('User'),
-                ('Admin');
-                """))
-
-                # Insert data into user_addresses
-                connection.execute(text("""
-                INSERT INTO user_addresses (street, city, state, zip_code, country, latitude, longitude) VALUES 
-                ('123 Elm St', 'Springfield', 'IL', '62701', 'USA', 39.7817, -89.6501),
-                ('456 Oak St', 'Springfield', 'IL', '62702', 'USA', 39.7817, -89.6501);
-                """))
-
-                # Insert data into recipient_addresses
-                connection.execute(text("""
-                INSERT INTO recipient_addresses (street, city, state, zip_code, country, latitude, longitude) VALUES 
-                ('789 Pine St', 'Springfield', 'IL', '62703', 'USA', 39.7817, -89.6501),
-                ('101 Maple St', 'Springfield', 'IL', '62704', 'USA', 39.7817, -89.6501);
-                """))
-
-                # Insert data into billing_addresses
-                connection.execute(text("""
-                INSERT INTO billing_addresses (street, city, state, zip_code, country, latitude, longitude) VALUES 
-                ('202 Birch St', 'Springfield', 'IL', '62705', 'USA', 39.7817, -89.6501),
-                ('303 Cedar St', 'Springfield', 'IL', '62706', 'USA', 39.7817, -89.6501);
-                """))
-
-                # Insert data into users
-                connection.execute(text("""
-                INSERT INTO users (first_name, last_name, email, password, fs_uniquifier, user_address_id, billing_address_id, created_at, updated_at) VALUES 
-                ('John', 'Doe', 'john.doe@example.com', 'password123', uuid_generate_v4()::text, 1, 2, current_timestamp, current_timestamp),
-                ('Jane', 'Smith', 'jane.smith@example.com', 'password123', uuid_generate_v4()::text, 2, 1, current_timestamp, current_timestamp),
-                ('Emily', 'Johnson', 'emily.johnson@example.com', 'password123', uuid_generate_v4()::text, 1, 2, current_timestamp, current_timestamp);
-                """))
-
-                # Insert Admins
-                connection.execute(text("""
-                INSERT INTO users (first_name, last_name, email, password, fs_uniquifier, user_address_id, billing_address_id, created_at, updated_at) VALUES 
-                ('Admin', 'User', 'admin1@sendit.com', 'adminpass', uuid_generate_v4()::text, 2, 1, current_timestamp, current_timestamp),
-                ('Admin', 'User', 'admin2@sendit.com', 'adminpass', uuid_generate_v4()::text, 2, 2, current_timestamp, current_timestamp);
-                """))
-
-                # Insert data into recipients
-                connection.execute(text("""
-                INSERT INTO recipients (recipient_full_name, phone_number, delivery_address_id, created_at, updated_at) VALUES 
-                ('Alice Brown', '555-1234', 1, current_timestamp, current_timestamp),
-                ('Bob White', '555-5678', 2, current_timestamp, current_timestamp);
-                """))
-
-                # Insert data into parcels
-                connection.execute(text("""
-                INSERT INTO parcels (user_id, recipient_id, length, width, height, weight, status, tracking_number, created_at, updated_at) VALUES 
-                (1, 1, 10, 5, 5, 2, 'Shipped', substring(uuid_generate_v4()::text, 1, 32), current_timestamp, current_timestamp),
-                (2, 2, 15, 10, 10, 5, 'Delivered', substring(uuid_generate_v4()::text, 1, 32), current_timestamp, current_timestamp);
-                """))
-
-                # Insert data into roles_users
-                connection.execute(text("""
-                INSERT INTO roles_users (user_id, role_id) VALUES 
-                (1, 1), -- John Doe is a User
-                (2, 1), -- Jane Smith is a User
-                (3, 1), -- Emily Johnson is a User
-                (4, 2), -- Admin User 1 is an Admin
-                (5, 2); -- Admin User 2 is an Admin
-                """))
-
-        print("Database seeded!")
-
-if __name__ == "__main__":
-    seed_data()
-
-'''
-
+        seed_database(users=100, recipients=300, parcels=1000)
@@ -0,0 +1,223 @@
+# /server/serializers.py
+
+# Precompiled serializers for the hot endpoints.
+# SerializerMixin.to_dict() re-parses the serialize rules and reflects over the columns for every instance.
+# Here each view is compiled once into a flat function (one dict literal, one converter per column picked
+# from the column type up front) and cached in the registry. Output matches to_dict() for the same view:
+# same keys, datetimes as '%Y-%m-%d %H:%M:%S', Decimals as strings.
+#
+# Every JSON response, whether a Resource returns json_response(), a dict through flask_restful or jsonify(),
+# is encoded once by dumps() below: compact, sorted keys, orjson when it's installed. Bodies of
+# JSON_COMPRESS_MIN_SIZE bytes or more are then sent with br or gzip when the client accepts them.
+
+import gzip
+import json as stdlib_json
+from datetime import datetime, date
+from decimal import Decimal
+
+from flask import request, Response
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import inspect, DateTime, Date, Numeric
+
+from models import User, Role, Recipient, Parcel, BillingAddress
+
+try:
+    import orjson
+except ImportError: # Falls back to the standard library encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError: # gzip only
+    brotli = None
+
+# Same formats SerializerMixin uses so responses don't change
+DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+DATE_FORMAT = '%Y-%m-%d'
+
+# Levels for bodies compressed on every request, the static files (static_assets.py) get the slow maximum
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+
+
+def _decimal(value):
+    return str(value) if type(value) is Decimal else value
+
+
+def _datetime(value):
+    return value.strftime(DATETIME_FORMAT) if value is not None else None
+
+
+def _date(value):
+    return value.strftime(DATE_FORMAT) if value is not None else None
+
+
+def _converter_for(column_type):
+    if isinstance(column_type, DateTime):
+        return '_datetime'
+    if isinstance(column_type, Date):
+        return '_date'
+    if isinstance(column_type, Numeric) and column_type.asdecimal:
+        return '_decimal'
+    return None
+
+
+def serializable_fields(model):
+    # Column names a view of the model may contain. Top level '-field' rules on the model (password,
+    # fs_uniquifier...) are honoured like to_dict() does
+    excluded = {rule[1:] for rule in model.serialize_rules if rule.startswith('-') and '.' not in rule}
+    return [column_attr.key for column_attr in inspect(model).column_attrs if column_attr.key not in excluded]
+
+
+def compile_serializer(model, relations=None, only=None):
+    # only= restricts the output to those columns, the result also works on Rows from a column projected select
+    relations = relations or {}
+    mapper = inspect(model)
+    allowed = set(serializable_fields(model) if only is None else only) & set(serializable_fields(model))
+
+    namespace = {'_decimal': _decimal, '_datetime': _datetime, '_date': _date}
+    fields = []
+    for column_attr in mapper.column_attrs:
+        key = column_attr.key
+        if key not in allowed:
+            continue
+        converter = _converter_for(column_attr.columns[0].type)
+        fields.append(f'{key!r}: {converter}(obj.{key})' if converter else f'{key!r}: obj.{key}')
+
+    for key, view_name in relations.items():
+        namespace[f'_{key}'] = get_serializer(view_name)
+        if mapper.relationships[key].uselist:
+            fields.append(f'{key!r}: [_{key}(item) for item in obj.{key}]')
+        else:
+            fields.append(f'{key!r}: _{key}(obj.{key}) if obj.{key} is not None else None')
+
+    source = 'def serialize(obj):\n    return {\n' + ''.join(f'        {field},\n' for field in fields) + '    }\n'
+    exec(compile(source, f'<serializer {model.__name__}>', 'exec'), namespace)
+    return namespace['serialize']
+
+
+# Registry of views: name -> (model, {relationship: nested view name})
+VIEWS = {}
+_compiled = {}
+_field_compiled = {}
+MAX_FIELD_SERIALIZERS = 256 # Clients pick the field sets, so keep the number compiled in check
+
+
+def register_view(name, model, relations=None):
+    VIEWS[name] = (model, relations or {})
+    _compiled.pop(name, None)
+
+
+def get_serializer(name):
+    serializer = _compiled.get(name)
+    if serializer is None:
+        model, relations = VIEWS[name]
+        serializer = _compiled[name] = compile_serializer(model, relations)
+    return serializer
+
+
+def get_field_serializer(model, fields):
+    # Sparse fieldsets (?fields=), compiled once per distinct set of fields
+    key = (model, frozenset(fields))
+    serializer = _field_compiled.get(key)
+    if serializer is None:
+        if len(_field_compiled) >= MAX_FIELD_SERIALIZERS:
+            _field_compiled.clear()
+        serializer = _field_compiled[key] = compile_serializer(model, only=fields)
+    return serializer
+
+
+register_view('role', Role)
+register_view('recipient', Recipient)
+register_view('billing_address', BillingAddress)
+register_view('user', User)
+register_view('user_summary', User, {'roles': 'role', 'billing_addresses': 'billing_address'})
+register_view('parcel_with_recipient', Parcel, {'recipient': 'recipient'})
+register_view('user_detail', User, {'roles': 'role', 'billing_addresses': 'billing_address', 'parcels': 'parcel_with_recipient'})
+register_view('parcel', Parcel, {'user': 'user', 'recipient': 'recipient'})
+register_view('billing_address_with_user', BillingAddress, {'user': 'user'})
+
+
+# Fast JSON encoding
+
+def _default(value):
+    # Only hit for values that didn't go through a compiled serializer
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.strftime(DATETIME_FORMAT)
+    if isinstance(value, date):
+        return value.strftime(DATE_FORMAT)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(payload, pretty=False):
+    # Always returns bytes, ready to be written to the response
+    if orjson is not None:
+        option = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(payload, default=_default, option=option)
+    # Not flask.json.dumps, which hands the call to app.json and so back here
+    if pretty:
+        return stdlib_json.dumps(payload, default=_default, indent=2, sort_keys=True, ensure_ascii=False).encode()
+    return stdlib_json.dumps(payload, default=_default, separators=(',', ':'), sort_keys=True,
+                             ensure_ascii=False).encode()
+
+
+def json_response(payload, status=200, headers=None):
+    # Drop-in for make_response(jsonify(payload), status), including jsonify's trailing newline
+    return Response(dumps(payload) + b'\n', status=status, headers=headers, mimetype='application/json')
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    # app.json, so jsonify() encodes with dumps() too. Request bodies are still parsed by the standard library
+    def dumps(self, obj, **kwargs):
+        # jsonify() passes no options. Callers asking for some (indent=, sort_keys=...) get the standard library
+        # with them, and the same Decimal and datetime handling
+        if kwargs:
+            kwargs.setdefault('default', _default)
+            return stdlib_json.dumps(obj, **kwargs)
+        return dumps(obj).decode()
+
+    def response(self, *args, **kwargs):
+        return json_response(self._prepare_response_obj(args, kwargs))
+
+
+def _compress(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def compress_response(response, min_size):
+    if (response.mimetype != 'application/json' or response.direct_passthrough or response.is_streamed
+            or response.status_code in (204, 304) or 'Content-Encoding' in response.headers):
+        return response
+    response.vary.add('Accept-Encoding')
+    if response.content_length is None or response.content_length < min_size:
+        return response
+    encoding = request.accept_encodings.best_match(('br', 'gzip') if brotli is not None else ('gzip',))
+    if encoding is None:
+        return response
+    response.set_data(_compress(response.get_data(), encoding))
+    response.headers['Content-Encoding'] = encoding
+    # The compressed bytes differ from the ones the ETag was made for, If-None-Match still matches weakly
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+
+def init_json(app, api):
+    app.json = FastJSONProvider(app)
+
+    @api.representation('application/json')
+    def output_json(data, code, headers=None):
+        # Replaces flask_restful's, which encodes with the standard library and indents in debug mode
+        return json_response(data, code, headers)
+
+    if app.config['JSON_COMPRESSION']:
+        @app.after_request
+        def compress_json(response):
+            return compress_response(response, app.config['JSON_COMPRESS_MIN_SIZE'])
@@ -0,0 +1,300 @@
+# /server/spatial.py
+
+# Nearby parcel queries for dispatch: GET /parcels/nearby?lat=&lng=&radius= and ?k= for the k nearest.
+#
+# Open parcels (anything not Delivered) are kept in memory in a KD-tree over unit sphere vectors (geo.py), so
+# a radius or k-nearest search only visits the branches that can hold an answer instead of every parcel.
+# Candidates are then measured exactly with the haversine formula. Each worker builds its own index on first
+# use and keeps it current from the parcel_events log: every NEARBY_INDEX_REFRESH seconds it applies the
+# events written since the last ones it saw. Parcels added or moved since the tree was built sit in a small
+# overlay that is searched linearly. The index is reloaded from parcels, in the background of other requests,
+# every NEARBY_INDEX_RELOAD seconds or sooner once the overlay gets big, which also picks up events that
+# committed out of id order.
+#
+# Every parcel also stores the geohash of its coordinates, set on write here and in the Core insert paths
+# (ingest.py, seed.py). ?scope=all, which includes delivered parcels, is answered from that column instead:
+# one range scan of ix_parcels_geohash per covering cell, then the same haversine refinement.
+
+import heapq
+import threading
+import time
+from operator import itemgetter
+
+from flask import current_app
+from sqlalchemy import event, select, func, and_, or_
+
+from config import db
+from models import Parcel, ParcelEvent
+from geo import (haversine_km, geohash_encode, geohash_cover, geohash_prefix_end, unit_vector, chord_for_km,
+                 GEOHASH_PRECISION)
+from listing import QueryArgsError
+
+CLOSED_STATUS = 'Delivered' # Same split as the ix_parcels_status_open partial index
+MAX_NEARBY_RESULTS = 1000
+MAX_NEARBY_RADIUS_KM = 1000
+EVENT_BATCH_SIZE = 5000 # Further behind than this and the index is reloaded instead
+KDTREE_LEAF_SIZE = 16
+OVERLAY_REBUILD_MIN = 256 # Overlay size that triggers a rebuild, or a tenth of the index if that's larger
+
+
+def parcel_geohash(latitude, longitude):
+    if latitude is None or longitude is None:
+        return None
+    return geohash_encode(latitude, longitude, GEOHASH_PRECISION)
+
+
+@event.listens_for(Parcel, 'before_insert')
+@event.listens_for(Parcel, 'before_update')
+def set_parcel_geohash(mapper, connection, target):
+    target.geohash = parcel_geohash(target.latitude, target.longitude)
+
+
+_AXES = [itemgetter(axis) for axis in range(3)]
+
+
+def _distance_sq(a, b):
+    return (a[0] - b[0]) ** 2 + (a[1] - b[1]) ** 2 + (a[2] - b[2]) ** 2
+
+
+class KDTree:
+    # Static tree over (key, vector) items. Leaves hold up to KDTREE_LEAF_SIZE items in keys/vectors[start:end],
+    # inner nodes split at the median of the axis with the widest spread
+    def __init__(self, items):
+        rows = [(*vector, key) for key, vector in items] # Flat tuples sort fastest with itemgetter
+        self.nodes = [] # (axis, split, left, right) for inner nodes, (-1, start, end, None) for leaves
+        if rows:
+            self._build(rows, 0, len(rows))
+        self.keys = [row[3] for row in rows]
+        self.vectors = [row[:3] for row in rows]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _build(self, rows, start, end):
+        index = len(self.nodes)
+        if end - start <= KDTREE_LEAF_SIZE:
+            self.nodes.append((-1, start, end, None))
+            return index
+        chunk = rows[start:end]
+        sample = chunk[::max(1, len(chunk) // 256)] # Enough to tell the widest axis
+        spreads = [max(values) - min(values) for values in zip(*sample)][:3]
+        axis = spreads.index(max(spreads))
+        chunk.sort(key=_AXES[axis])
+        rows[start:end] = chunk
+        middle = (start + end) // 2
+        split = rows[middle][axis] # Read before the children reorder their halves
+        self.nodes.append(None) # Filled in once both children have their indexes
+        left = self._build(rows, start, middle)
+        right = self._build(rows, middle, end)
+        self.nodes[index] = (axis, split, left, right)
+        return index
+
+    def within(self, vector, radius):
+        # Keys of the items no further than radius (straight line) from vector
+        if not self.nodes:
+            return []
+        radius_sq = radius * radius
+        found, stack = [], [0]
+        while stack:
+            axis, a, b, c = self.nodes[stack.pop()]
+            if axis < 0:
+                for position in range(a, b):
+                    if _distance_sq(self.vectors[position], vector) <= radius_sq:
+                        found.append(self.keys[position])
+                continue
+            offset = vector[axis] - a
+            if offset <= radius:
+                stack.append(b)
+            if offset >= -radius:
+                stack.append(c)
+        return found
+
+    def nearest(self, vector, k, accept=None):
+        # [(distance squared, key)] of the k nearest items that accept(key) lets through, nearest first.
+        # Equal distances are settled by the smaller key, parcels often share their recipient's coordinates
+        if not self.nodes or k <= 0:
+            return []
+        best = [] # Max-heap of (-distance squared, -key)
+        stack = [(0, 0.0)]
+        while stack:
+            node, plane_sq = stack.pop()
+            if len(best) == k and plane_sq > -best[0][0]:
+                continue
+            axis, a, b, c = self.nodes[node]
+            if axis < 0:
+                for position in range(a, b):
+                    key = self.keys[position]
+                    if accept is not None and not accept(key):
+                        continue
+                    item = (-_distance_sq(self.vectors[position], vector), -key)
+                    if len(best) < k:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+                continue
+            offset = vector[axis] - a
+            near, far = (b, c) if offset < 0 else (c, b)
+            stack.append((far, offset * offset)) # Popped after the near side, when the k best are tighter
+            stack.append((near, 0.0))
+        return sorted((-distance_sq, -key) for distance_sq, key in best)
+
+
+class OpenParcelIndex:
+    def __init__(self):
+        self._lock = threading.Lock() # Held by queries and while events are applied
+        self._building = threading.Lock() # Held by the one thread reloading, which doesn't hold _lock meanwhile
+        self._points = {} # parcel id -> (latitude, longitude, status, vector) of every open parcel with coordinates
+        self._tree = KDTree(())
+        self._overlay = {} # ids added or moved since the tree was built
+        self._stale = set() # ids whose tree entry no longer counts (closed, deleted or moved into the overlay)
+        self._cursor = None # Last parcel_events id applied
+        self._loaded_at = self._refreshed_at = 0.0
+
+    def _entry(self, latitude, longitude, status):
+        return float(latitude), float(longitude), status, unit_vector(latitude, longitude)
+
+    def _reload(self, wait):
+        # Reads and builds without the query lock, so other requests keep searching the current index until the
+        # new one is swapped in. The cursor is read first, events that land while parcels are read are applied
+        # again by the next refresh, which changes nothing
+        if not self._building.acquire(blocking=wait):
+            return # Another thread is already at it
+        try:
+            if wait and self._cursor is not None:
+                return
+            cursor = db.session.scalar(select(func.max(ParcelEvent.id))) or 0
+            points = {id: self._entry(latitude, longitude, status)
+                      for id, latitude, longitude, status in db.session.execute(open_parcels_statement())}
+            tree = KDTree((id, entry[3]) for id, entry in points.items())
+            with self._lock:
+                self._cursor, self._points, self._tree = cursor, points, tree
+                self._overlay, self._stale = {}, set()
+                self._loaded_at = self._refreshed_at = time.monotonic()
+        finally:
+            self._building.release()
+
+    def _apply_events(self):
+        stmt = (select(ParcelEvent.id, ParcelEvent.parcel_id, ParcelEvent.event_type, ParcelEvent.status,
+                       ParcelEvent.latitude, ParcelEvent.longitude)
+                .where(ParcelEvent.id > self._cursor).order_by(ParcelEvent.id).limit(EVENT_BATCH_SIZE))
+        rows = db.session.execute(stmt).all()
+        for id, parcel_id, event_type, status, latitude, longitude in rows:
+            self._cursor = id
+            self._points.pop(parcel_id, None)
+            self._overlay.pop(parcel_id, None)
+            self._stale.add(parcel_id)
+            if event_type != 'deleted' and status != CLOSED_STATUS and latitude is not None and longitude is not None:
+                self._points[parcel_id] = self._overlay[parcel_id] = self._entry(latitude, longitude, status)
+        overgrown = len(self._overlay) + len(self._stale) > max(OVERLAY_REBUILD_MIN, len(self._points) // 10)
+        if overgrown or len(rows) == EVENT_BATCH_SIZE:
+            self._loaded_at = float('-inf') # Reload on the next query rather than crawl through the backlog
+
+    def _refresh(self):
+        config = current_app.config
+        if self._cursor is None:
+            self._reload(wait=True)
+        elif time.monotonic() - self._loaded_at >= config['NEARBY_INDEX_RELOAD']:
+            self._reload(wait=False)
+        with self._lock:
+            if time.monotonic() - self._refreshed_at >= config['NEARBY_INDEX_REFRESH']:
+                self._apply_events()
+                self._refreshed_at = time.monotonic()
+
+    def _measure(self, ids, latitude, longitude, status):
+        found = []
+        for id in ids:
+            entry = self._points[id]
+            if status is None or entry[2] == status:
+                found.append((haversine_km(latitude, longitude, entry[0], entry[1]), id))
+        return found
+
+    def within(self, latitude, longitude, radius_km, limit, status=None):
+        # [(distance km, parcel id)] of open parcels within radius_km, nearest first
+        vector, chord = unit_vector(latitude, longitude), chord_for_km(radius_km) * 1.000001 # Leeway for rounding
+        self._refresh()
+        with self._lock:
+            ids = [id for id in self._tree.within(vector, chord) if id not in self._stale]
+            ids.extend(id for id, entry in self._overlay.items() if _distance_sq(entry[3], vector) <= chord * chord)
+            found = self._measure(ids, latitude, longitude, status)
+        return sorted(item for item in found if item[0] <= radius_km)[:limit]
+
+    def nearest(self, latitude, longitude, k, status=None, radius_km=None):
+        # [(distance km, parcel id)] of the k nearest open parcels, optionally no further than radius_km
+        vector = unit_vector(latitude, longitude)
+        self._refresh()
+        with self._lock:
+            points, stale = self._points, self._stale
+            accept = lambda id: id not in stale and (status is None or points[id][2] == status)
+            ids = [id for _, id in self._tree.nearest(vector, k, accept)]
+            ids.extend(self._overlay)
+            found = self._measure(ids, latitude, longitude, status)
+        if radius_km is not None:
+            found = [item for item in found if item[0] <= radius_km]
+        return sorted(found)[:k]
+
+
+open_parcels = OpenParcelIndex()
+
+
+def geohash_statement(latitude, longitude, radius_km, status=None):
+    # Parcels in the geohash cells covering the circle, a superset of the ones inside it
+    ranges = []
+    for cell in geohash_cover(latitude, longitude, radius_km):
+        end = geohash_prefix_end(cell)
+        ranges.append(and_(Parcel.geohash >= cell, Parcel.geohash < end) if end else Parcel.geohash >= cell)
+    stmt = select(Parcel.id, Parcel.latitude, Parcel.longitude).where(or_(*ranges))
+    if status is not None:
+        stmt = stmt.where(Parcel.status == status)
+    return stmt
+
+
+def open_parcels_statement():
+    return select(Parcel.id, Parcel.latitude, Parcel.longitude, Parcel.status).where(
+        Parcel.status != CLOSED_STATUS, Parcel.latitude.is_not(None), Parcel.longitude.is_not(None))
+
+
+def geohash_within(latitude, longitude, radius_km, limit, status=None):
+    # Same as OpenParcelIndex.within over every parcel, delivered ones included, using the geohash column
+    found = []
+    for id, parcel_latitude, parcel_longitude in db.session.execute(geohash_statement(latitude, longitude, radius_km, status)):
+        distance = haversine_km(latitude, longitude, parcel_latitude, parcel_longitude)
+        if distance <= radius_km:
+            found.append((distance, id))
+    return sorted(found)[:limit]
+
+
+def _number(args, name, low, high, cast=float):
+    try:
+        value = cast(args[name])
+    except (TypeError, ValueError):
+        raise QueryArgsError(f"'{name}' must be a number")
+    if not low <= value <= high:
+        raise QueryArgsError(f"'{name}' must be between {low} and {high}")
+    return value
+
+
+def find_nearby(args):
+    # Parses ?lat=&lng=&radius=&k=&limit=&status=&scope= and returns [(distance km, parcel id)]
+    if 'lat' not in args or 'lng' not in args:
+        raise QueryArgsError("'lat' and 'lng' are required")
+    latitude = _number(args, 'lat', -90, 90)
+    longitude = _number(args, 'lng', -180, 180)
+    radius = _number(args, 'radius', 0, MAX_NEARBY_RADIUS_KM) if 'radius' in args else None
+    k = _number(args, 'k', 1, MAX_NEARBY_RESULTS, int) if 'k' in args else None
+    limit = _number(args, 'limit', 1, MAX_NEARBY_RESULTS, int) if 'limit' in args else 100
+    status = args.get('status') or None
+    scope = args.get('scope', 'open')
+    if radius is None and k is None:
+        raise QueryArgsError("Pass a 'radius' in km, a 'k' for the k nearest, or both")
+    if scope not in ('open', 'all'):
+        raise QueryArgsError("'scope' is either open (the default) or all")
+
+    if scope == 'all':
+        if radius is None:
+            raise QueryArgsError("scope=all needs a 'radius'")
+        return geohash_within(latitude, longitude, radius, k or limit, status)
+    if status == CLOSED_STATUS:
+        raise QueryArgsError(f"{CLOSED_STATUS} parcels are only searched with scope=all")
+    if k is not None:
+        return open_parcels.nearest(latitude, longitude, k, status, radius)
+    return open_parcels.within(latitude, longitude, radius, limit, status)
@@ -0,0 +1,155 @@
+# /server/static_assets.py
+
+# Serves the React build from a manifest made once at startup.
+# Every file in STATIC_FOLDER is read once to get its size, content type and a strong ETag, and compressible files
+# get gzip (and brotli, when the brotli package is installed) variants written to STATIC_CACHE_DIR, keyed by
+# ETag so gunicorn workers and restarts share them. Requests are then answered from the manifest: a 304 when the
+# ETag matches without touching the disk, otherwise the best variant the client accepts through send_file, which
+# hands the open file to the server's wsgi.file_wrapper (sendfile under gunicorn).
+#
+# Files with a content hash in their name (CRA's main.1a2b3c4d.js) are cached for a year as immutable,
+# everything else (index.html, manifest.json) is revalidated on each use. A new build needs a restart.
+
+import gzip
+import hashlib
+import mimetypes
+import os
+import re
+import tempfile
+
+from flask import request, send_file, make_response, jsonify
+
+try:
+    import brotli
+except ImportError: # Pre-built .br files next to the originals are still used
+    brotli = None
+
+HASHED_NAME = re.compile(r'\.[0-9a-f]{8,}\.') # main.1a2b3c4d.js, main.1a2b3c4d.chunk.css, logo.5d5d9eef.svg
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+COMPRESS_MIN_SIZE = 1024
+COMPRESSIBLE_TYPES = {'application/javascript', 'text/javascript', 'application/json', 'application/manifest+json',
+                      'image/svg+xml', 'application/xml', 'application/wasm'}
+ENCODINGS = (('br', '.br'), ('gzip', '.gz')) # In order of preference
+
+mimetypes.add_type('application/manifest+json', '.webmanifest')
+
+
+class Asset:
+    __slots__ = ('path', 'content_type', 'size', 'etag', 'cache_control', 'variants')
+
+    def __init__(self, path, content_type, size, etag, cache_control):
+        self.path = path
+        self.content_type = content_type
+        self.size = size
+        self.etag = etag
+        self.cache_control = cache_control
+        self.variants = {} # encoding -> (path, size)
+
+
+def _compressible(content_type, size):
+    return size >= COMPRESS_MIN_SIZE and (content_type.startswith('text/') or content_type in COMPRESSIBLE_TYPES)
+
+
+def _write_once(path, data):
+    # Written under a temporary name first, so a worker never serves another worker's half written file
+    if os.path.exists(path):
+        return
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+    with os.fdopen(fd, 'wb') as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+
+class StaticManifest:
+    def __init__(self, root, cache_dir):
+        self.root = root
+        self.cache_dir = cache_dir
+        self.assets = {}
+
+    def build(self):
+        assets = {}
+        if not self.root or not os.path.isdir(self.root):
+            self.assets = assets
+            return self
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                path = os.path.join(directory, filename)
+                if filename.endswith(('.gz', '.br')) and os.path.exists(path[:-3]):
+                    continue # Picked up as a variant of the original below
+                name = os.path.relpath(path, self.root).replace(os.sep, '/')
+                assets[name] = self._asset(name, path)
+        self.assets = assets
+        return self
+
+    def _asset(self, name, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        content_type = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        etag = hashlib.sha1(data).hexdigest()[:20]
+        cache_control = IMMUTABLE if HASHED_NAME.search(os.path.basename(name)) else REVALIDATE
+        asset = Asset(path, content_type, len(data), etag, cache_control)
+
+        if _compressible(content_type, len(data)):
+            for encoding, suffix in ENCODINGS:
+                variant = path + suffix
+                if not os.path.exists(variant):
+                    variant = os.path.join(self.cache_dir, etag + suffix)
+                    if encoding == 'gzip':
+                        _write_once(variant, gzip.compress(data, compresslevel=9, mtime=0))
+                    elif brotli is not None:
+                        _write_once(variant, brotli.compress(data, quality=11))
+                    else:
+                        continue
+                size = os.path.getsize(variant)
+                if size < len(data) * 0.9: # Not worth a Content-Encoding otherwise
+                    asset.variants[encoding] = (variant, size)
+        return asset
+
+    def get(self, name):
+        return self.assets.get(name)
+
+
+def _negotiate(asset):
+    accepted = request.accept_encodings
+    for encoding, _ in ENCODINGS:
+        if encoding in asset.variants and accepted.quality(encoding) > 0:
+            return encoding
+    return None
+
+
+def send_asset(asset):
+    encoding = _negotiate(asset)
+    # Each encoding is its own representation, so it gets its own strong ETag
+    etag = f'{asset.etag}-{encoding}' if encoding else asset.etag
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': asset.cache_control}
+    if asset.variants:
+        headers['Vary'] = 'Accept-Encoding'
+
+    if request.if_none_match.contains_weak(etag):
+        return make_response('', 304, headers)
+
+    path = asset.variants[encoding][0] if encoding else asset.path
+    response = send_file(path, mimetype=asset.content_type, conditional=False, etag=False, max_age=None)
+    response.headers.update(headers)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    return response
+
+
+def init_static(app):
+    manifest = StaticManifest(app.config['STATIC_FOLDER'], app.config['STATIC_CACHE_DIR']).build()
+    app.extensions['static_manifest'] = manifest
+    app.logger.info(f"Static manifest: {len(manifest.assets)} files from {manifest.root}")
+    return manifest
+
+
+def serve_spa(manifest, path):
+    # Known files are served as they are, any other path is a client side route and gets index.html
+    asset = manifest.get(path) if path else None
+    if asset is None:
+        asset = manifest.get('index.html')
+    if asset is None:
+        return make_response(jsonify({"message": "Not found"}), 404)
+    return send_asset(asset)
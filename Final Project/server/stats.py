@@ -0,0 +1,218 @@
+# /server/stats.py
+
+# Incrementally maintained parcel counters for GET /admin/dashboard.
+# parcel_stats holds one row per (dimension, key): the overall total, each status, each creation day and each
+# destination country, with a parcel count and a revenue sum (Parcel.cost). Every flush that creates, deletes or
+# changes the status/cost/country of a parcel upserts the difference into those rows in the same transaction,
+# so the dashboard reads a few dozen summary rows instead of scanning parcels.
+#
+# Anything that writes parcels behind the ORM's back (raw SQL, a missed code path) is fixed up by
+#   flask --app app stats-reconcile [--every 3600]
+# which recomputes the table from parcels.
+
+import time
+from collections import defaultdict
+from datetime import datetime, timezone, timedelta
+from decimal import Decimal
+
+import click
+from sqlalchemy import event, inspect, select, delete, func, insert, update, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Parcel, ParcelStat
+
+TOTAL, STATUS, DAY, COUNTRY = 'total', 'status', 'day', 'country'
+DAY_FORMAT = '%Y-%m-%d'
+
+
+def _today():
+    return datetime.now(timezone.utc).strftime(DAY_FORMAT)
+
+
+def _day(created_at):
+    if created_at is None:
+        return None
+    if created_at.tzinfo is not None:
+        created_at = created_at.astimezone(timezone.utc)
+    return created_at.strftime(DAY_FORMAT)
+
+
+def contributions(status, cost, country, day):
+    # The (dimension, key) rows one parcel counts towards. day is None when it isn't known without a query,
+    # the day row is then left for the reconciler
+    keys = [(TOTAL, ''), (STATUS, status or ''), (COUNTRY, country or '')]
+    if day is not None:
+        keys.append((DAY, day))
+    return keys, Decimal(str(cost)) if cost is not None else Decimal(0)
+
+
+def add_contribution(deltas, values, sign):
+    keys, cost = contributions(*values)
+    for key in keys:
+        deltas[key][0] += sign
+        deltas[key][1] += sign * cost
+
+
+def _old_value(state, field):
+    history = state.attrs[field].history
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return state.dict.get(field)
+
+
+def _values(obj, day):
+    return obj.status, obj.cost, obj.country, day
+
+
+@event.listens_for(Session, 'after_flush')
+def record_parcel_stats(session, flush_context):
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    for obj in session.new:
+        if isinstance(obj, Parcel):
+            add_contribution(deltas, _values(obj, _today()), 1)
+    for obj in session.dirty:
+        if not isinstance(obj, Parcel):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[field].history.has_changes() for field in ('status', 'cost', 'country')):
+            continue
+        day = _day(state.dict.get('created_at')) # Only if already loaded, never worth a query here
+        old = (_old_value(state, 'status'), _old_value(state, 'cost'), _old_value(state, 'country'), day)
+        add_contribution(deltas, old, -1)
+        add_contribution(deltas, _values(obj, day), 1)
+    for obj in session.deleted:
+        if isinstance(obj, Parcel):
+            state = inspect(obj)
+            old = (_old_value(state, 'status'), _old_value(state, 'cost'), _old_value(state, 'country'),
+                   _day(state.dict.get('created_at')))
+            add_contribution(deltas, old, -1)
+
+    if deltas:
+        apply_deltas(session.connection(), deltas)
+
+
+def created_deltas(parcel_rows):
+    # For Core inserts (bulk ingestion) that skip the flush hook
+    deltas = defaultdict(lambda: [0, Decimal(0)])
+    today = _today()
+    for row in parcel_rows:
+        add_contribution(deltas, (row.get('status'), row.get('cost'), row.get('country'), today), 1)
+    return deltas
+
+
+def apply_deltas(connection, deltas):
+    rows = [
+        {'dimension': dimension, 'key': key, 'parcels': count, 'revenue': revenue}
+        for (dimension, key), (count, revenue) in sorted(deltas.items()) # Sorted so concurrent flushes lock rows in the same order
+        if count or revenue
+    ]
+    if not rows:
+        return
+    dialect = connection.dialect.name
+    if dialect not in ('postgresql', 'sqlite'):
+        _update_or_insert(connection, rows)
+        return
+    stmt = (postgresql if dialect == 'postgresql' else sqlite).insert(ParcelStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['dimension', 'key'],
+        set_={
+            'parcels': ParcelStat.parcels + stmt.excluded.parcels,
+            'revenue': ParcelStat.revenue + stmt.excluded.revenue,
+        },
+    )
+    connection.execute(stmt, rows)
+
+
+def _update_or_insert(connection, rows):
+    # Databases without ON CONFLICT: add to the row, or insert it when there is none yet. This runs inside the
+    # flush, so a concurrent insert of the same row is retried as an update instead of failing the commit
+    for row in rows:
+        stmt = update(ParcelStat).where(ParcelStat.dimension == row['dimension'], ParcelStat.key == row['key'])
+        stmt = stmt.values(parcels=ParcelStat.parcels + row['parcels'], revenue=ParcelStat.revenue + row['revenue'])
+        if connection.execute(stmt).rowcount:
+            continue
+        try:
+            with connection.begin_nested():
+                connection.execute(insert(ParcelStat), row)
+        except IntegrityError:
+            connection.execute(stmt)
+
+
+def reconcile_stats():
+    # Rebuilds parcel_stats from parcels in one transaction. On PostgreSQL the table is locked first, so flushes
+    # that commit while this runs either land in the aggregates below or wait and apply their deltas on top
+    session = db.session
+    dialect = session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        session.execute(text('LOCK TABLE parcel_stats IN EXCLUSIVE MODE'))
+        created_day = func.to_char(func.timezone('UTC', Parcel.created_at), 'YYYY-MM-DD')
+    else:
+        created_day = func.strftime(DAY_FORMAT, Parcel.created_at)
+
+    revenue = func.coalesce(func.sum(Parcel.cost), 0)
+    rows = []
+    groupings = (
+        (TOTAL, None),
+        (STATUS, func.coalesce(Parcel.status, '')),
+        (DAY, created_day),
+        (COUNTRY, func.coalesce(Parcel.country, '')),
+    )
+    for dimension, key in groupings:
+        if key is None:
+            stmt = select(func.count(Parcel.id), revenue)
+            rows.extend({'dimension': dimension, 'key': '', 'parcels': count, 'revenue': total}
+                        for count, total in session.execute(stmt))
+        else:
+            stmt = select(key, func.count(Parcel.id), revenue).group_by(key)
+            rows.extend({'dimension': dimension, 'key': value or '', 'parcels': count, 'revenue': total}
+                        for value, count, total in session.execute(stmt))
+
+    session.execute(delete(ParcelStat))
+    session.execute(insert(ParcelStat), rows)
+    session.commit()
+    return len(rows)
+
+
+def _rows(stmt):
+    return [(row.key or None, row.parcels, str(Decimal(row.revenue).quantize(Decimal('0.01'))))
+            for row in db.session.execute(stmt)]
+
+
+def dashboard_summary(days=30, top=10):
+    stat = ParcelStat
+    columns = (stat.key, stat.parcels, stat.revenue)
+    since = (datetime.now(timezone.utc) - timedelta(days=days - 1)).strftime(DAY_FORMAT)
+
+    totals = _rows(select(*columns).where(stat.dimension == TOTAL))
+    by_status = _rows(select(*columns).where(stat.dimension == STATUS, stat.parcels > 0).order_by(stat.key))
+    daily = _rows(select(*columns).where(stat.dimension == DAY, stat.key >= since).order_by(stat.key))
+    countries = _rows(
+        select(*columns).where(stat.dimension == COUNTRY, stat.parcels > 0)
+        .order_by(stat.parcels.desc(), stat.key).limit(top)
+    )
+
+    _, total_parcels, total_revenue = totals[0] if totals else (None, 0, '0.00')
+    return {
+        "total": {"parcels": total_parcels, "revenue": total_revenue},
+        "by_status": [{"status": key, "parcels": count, "revenue": revenue} for key, count, revenue in by_status],
+        "daily": [{"day": key, "parcels": count, "revenue": revenue} for key, count, revenue in daily],
+        "top_countries": [{"country": key, "parcels": count, "revenue": revenue} for key, count, revenue in countries],
+    }
+
+
+def init_stats(app):
+    @app.cli.command('stats-reconcile')
+    @click.option('--every', default=0, help='Keep running, reconciling every N seconds')
+    def stats_reconcile(every):
+        while True:
+            count = reconcile_stats()
+            click.echo(f"Reconciled {count} parcel_stats rows")
+            if not every:
+                return
+            db.session.remove()
+            time.sleep(every)
@@ -0,0 +1,74 @@
+# /server/tests/conftest.py
+
+# Shared fixtures. The migrations are applied once per run to a scratch SQLite database, or to the scratch
+# database TEST_DATABASE_URI points at, and every test that takes `database` starts from empty tables:
+#   cd server && python -m pytest tests
+
+import os
+import sys
+import tempfile
+
+import pytest
+from flask import g, has_app_context
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SERVER_DIR)
+os.environ['DATABASE_URI'] = os.getenv('TEST_DATABASE_URI') or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'tests.db')
+
+from flask_migrate import upgrade
+from werkzeug.security import generate_password_hash
+
+from config import app, db
+from models import User, Role
+from principal import clear_principals
+from seed import ensure_roles
+import app as application # Registers every resource and the gate
+import tracking
+
+PASSWORD = 'secret1'
+app.config['PASSWORD_HASH_METHOD'] = 'pbkdf2:sha256:1000' # Logins in tests don't need a slow hash
+
+
+@pytest.fixture(scope='session')
+def schema():
+    with app.app_context():
+        upgrade(directory=os.path.join(SERVER_DIR, 'migrations'))
+
+
+@pytest.fixture
+def database(schema):
+    with app.app_context():
+        roles = ensure_roles()
+        yield roles
+        db.session.remove()
+        for table in reversed(db.metadata.sorted_tables):
+            db.session.execute(table.delete())
+        db.session.commit()
+        clear_principals()
+        tracking._tracking.clear()
+
+
+@pytest.fixture
+def client():
+    return app.test_client()
+
+
+@pytest.fixture
+def make_user(database):
+    # make_user('a@example.com', admin=True) -> user id, with PASSWORD as the password
+    def make_user(email, admin=False):
+        user = User(first_name='Test', last_name=email.split('@')[0], email=email,
+                    password=generate_password_hash(PASSWORD, method=app.config['PASSWORD_HASH_METHOD']))
+        user.roles = [db.session.get(Role, database['admin' if admin else 'user'])]
+        db.session.add(user)
+        db.session.commit()
+        return user.id
+    return make_user
+
+
+def login(client, user_id):
+    with client.session_transaction() as session:
+        session['user_id'] = user_id
+    # Requests share the test's app context, and with it the principal cached in g by the previous one
+    if has_app_context():
+        g.pop('principal', None)
@@ -0,0 +1,99 @@
+# /server/tests/test_addressbook.py
+
+from config import db
+from models import Recipient, Parcel
+from seed import seed_database
+from conftest import login
+
+ADDRESS = {'first_name': 'Mary', 'last_name': 'Doe', 'email': 'mary@example.com', 'phone_number': '+254700000001',
+           'street': '12 Moi Avenue', 'city': 'Nairobi', 'state': 'Nairobi', 'zip_code': '00100', 'country': 'Kenya'}
+
+
+def test_reposting_an_address_only_renames_recipients_without_parcels(client, make_user):
+    login(client, make_user('jane@example.com'))
+    first = client.post('/recipients', json=ADDRESS)
+    assert first.status_code == 201
+    renamed = client.post('/recipients', json=dict(ADDRESS, first_name='Maria', street=' 12 Moi Avenue,'))
+    assert renamed.status_code == 200
+    assert renamed.get_json()['first_name'] == 'Maria'
+
+    recipient_id = first.get_json()['id']
+    parcel = client.post('/parcels', json={'recipient_id': recipient_id, 'length': 1, 'width': 1, 'height': 1,
+                                           'weight': 1, 'status': 'Pending'})
+    assert parcel.status_code == 201
+    again = client.post('/recipients', json=dict(ADDRESS, first_name='R2', latitude=-1.28, longitude=36.82))
+    assert again.status_code == 200
+    assert again.get_json()['id'] == recipient_id
+    assert again.get_json()['first_name'] == 'Maria'
+    assert float(again.get_json()['latitude']) == -1.28 # Missing before, so still filled in
+    assert client.get(f"/parcels/{parcel.get_json()['id']}").get_json()['recipient']['first_name'] == 'Maria'
+
+
+def test_seeded_recipients_are_in_their_senders_address_books(client, database):
+    seed_database(users=5, recipients=40, parcels=200, echo=lambda message: None)
+    assert db.session.scalar(db.select(db.func.count()).select_from(Recipient).where(
+        (Recipient.user_id.is_(None)) | (Recipient.fingerprint.is_(None)))) == 0
+    mismatched = db.session.scalar(db.select(db.func.count()).select_from(Parcel).join(Recipient).where(
+        Parcel.user_id != Recipient.user_id))
+    assert mismatched == 0
+
+    user_id = db.session.scalar(db.select(Recipient.user_id).group_by(Recipient.user_id)
+                                .order_by(db.func.count().desc()).limit(1))
+    owned = db.session.scalar(db.select(db.func.count()).select_from(Recipient).where(Recipient.user_id == user_id))
+    login(client, user_id)
+    response = client.get('/user/recipients?limit=100')
+    assert response.status_code == 200
+    assert len(response.get_json()) == owned
+
+
+def _parcel(client, recipient_id):
+    response = client.post('/parcels', json={'recipient_id': recipient_id, 'length': 1, 'width': 1, 'height': 1,
+                                             'weight': 1, 'status': 'Pending'})
+    assert response.status_code == 201
+    return response.get_json()['id']
+
+
+def test_changing_one_orders_destination_leaves_the_other_parcels_alone(client, make_user):
+    login(client, make_user('jane@example.com'))
+    recipient_id = client.post('/recipients', json=ADDRESS).get_json()['id']
+    first, second = _parcel(client, recipient_id), _parcel(client, recipient_id)
+    moved = dict(ADDRESS, street='4 Kenyatta Avenue', city='Mombasa', zip_code='80100')
+    existing = client.post('/recipients', json=moved).get_json()['id'] # Already in the address book, no 409
+
+    response = client.patch(f'/recipients/{recipient_id}', json={'parcel_id': first, 'street': moved['street'],
+                                                                   'city': 'Mombasa', 'zip_code': '80100'})
+    assert response.status_code == 200
+    assert response.get_json()['id'] == existing
+
+    edited, untouched = client.get(f'/parcels/{first}').get_json(), client.get(f'/parcels/{second}').get_json()
+    assert (edited['recipient_id'], edited['city'], edited['street']) == (existing, 'Mombasa', '4 Kenyatta Avenue')
+    assert (untouched['recipient_id'], untouched['city']) == (recipient_id, 'Nairobi')
+    assert client.get(f'/recipients/{recipient_id}').get_json()['street'] == ADDRESS['street']
+
+    # A new address is copied into a new row, the old one still belongs to the second parcel
+    response = client.patch(f'/recipients/{recipient_id}', json={'city': 'Kisumu', 'street': '9 Oginga Odinga Street'})
+    assert response.status_code == 201
+    assert response.get_json()['id'] not in (recipient_id, existing)
+    assert client.get(f'/parcels/{second}').get_json()['city'] == 'Nairobi'
+
+
+def test_a_recipient_without_other_parcels_is_edited_in_place(client, make_user):
+    login(client, make_user('jane@example.com'))
+    recipient_id = client.post('/recipients', json=ADDRESS).get_json()['id']
+    parcel_id = _parcel(client, recipient_id)
+    response = client.patch(f'/recipients/{recipient_id}', json={'parcel_id': parcel_id, 'city': 'Thika'})
+    assert response.status_code == 200
+    assert response.get_json()['id'] == recipient_id
+    assert client.get(f'/parcels/{parcel_id}').get_json()['city'] == 'Thika'
+
+
+def test_only_the_owner_or_an_admin_may_edit_a_recipient(client, make_user):
+    owner, stranger, admin = make_user('jane@example.com'), make_user('john@example.com'), make_user('a@example.com', admin=True)
+    login(client, owner)
+    recipient_id = client.post('/recipients', json=ADDRESS).get_json()['id']
+
+    login(client, stranger)
+    assert client.patch(f'/recipients/{recipient_id}', json={'city': 'Thika'}).status_code == 404
+    login(client, admin)
+    assert client.patch(f'/recipients/{recipient_id}', json={'city': 'Thika'}).status_code == 200
+    assert client.patch(f'/recipients/{recipient_id}', json={'parcel_id': [1]}).status_code == 400
@@ -0,0 +1,28 @@
+# /server/tests/test_dispatch.py
+
+from config import app, db
+from models import Recipient, Parcel
+from dispatch import route_options
+from conftest import login
+
+
+def test_the_endpoint_clamps_stops_per_vehicle(client, make_user):
+    login(client, make_user('admin@example.com', admin=True))
+    recipient = Recipient(first_name='Amina', last_name='Otieno', email='amina@example.com', country='Kenya')
+    db.session.add(recipient)
+    db.session.flush()
+    db.session.add_all([Parcel(recipient_id=recipient.id, length=10, width=10, height=10, weight=1, status='Pending',
+                               latitude=-1.29 + index / 1000, longitude=36.82) for index in range(5)])
+    db.session.commit()
+
+    response = client.post('/admin/routes', json={'lat': -1.2921, 'lng': 36.8219, 'max_stops': 10000})
+    assert response.status_code == 200
+    plan = response.get_json()
+    assert plan['max_stops'] == app.config['ROUTE_STOPS_LIMIT']
+    assert plan['stops'] == 5
+
+
+def test_the_cli_is_not_clamped(database):
+    options = route_options({'lat': -1.2921, 'lng': 36.8219, 'max_stops': 5000})
+    assert options['max_stops'] == 5000
+    assert route_options({'lat': 0, 'lng': 0, 'max_stops': 20}, stops_limit=300)['max_stops'] == 20
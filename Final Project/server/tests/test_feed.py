@@ -0,0 +1,69 @@
+# /server/tests/test_feed.py
+
+import time
+
+import pytest
+
+from config import app
+from events import feed_waiters
+from conftest import login
+
+
+@pytest.fixture
+def user_client(client, make_user, monkeypatch):
+    monkeypatch.setitem(app.config, 'FEED_MAX_WAITERS', 1)
+    monkeypatch.setitem(app.config, 'FEED_STREAM_DURATION', 0.2)
+    login(client, make_user('jane@example.com'))
+    return client
+
+
+def test_streams_over_the_cap_are_turned_away(user_client):
+    first = user_client.get('/user/parcels/changes/stream?since=0', buffered=False)
+    assert first.status_code == 200
+    assert feed_waiters.active == 1
+
+    second = user_client.get('/user/parcels/changes/stream?since=0')
+    assert second.status_code == 503
+    assert second.headers['Retry-After']
+
+    started = time.monotonic()
+    poll = user_client.get('/user/parcels/changes?since=0&wait=10')
+    assert time.monotonic() - started < 1 # Answered at once instead of holding another thread
+    assert poll.get_json() == {'changes': [], 'cursor': 0}
+    assert poll.headers['Retry-After']
+
+    first.close()
+    assert feed_waiters.active == 0
+
+
+def test_stream_ends_and_sends_its_cursor(user_client):
+    started = time.monotonic()
+    response = user_client.get('/user/parcels/changes/stream?since=7')
+    assert response.get_data(as_text=True).startswith('retry: 2000\nid: 7\n\n')
+    assert time.monotonic() - started < 1
+    response.close() # What the WSGI server does once the stream is written
+    assert feed_waiters.active == 0
+
+
+def test_long_poll_waits_within_the_cap(user_client):
+    started = time.monotonic()
+    response = user_client.get('/user/parcels/changes?since=0&wait=0.3')
+    assert time.monotonic() - started >= 0.3
+    assert 'Retry-After' not in response.headers
+    assert feed_waiters.active == 0
+
+
+def test_the_default_config_lets_a_single_threaded_worker_wait(client, make_user, monkeypatch):
+    # No FEED_MAX_WAITERS override: one gunicorn thread still gets a waiting slot instead of none
+    monkeypatch.setitem(app.config, 'FEED_STREAM_DURATION', 0.2)
+    login(client, make_user('jane@example.com'))
+    assert app.config['FEED_MAX_WAITERS'] >= 1
+
+    response = client.get('/user/parcels/changes/stream?since=0')
+    assert response.status_code == 200
+    response.close()
+
+    started = time.monotonic()
+    poll = client.get('/user/parcels/changes?since=0&wait=0.3')
+    assert time.monotonic() - started >= 0.3
+    assert 'Retry-After' not in poll.headers
@@ -0,0 +1,39 @@
+# /server/tests/test_ingest.py
+
+from config import db
+from models import Recipient, Parcel
+from conftest import login
+
+PARCEL = {'length': 10, 'width': 10, 'height': 10, 'weight': 1}
+
+
+def add_recipient(user_id, email, latitude=-1.29):
+    recipient = Recipient(user_id=user_id, first_name='R', last_name=email, email=email, latitude=latitude,
+                          longitude=36.82)
+    db.session.add(recipient)
+    db.session.commit()
+    return recipient.id
+
+
+def bulk(client, rows):
+    response = client.post('/parcels/bulk', json=rows)
+    assert response.status_code == 200
+    return response.get_json()['results']
+
+
+def test_recipients_are_looked_up_in_the_callers_address_book(client, make_user):
+    alice, bob = make_user('alice@example.com'), make_user('bob@example.com')
+    own = add_recipient(alice, 'Mary.Doe@Example.com')
+    others = add_recipient(bob, 'john@example.com', latitude=4.0)
+    login(client, alice)
+
+    results = bulk(client, [
+        dict(PARCEL, recipient_email='mary.doe@example.COM'),
+        dict(PARCEL, recipient_email='john@example.com'),
+        dict(PARCEL, recipient_id=own),
+        dict(PARCEL, recipient_id=others),
+    ])
+    assert [result.get('error') for result in results] == [None, 'Recipient not found', None, 'Recipient not found']
+    parcels = db.session.execute(db.select(Parcel.recipient_id, Parcel.latitude)).all()
+    assert sorted(recipient_id for recipient_id, _ in parcels) == [own, own]
+    assert all(float(latitude) == -1.29 for _, latitude in parcels)
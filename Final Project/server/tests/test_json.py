@@ -0,0 +1,53 @@
+# /server/tests/test_json.py
+
+from datetime import datetime
+from decimal import Decimal
+
+import pytest
+from flask import jsonify
+
+import serializers
+from config import app
+from conftest import login
+
+
+@pytest.fixture(params=['orjson', 'stdlib'])
+def encoder(request, monkeypatch):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+    else:
+        monkeypatch.setattr(serializers, 'orjson', None) # As if orjson wasn't installed
+    return request.param
+
+
+def test_dumps_is_compact_and_handles_decimals_and_datetimes(encoder):
+    payload = {'b': Decimal('1.50'), 'a': datetime(2024, 5, 31, 12, 30), 'c': 'Nairobi – Mombasa'}
+    assert serializers.dumps(payload) == '{"a":"2024-05-31 12:30:00","b":"1.50","c":"Nairobi – Mombasa"}'.encode()
+
+
+def test_jsonify_and_resources_use_dumps(encoder, client, make_user):
+    with app.test_request_context():
+        assert jsonify({'cost': Decimal('2.00')}).get_data() == b'{"cost":"2.00"}\n'
+    assert client.get('/').get_data() == b'{"message":"SendIT API is running"}\n'
+    user_id = make_user('jane@example.com')
+    response = client.post('/login', json={'email': 'jane@example.com', 'password': 'secret1'})
+    assert response.status_code == 200
+    assert response.get_json()['user']['id'] == user_id
+    login(client, user_id)
+    assert client.get('/parcels').get_data() == b'[]\n'
+
+
+def test_provider_passes_options_through(encoder):
+    with app.app_context():
+        assert app.json.dumps({'b': 1, 'a': Decimal('2')}, indent=1, sort_keys=True) == '{\n "a": "2",\n "b": 1\n}'
+
+
+def test_large_bodies_are_compressed(client, make_user, monkeypatch):
+    import gzip
+    monkeypatch.setitem(app.config, 'JSON_COMPRESS_MIN_SIZE', 10)
+    login(client, make_user('jane@example.com'))
+    response = client.get('/check_session', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert b'"email":"jane@example.com"' in gzip.decompress(response.get_data())
+    assert 'Content-Encoding' not in client.get('/check_session').headers
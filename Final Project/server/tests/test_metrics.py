@@ -0,0 +1,32 @@
+# /server/tests/test_metrics.py
+
+# /metrics only exists with INSTRUMENTATION=true, which has to be set before the app registers its routes, so
+# these run on a bare Flask app with just the instrumentation
+
+from flask import Flask
+
+from instrumentation import init_instrumentation
+from policy import build_route_policies, PUBLIC, ADMIN
+
+
+def _metrics_app(token):
+    app = Flask(__name__)
+    app.config.update(INSTRUMENTATION=True, METRICS_TOKEN=token)
+    init_instrumentation(app)
+    return app
+
+
+def test_metrics_are_admin_only_without_a_token():
+    assert build_route_policies(_metrics_app(None))['metrics'] == ADMIN
+    assert build_route_policies(_metrics_app(''))['metrics'] == ADMIN
+
+
+def test_metrics_need_the_token_when_one_is_set():
+    app = _metrics_app('s3cret')
+    assert build_route_policies(app)['metrics'] == PUBLIC # The scraper has a token, not a session
+    client = app.test_client()
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+    response = client.get('/metrics', headers={'Authorization': 'Bearer s3cret'})
+    assert response.status_code == 200
+    assert response.mimetype == 'text/plain'
@@ -0,0 +1,110 @@
+# /server/tests/test_outbox.py
+
+# Drains the outbox against a local aiosmtpd server, like the outbox-worker command does against a real one.
+
+import socket
+import threading
+import time
+from datetime import timedelta
+from email import message_from_bytes
+
+import pytest
+from flask_mail import Mail
+
+from config import app, db
+from models import EmailOutbox
+from outbox import (enqueue_email, drain_outbox, claim_batch, utcnow, OutboxWorkerPool, OUTBOX_MAX_ATTEMPTS,
+                    OUTBOX_CLAIM_TIMEOUT)
+
+aiosmtpd = pytest.importorskip('aiosmtpd.controller')
+
+
+class Recorder:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.subjects = []
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address.startswith('reject'):
+            return '550 No such user'
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        with self.lock:
+            self.subjects.append(message_from_bytes(envelope.content)['Subject'])
+        return '250 Message accepted'
+
+
+@pytest.fixture
+def smtp(database, monkeypatch):
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    recorder = Recorder()
+    controller = aiosmtpd.Controller(recorder, hostname='127.0.0.1', port=port)
+    controller.start()
+    config = {'MAIL_SERVER': '127.0.0.1', 'MAIL_PORT': port, 'MAIL_DEFAULT_SENDER': 'noreply@example.com'}
+    monkeypatch.setitem(app.extensions, 'mail', Mail().init_mail(config))
+    monkeypatch.setitem(app.config, 'MAIL_USERNAME', None)
+    monkeypatch.setitem(app.config, 'MAIL_DEFAULT_SENDER', 'noreply@example.com')
+    yield recorder
+    controller.stop()
+
+
+def statuses():
+    db.session.expire_all()
+    return dict(db.session.execute(db.select(EmailOutbox.subject, EmailOutbox.status)).all())
+
+
+def test_drain_sends_and_retries_rejected_messages(smtp):
+    enqueue_email('jane@example.com', 'Delivered', 'Your parcel arrived')
+    enqueue_email('reject@example.com', 'Bounced', 'Nobody home')
+    assert drain_outbox() == 2
+    assert smtp.subjects == ['Delivered']
+    assert statuses() == {'Delivered': 'sent', 'Bounced': 'pending'}
+    assert drain_outbox() == 0 # The bounce waits for its backoff
+
+
+def test_worker_pool_sends_every_message_once(smtp):
+    subjects = [f'Parcel {number}' for number in range(60)]
+    for subject in subjects:
+        enqueue_email('jane@example.com', subject, 'Status update', commit=False)
+    db.session.commit()
+
+    pool = OutboxWorkerPool(app, workers=4, poll_interval=0.05, batch_size=5)
+    pool.start()
+    deadline = time.monotonic() + 20
+    while len(smtp.subjects) < len(subjects) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    time.sleep(0.3) # A duplicate would show up now
+    pool.stop(timeout=5)
+
+    assert sorted(smtp.subjects) == sorted(subjects)
+    assert set(statuses().values()) == {'sent'}
+
+
+def test_stale_claims_count_as_attempts(database):
+    # A worker died while sending: every reclaim is an attempt, until the message is dead-lettered
+    crashing = enqueue_email('jane@example.com', 'Crashes its worker', 'Huge attachment')
+    fine = enqueue_email('john@example.com', 'Fine', 'Status update')
+    crashing_id, fine_id = crashing.id, fine.id
+
+    def crash():
+        db.session.execute(db.update(EmailOutbox).where(EmailOutbox.id == crashing_id).values(
+            status='sending', locked_at=utcnow() - timedelta(seconds=OUTBOX_CLAIM_TIMEOUT + 1)))
+        db.session.commit()
+
+    attempts = []
+    for _ in range(OUTBOX_MAX_ATTEMPTS - 1):
+        crash()
+        batch = claim_batch()
+        assert [row.id for row in batch] == [crashing_id] + ([fine_id] if not attempts else [])
+        attempts.append(batch[0].attempts)
+    assert attempts == list(range(1, OUTBOX_MAX_ATTEMPTS))
+
+    crash()
+    assert claim_batch() == []
+    db.session.expire_all()
+    assert db.session.get(EmailOutbox, crashing_id).status == 'dead'
+    assert db.session.get(EmailOutbox, crashing_id).attempts == OUTBOX_MAX_ATTEMPTS
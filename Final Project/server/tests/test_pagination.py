@@ -0,0 +1,21 @@
+# /server/tests/test_pagination.py
+
+import json
+
+from conftest import login
+
+
+def _ndjson(response):
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_ndjson_honours_limit(client, make_user):
+    login(client, make_user('admin@example.com', admin=True))
+    for index in range(5):
+        make_user(f'user{index}@example.com')
+
+    everyone = _ndjson(client.get('/users?format=ndjson'))
+    assert len(everyone) == 6
+    assert _ndjson(client.get('/users?format=ndjson&limit=2')) == everyone[:2]
+    after = everyone[1]['id']
+    assert _ndjson(client.get(f'/users?format=ndjson&after_id={after}&limit=3')) == everyone[2:5]
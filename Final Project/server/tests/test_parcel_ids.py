@@ -0,0 +1,19 @@
+# /server/tests/test_parcel_ids.py
+
+# Parcels created through the ORM get an id from the database on SQLite too, after the migrations
+
+from config import db
+from models import Recipient, Parcel
+
+
+def test_new_parcels_get_increasing_ids(database):
+    recipient = Recipient(first_name='Amina', last_name='Otieno', email='amina@example.com')
+    db.session.add(recipient)
+    db.session.flush()
+    parcels = [Parcel(recipient_id=recipient.id, length=1, width=1, height=1, weight=1, status='Pending')
+               for _ in range(3)]
+    db.session.add_all(parcels)
+    db.session.commit()
+    ids = [parcel.id for parcel in parcels]
+    assert None not in ids
+    assert ids == sorted(set(ids))
@@ -0,0 +1,33 @@
+# /server/tests/test_passwords.py
+
+import threading
+import time
+
+import pytest
+
+from passwords import HashingPool, PasswordHashingBusy
+
+
+def test_a_timed_out_hash_keeps_its_slot_until_it_finishes():
+    pool = HashingPool(workers=1, pending=1, timeout=0.5)
+    release = threading.Event()
+    try:
+        with pytest.raises(PasswordHashingBusy):
+            pool.run(release.wait, 5) # Gave up waiting, still hashing
+        started = time.monotonic()
+        with pytest.raises(PasswordHashingBusy):
+            pool.run(len, 'password')
+        assert time.monotonic() - started < 0.2 # Turned away at once instead of queueing behind it
+
+        release.set()
+        deadline = time.monotonic() + 2
+        while True:
+            try:
+                assert pool.run(len, 'password') == 8
+                break
+            except PasswordHashingBusy:
+                assert time.monotonic() < deadline
+                time.sleep(0.01)
+    finally:
+        release.set()
+        pool.shutdown()
@@ -0,0 +1,137 @@
+# /server/tests/test_policy.py
+
+# The auth gate (policy.py) on every protected endpoint and method: anonymous requests get 401, users without
+# the admin role 403 on admin routes, and whoever the policy lets in gets through to the handler.
+
+import pytest
+
+from config import app, db
+from models import Recipient, Parcel, BillingAddress, Role
+import policy as policy_module
+from policy import build_route_policies, PUBLIC, ADMIN
+from conftest import login
+
+RECIPIENT = {'first_name': 'Amina', 'last_name': 'Otieno', 'email': 'amina@example.com', 'phone_number': '0712345678',
+             'street': '12 Moi Avenue', 'city': 'Nairobi', 'state': 'Nairobi', 'zip_code': '00100', 'country': 'Kenya'}
+PARCEL = {'length': 10, 'width': 10, 'height': 10, 'weight': 2, 'status': 'Pending'}
+
+# (endpoint, method) -> (url, JSON body) that the handler answers with 2xx. {user}, {recipient}... are the ids
+# made by the `world` fixture
+REQUESTS = {
+    ('admindashboard', 'GET'): ('/admin/dashboard', None),
+    ('adminroutes', 'POST'): ('/admin/routes', {'lat': -1.2921, 'lng': 36.8219}),
+    ('parcelsnearby', 'GET'): ('/parcels/nearby?lat=-1.2921&lng=36.8219&radius=10', None),
+    ('billingaddresses', 'GET'): ('/billing_addresses', None),
+    ('billingaddresses', 'POST'): ('/billing_addresses', {'street': '1 Kenyatta Avenue', 'city': 'Nairobi', 'country': 'Kenya'}),
+    ('billingaddressesbyid', 'GET'): ('/billing_addresses/{billing_address}', None),
+    ('billingaddressesbyid', 'PATCH'): ('/billing_addresses/{billing_address}', {'city': 'Kisumu'}),
+    ('billingaddressesbyid', 'DELETE'): ('/billing_addresses/{billing_address}', None),
+    ('parcels', 'GET'): ('/parcels', None),
+    ('parcels', 'POST'): ('/parcels', dict(PARCEL, recipient_id='{recipient}')),
+    ('parcelsbyid', 'GET'): ('/parcels/{parcel}', None),
+    ('parcelsbyid', 'PATCH'): ('/parcels/{parcel}', {'status': 'Accepted'}),
+    ('parcelsbyid', 'DELETE'): ('/parcels/{parcel}', None),
+    ('parcelsbulk', 'POST'): ('/parcels/bulk', [dict(PARCEL, recipient_id='{recipient}')]),
+    ('quotes', 'POST'): ('/quotes', dict(PARCEL, origin={'latitude': -1.2921, 'longitude': 36.8219},
+                                         destination={'latitude': -0.0917, 'longitude': 34.768})),
+    ('recipients', 'GET'): ('/recipients', None),
+    ('recipients', 'POST'): ('/recipients', dict(RECIPIENT, email='baraka@example.com')),
+    ('recipientsbyid', 'GET'): ('/recipients/{recipient}', None),
+    ('recipientsbyid', 'PATCH'): ('/recipients/{recipient}', {'phone_number': '0722000000'}),
+    ('recipientsbyid', 'DELETE'): ('/recipients/{recipient}', None),
+    ('recipientsbatch', 'POST'): ('/recipients/batch', {'ids': ['{recipient}']}),
+    ('roles', 'GET'): ('/roles', None),
+    ('roles', 'POST'): ('/roles', {'name': 'dispatcher'}),
+    ('rolesbyid', 'GET'): ('/roles/{role}', None),
+    ('rolesbyid', 'PATCH'): ('/roles/{role}', {'name': 'driver'}),
+    ('rolesbyid', 'DELETE'): ('/roles/{role}', None),
+    ('sendemail', 'POST'): ('/send-email', {'to': 'amina@example.com', 'subject': 'Hello', 'body': 'On its way'}),
+    ('parcelsbyuserid', 'GET'): ('/user/parcels', None),
+    ('recipientsbyuserid', 'GET'): ('/user/recipients', None),
+    ('parcelchanges', 'GET'): ('/user/parcels/changes?since=0', None),
+    ('parcelchangesstream', 'GET'): ('/user/parcels/changes/stream?since=0', None),
+    ('users', 'GET'): ('/users', None),
+    ('users', 'POST'): ('/users', {'first_name': 'Baraka', 'last_name': 'Mwangi', 'email': 'baraka@example.com',
+                                   'password': 'secret1'}),
+    ('usersbyid', 'GET'): ('/users/{user}', None),
+    ('usersbyid', 'PATCH'): ('/users/{user}', {'first_name': 'Janet'}),
+    ('usersbyid', 'DELETE'): ('/users/{spare_user}', None), # {user} still owns parcels
+}
+
+with app.app_context():
+    POLICIES = build_route_policies(app)
+PROTECTED = sorted((rule.endpoint, method) for rule in app.url_map.iter_rules() if POLICIES[rule.endpoint] != PUBLIC
+                   for method in rule.methods - {'HEAD', 'OPTIONS'})
+
+
+def _fill(value, ids):
+    # The ids go in as ints where the template has just '{name}'
+    if isinstance(value, dict):
+        return {key: _fill(item, ids) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, ids) for item in value]
+    if isinstance(value, str) and value.startswith('{') and value.endswith('}'):
+        return ids[value[1:-1]]
+    return value
+
+
+def _request(client, endpoint, method, ids):
+    url, body = REQUESTS[endpoint, method]
+    return client.open(url.format(**ids), method=method, json=_fill(body, ids), buffered=False)
+
+
+@pytest.fixture
+def world(make_user, monkeypatch):
+    monkeypatch.setitem(app.config, 'FEED_MAX_WAITERS', 1)
+    monkeypatch.setitem(app.config, 'FEED_STREAM_DURATION', 0.1)
+    ids = {'admin': make_user('admin@example.com', admin=True), 'user': make_user('jane@example.com'),
+           'spare_user': make_user('spare@example.com')}
+    recipient = Recipient(user_id=ids['user'], latitude=-1.2921, longitude=36.8219, **RECIPIENT)
+    role = Role(name='courier')
+    billing_address = BillingAddress(user_id=ids['user'], street='5 Moi Avenue', city='Nairobi', country='Kenya')
+    db.session.add_all([recipient, role, billing_address])
+    db.session.flush()
+    parcel = Parcel(user_id=ids['user'], recipient_id=recipient.id, latitude=recipient.latitude,
+                    longitude=recipient.longitude, **PARCEL)
+    db.session.add(parcel)
+    db.session.commit()
+    ids.update(recipient=recipient.id, role=role.id, billing_address=billing_address.id, parcel=parcel.id)
+    return ids
+
+
+def test_every_protected_route_is_covered():
+    assert sorted(REQUESTS) == PROTECTED
+
+
+@pytest.mark.parametrize('endpoint, method', PROTECTED)
+def test_anonymous_requests_are_refused(client, world, endpoint, method):
+    response = _request(client, endpoint, method, world)
+    assert response.status_code == 401, response.get_data(as_text=True)
+    assert response.get_json() == {'message': 'Unauthorized access'}
+
+
+@pytest.mark.parametrize('endpoint, method', [key for key in PROTECTED if POLICIES[key[0]] == ADMIN])
+def test_admin_routes_refuse_other_users(client, world, endpoint, method):
+    login(client, world['user'])
+    response = _request(client, endpoint, method, world)
+    assert response.status_code == 403, response.get_data(as_text=True)
+
+
+@pytest.mark.parametrize('endpoint, method', PROTECTED)
+def test_allowed_users_get_through(client, world, endpoint, method):
+    login(client, world['admin' if POLICIES[endpoint] == ADMIN else 'user'])
+    response = _request(client, endpoint, method, world)
+    try:
+        assert 200 <= response.status_code < 300, response.get_data(as_text=True)
+    finally:
+        response.close() # As the WSGI server does, frees the change stream's slot
+
+
+def test_policies_compare_by_value(client, world, monkeypatch):
+    # Equal but not the same str objects, as policies read from config or copied would be
+    copies = {endpoint: ''.join(list(policy)) for endpoint, policy in policy_module._policies.items()}
+    assert copies['track'] is not PUBLIC
+    monkeypatch.setattr(policy_module, '_policies', copies)
+    assert client.get('/track/unknown').status_code != 401
+    login(client, world['user'])
+    assert client.get('/admin/dashboard').status_code == 403
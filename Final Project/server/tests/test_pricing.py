@@ -0,0 +1,87 @@
+# /server/tests/test_pricing.py
+
+import random
+
+import pytest
+
+from config import db
+from models import Recipient, BillingAddress
+from geo import haversine_km
+from pricing import price, distance_km
+from conftest import login
+
+PARCEL = {'length': 40, 'width': 30, 'height': 20, 'weight': 3}
+
+
+@pytest.fixture
+def user_client(client, make_user):
+    user_id = make_user('jane@example.com')
+    login(client, user_id)
+    return client, user_id
+
+
+def test_single_and_batch_quotes_agree(user_client):
+    client, _ = user_client
+    rng = random.Random(5)
+    items = []
+    for _ in range(50):
+        items.append(dict(PARCEL, origin={'latitude': rng.uniform(-4.5, 4.5), 'longitude': rng.uniform(29.5, 41.5)},
+                          destination={'latitude': rng.uniform(-4.5, 4.5), 'longitude': rng.uniform(29.5, 41.5)},
+                          weight=rng.uniform(0.1, 40)))
+    batch = client.post('/quotes', json=items).get_json()
+    for index, item in enumerate(items):
+        single = client.post('/quotes', json=item)
+        assert single.status_code == 200
+        assert dict(single.get_json(), index=index) == batch[index]
+
+
+def test_quotes_use_the_exact_distance(user_client):
+    client, _ = user_client
+    # Both points are in the same ~1km geohash-6 cell, which single quotes used to price as 0km apart
+    item = dict(PARCEL, origin={'latitude': -1.2921, 'longitude': 36.8219},
+                destination={'latitude': -1.2951, 'longitude': 36.8249})
+    expected = haversine_km(-1.2921, 36.8219, -1.2951, 36.8249)
+    response = client.post('/quotes', json=item).get_json()
+    assert response == price(expected, 40, 30, 20, 3)
+    assert distance_km(-1.2951, 36.8249, -1.2921, 36.8219) == distance_km(-1.2921, 36.8219, -1.2951, 36.8249)
+
+
+def test_stored_coordinates_are_looked_up_by_id(user_client):
+    client, user_id = user_client
+    recipient = Recipient(user_id=user_id, first_name='Amina', last_name='Otieno', email='amina@example.com',
+                          latitude=-0.0917, longitude=34.768)
+    billing_address = BillingAddress(user_id=user_id, street='1 Moi Avenue', latitude=-1.2921, longitude=36.8219)
+    db.session.add_all([recipient, billing_address])
+    db.session.commit()
+    item = dict(PARCEL, recipient_id=recipient.id, billing_address_id=billing_address.id)
+    response = client.post('/quotes', json=item)
+    assert response.status_code == 200
+    assert response.get_json() == price(haversine_km(-1.2921, 36.8219, -0.0917, 34.768), 40, 30, 20, 3)
+    assert client.post('/quotes', json=[item]).get_json()[0]['cost'] == response.get_json()['cost']
+
+
+@pytest.mark.parametrize('field, value', [('recipient_id', [1]), ('recipient_id', {'id': 1}), ('recipient_id', '1'),
+                                          ('billing_address_id', [1]), ('billing_address_id', True)])
+def test_ids_must_be_integers(user_client, field, value):
+    client, _ = user_client
+    # The id is used first: a recipient_id instead of a destination, a billing_address_id before the origin
+    item = dict(PARCEL, **{field: value})
+    if field == 'recipient_id':
+        item['origin'] = {'latitude': 1, 'longitude': 35}
+    response = client.post('/quotes', json=item)
+    assert response.status_code == 400
+    assert response.get_json() == {'message': f"'{field}' must be an integer id"}
+
+    batch = client.post('/quotes', json=[item, dict(PARCEL, destination={'latitude': 0, 'longitude': 35},
+                                                    origin={'latitude': 1, 'longitude': 35})])
+    assert batch.status_code == 200
+    assert batch.get_json()[0] == {'index': 0, 'error': f"'{field}' must be an integer id"}
+    assert 'cost' in batch.get_json()[1]
+
+
+def test_bad_coordinates_are_a_400(user_client):
+    client, _ = user_client
+    for destination in ({'latitude': [1], 'longitude': 2}, {'latitude': 'north', 'longitude': 2},
+                        {'latitude': 91, 'longitude': 2}):
+        item = dict(PARCEL, origin={'latitude': 0, 'longitude': 0}, destination=destination)
+        assert client.post('/quotes', json=item).status_code == 400
@@ -0,0 +1,60 @@
+# /server/tests/test_query_budget.py
+
+# The list endpoints run a fixed number of queries however many rows they return, and the budget guard
+# (loading.py) fails a request that goes over
+
+import pytest
+from sqlalchemy import event, func, select
+
+from config import app, db
+from models import Parcel
+from loading import QueryBudgetExceeded
+from seed import seed_database
+from conftest import login
+
+
+@pytest.fixture
+def seeded(database, make_user, monkeypatch):
+    monkeypatch.setitem(app.config, 'TESTING', True) # Turns the budget guard on
+    seed_database(users=5, recipients=40, parcels=200, echo=lambda message: None)
+    return make_user('ops@example.com', admin=True)
+
+
+@pytest.fixture
+def queries():
+    statements = []
+
+    def count(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', count)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', count)
+
+
+def _count(client, queries, url):
+    queries.clear()
+    response = client.get(url)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    return len(queries), response.get_json()
+
+
+@pytest.mark.parametrize('url', ['/parcels?limit={limit}', '/users?limit={limit}', '/recipients?limit={limit}',
+                                 '/billing_addresses?limit={limit}', '/user/parcels?limit={limit}'])
+def test_list_queries_do_not_grow_with_rows(client, seeded, queries, url):
+    user_id = seeded
+    if url.startswith('/user/'):
+        user_id = db.session.scalar(select(Parcel.user_id).group_by(Parcel.user_id).order_by(func.count().desc()))
+    login(client, user_id)
+    client.get(url.format(limit=1)) # Warm up the principal cache
+    few, _ = _count(client, queries, url.format(limit=2))
+    many, payload = _count(client, queries, url.format(limit=30))
+    assert len(payload) > 2
+    assert few == many <= app.config['QUERY_BUDGET'], queries
+
+
+def test_over_budget_requests_fail(client, seeded, monkeypatch):
+    login(client, seeded)
+    monkeypatch.setitem(app.config, 'QUERY_BUDGET', 0)
+    with pytest.raises(QueryBudgetExceeded):
+        client.get('/parcels')
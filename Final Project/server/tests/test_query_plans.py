@@ -0,0 +1,147 @@
+# /server/tests/test_query_plans.py
+
+# Query plan regression check for the hot parcel queries.
+# Builds the same statements the endpoints run and EXPLAINs them against a generated dataset: each one fails when
+# it reads parcels (or parcel_events, recipients) with a full table scan instead of an index. The migrations are
+# applied first, so this also checks they create the indexes. The data is generated in one transaction that is
+# rolled back afterwards. QUERY_PLAN_PARCELS, QUERY_PLAN_USERS and QUERY_PLAN_RECIPIENTS set its size,
+# benchmarks/check_query_plans.py runs this module against any database.
+
+import json
+import os
+import random
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import select, insert, text
+
+from config import db, app
+from models import User, Recipient, Parcel, ParcelEvent
+from loading import PARCEL_PROFILE
+from pagination import keyset_statement
+from geo import geohash_encode, GEOHASH_PRECISION
+from spatial import open_parcels_statement, geohash_statement
+from dispatch import pending_stops_statement
+
+CHECKED_TABLES = {'parcels', 'parcel_events', 'recipients'}
+STATUSES = ['Delivered'] * 17 + ['Pending', 'Accepted', 'Out For Delivery'] # Most parcels end up delivered
+COUNTRIES = ['Kenya', 'Uganda', 'Tanzania', 'Rwanda', 'Ethiopia']
+
+
+def generate(parcels, users, recipients):
+    rng = random.Random(42)
+    now = datetime.now(timezone.utc)
+    db.session.execute(insert(User), [
+        {'id': i, 'first_name': 'User', 'last_name': str(i), 'email': f'user{i}@example.com', 'password': 'x' * 60,
+         'fs_uniquifier': uuid.uuid4().hex}
+        for i in range(1, users + 1)
+    ])
+    db.session.execute(insert(Recipient), [
+        {'id': i, 'first_name': 'Recipient', 'last_name': str(i), 'email': f'recipient{i}@example.com',
+         'fs_uniquifier': uuid.uuid4().hex, 'country': rng.choice(COUNTRIES), 'user_id': rng.randint(1, users),
+         'fingerprint': uuid.uuid4().hex}
+        for i in range(1, recipients + 1)
+    ])
+    rows = []
+    for i in range(1, parcels + 1):
+        latitude, longitude = rng.uniform(-4.5, 4.5), rng.uniform(29.5, 41.5)
+        rows.append({
+            'latitude': latitude, 'longitude': longitude, 'geohash': geohash_encode(latitude, longitude, GEOHASH_PRECISION),
+            'id': i, 'user_id': rng.randint(1, users), 'recipient_id': rng.randint(1, recipients),
+            'length': 10, 'width': 10, 'height': 10, 'weight': 1, 'cost': rng.randint(1, 500),
+            'status': rng.choice(STATUSES), 'country': rng.choice(COUNTRIES), 'tracking_number': uuid.uuid4().hex,
+            'created_at': now - timedelta(minutes=rng.randint(0, 365 * 24 * 60)),
+        })
+        if len(rows) == 5000:
+            db.session.execute(insert(Parcel), rows)
+            rows = []
+    if rows:
+        db.session.execute(insert(Parcel), rows)
+    db.session.execute(insert(ParcelEvent), [
+        {'id': i, 'parcel_id': i, 'user_id': rng.randint(1, users), 'event_type': 'created', 'status': 'Pending'}
+        for i in range(1, parcels + 1)
+    ])
+    db.session.execute(text('ANALYZE'))
+
+
+def hot_queries():
+    user_id, recipient_id = 7, 11
+    since = datetime.now(timezone.utc) - timedelta(days=3)
+    collection = PARCEL_PROFILE.collection
+    return {
+        'user parcels (ParcelsByUserID)': PARCEL_PROFILE.query().filter_by(user_id=user_id).statement,
+        'user parcels, newest first': keyset_statement(
+            Parcel, stmt=select(Parcel).where(Parcel.user_id == user_id), sort=[(Parcel.created_at, True)]
+        ).limit(101),
+        'recipient parcels': select(Parcel.id).where(Parcel.recipient_id == recipient_id),
+        'created_after range (/parcels?created_after=)':
+            collection.parse({'created_after': since.isoformat()}).statement(PARCEL_PROFILE.select()),
+        'newest first page (/parcels?sort=-created_at)':
+            keyset_statement(Parcel, stmt=select(Parcel), sort=[(Parcel.created_at, True)]).limit(101),
+        'open parcels (/parcels?status=Pending)':
+            collection.parse({'status': 'Pending'}).statement(select(Parcel)),
+        'tracking lookup (/track/<tracking_number>)':
+            select(Parcel.status, Parcel.city).where(Parcel.tracking_number == uuid.uuid4().hex),
+        'change feed (/user/parcels/changes)':
+            select(ParcelEvent).where(ParcelEvent.user_id == user_id, ParcelEvent.id > 100)
+            .order_by(ParcelEvent.id).limit(500),
+        'open parcel index load (/parcels/nearby)': open_parcels_statement(),
+        'parcels near a depot (/parcels/nearby?scope=all)': geohash_statement(-1.2921, 36.8219, 25),
+        'stops to route (/admin/routes)': pending_stops_statement(),
+        'stops to route for a day (/admin/routes)': pending_stops_statement(since.date()),
+        'address book upsert (POST /recipients)':
+            select(Recipient).where(Recipient.user_id == user_id, Recipient.fingerprint == uuid.uuid4().hex),
+        'address book (/user/recipients)':
+            keyset_statement(Recipient, stmt=select(Recipient).where(Recipient.user_id == user_id)).limit(101),
+    }
+
+
+def explain(stmt):
+    # Returns (plan lines, full scans of the checked tables)
+    dialect = db.session.get_bind().dialect
+    sql = str(stmt.compile(dialect=dialect, compile_kwargs={'literal_binds': True}))
+    if dialect.name == 'postgresql':
+        plan = db.session.execute(text('EXPLAIN (FORMAT JSON) ' + sql)).scalar_one()
+        plan = json.loads(plan) if isinstance(plan, str) else plan
+        lines, scans = [], []
+
+        def walk(node, depth=0):
+            relation = node.get('Relation Name')
+            lines.append('  ' * depth + node['Node Type'] + (f' on {relation}' if relation else '') +
+                         (f" using {node['Index Name']}" if 'Index Name' in node else ''))
+            if node['Node Type'] == 'Seq Scan' and relation in CHECKED_TABLES:
+                scans.append(relation)
+            for child in node.get('Plans', ()):
+                walk(child, depth + 1)
+        walk(plan[0]['Plan'])
+        return lines, scans
+
+    lines = [row[3] for row in db.session.execute(text('EXPLAIN QUERY PLAN ' + sql))]
+    scans = [match.group(1) for line in lines for match in [re.match(r'SCAN (\w+)$', line.split(' AS ')[0].strip())]
+             if match and match.group(1) in CHECKED_TABLES]
+    return lines, scans
+
+
+with app.app_context(): # The statements are built again once there is data, only the names are needed here
+    HOT_QUERIES = list(hot_queries())
+
+
+@pytest.fixture(scope='module')
+def dataset(schema):
+    with app.app_context():
+        generate(int(os.getenv('QUERY_PLAN_PARCELS', 50000)), int(os.getenv('QUERY_PLAN_USERS', 500)),
+                 int(os.getenv('QUERY_PLAN_RECIPIENTS', 5000)))
+        try:
+            yield hot_queries()
+        finally:
+            db.session.rollback()
+            db.session.remove()
+
+
+@pytest.mark.parametrize('name', HOT_QUERIES)
+def test_hot_query_uses_an_index(dataset, name):
+    lines, scans = explain(dataset[name])
+    print('\n'.join([name] + [f"    {line}" for line in lines])) # Shown with -s
+    assert not scans, f"full scan of {', '.join(sorted(set(scans)))}:\n" + '\n'.join(lines)
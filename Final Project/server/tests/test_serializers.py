@@ -0,0 +1,37 @@
+# /server/tests/test_serializers.py
+
+# The precompiled serializers (serializers.py) have to give exactly what to_dict() gives with the profile's rules,
+# for every loading profile the endpoints use
+
+import pytest
+from sqlalchemy import func, select
+
+from config import db
+from models import Recipient, Parcel
+from loading import (PARCEL_PROFILE, USER_LIST_PROFILE, USER_DETAIL_PROFILE, RECIPIENT_PROFILE,
+                     BILLING_ADDRESS_PROFILE, ROLE_PROFILE)
+from seed import seed_database
+
+PROFILES = {'parcel': PARCEL_PROFILE, 'user_list': USER_LIST_PROFILE, 'user_detail': USER_DETAIL_PROFILE,
+            'recipient': RECIPIENT_PROFILE, 'billing_address': BILLING_ADDRESS_PROFILE, 'role': ROLE_PROFILE}
+
+
+@pytest.fixture
+def seeded(database):
+    seed_database(users=5, recipients=20, parcels=60, echo=lambda message: None)
+    # Rows with the nullable columns empty too
+    recipient = Recipient(first_name='Amina', last_name='Otieno', email='amina@example.com', city='Nairobi', country='Kenya')
+    db.session.add(recipient)
+    db.session.flush()
+    db.session.add(Parcel(user_id=db.session.scalar(select(func.min(Parcel.user_id))), recipient_id=recipient.id,
+                          weight=1, status='Pending'))
+    db.session.commit()
+
+
+@pytest.mark.parametrize('name', PROFILES)
+def test_view_matches_to_dict(seeded, name):
+    profile = PROFILES[name]
+    rows = db.session.scalars(profile.select()).unique().all()
+    assert rows
+    for row in rows:
+        assert profile.serialize(row) == row.to_dict(rules=profile.exclude), f"{name} #{row.id}"
@@ -0,0 +1,108 @@
+# /server/tests/test_spatial.py
+
+# The KD-tree and /parcels/nearby against a brute force haversine scan of every parcel, around ordinary places,
+# the antimeridian and both poles
+
+import importlib.util
+import os
+import random
+
+import pytest
+
+import spatial
+from config import db
+from models import Parcel
+from geo import haversine_km, unit_vector, chord_for_km, geohash_encode, GEOHASH_PRECISION
+from spatial import KDTree, OpenParcelIndex, find_nearby
+from conftest import SERVER_DIR, login
+
+CENTRES = [(-1.2921, 36.8219), (0.5, 179.95), (-0.5, -179.95), (89.95, 10.0), (-89.95, -120.0)]
+
+
+def _points(rng, count):
+    # Clustered around the centres, some right on the antimeridian and past the poles' last degree of latitude
+    points = []
+    for _ in range(count):
+        latitude, longitude = rng.choice(CENTRES)
+        latitude = max(-90.0, min(90.0, latitude + rng.gauss(0, 0.3)))
+        longitude = (longitude + rng.gauss(0, 0.3) + 180) % 360 - 180
+        points.append((latitude, longitude))
+    return points
+
+
+def _brute_within(points, latitude, longitude, radius):
+    return sorted((haversine_km(latitude, longitude, *point), id) for id, point in points.items()
+                  if haversine_km(latitude, longitude, *point) <= radius)
+
+
+def test_kdtree_matches_a_brute_force_scan():
+    rng = random.Random(7)
+    points = dict(enumerate(_points(rng, 3000), start=1))
+    tree = KDTree((id, unit_vector(*point)) for id, point in points.items())
+    for latitude, longitude in CENTRES:
+        vector = unit_vector(latitude, longitude)
+        for radius in (1, 25, 80):
+            chord = chord_for_km(radius) * 1.000001
+            expected = {id for id, point in points.items()
+                        if sum((a - b) ** 2 for a, b in zip(unit_vector(*point), vector)) <= chord * chord}
+            assert set(tree.within(vector, chord)) == expected
+        for k in (1, 7, 50):
+            expected = sorted((sum((a - b) ** 2 for a, b in zip(unit_vector(*point), vector)), id)
+                              for id, point in points.items())[:k]
+            assert [id for _, id in tree.nearest(vector, k)] == [id for _, id in expected]
+
+
+def test_an_empty_kdtree_finds_nothing():
+    tree = KDTree(())
+    assert len(tree) == 0
+    assert tree.within(unit_vector(0, 0), 1.0) == []
+    assert tree.nearest(unit_vector(0, 0), 5) == []
+
+
+@pytest.fixture
+def parcels(database, monkeypatch):
+    # {parcel id: (latitude, longitude)} of open parcels, plus a few delivered ones only scope=all finds
+    monkeypatch.setattr(spatial, 'open_parcels', OpenParcelIndex())
+    rng = random.Random(11)
+    rows = [Parcel(length=1, width=1, height=1, weight=1, latitude=latitude, longitude=longitude,
+                   status='Delivered' if index % 10 == 0 else 'Pending')
+            for index, (latitude, longitude) in enumerate(_points(rng, 600))]
+    db.session.add_all(rows)
+    db.session.commit()
+    return ({row.id: (float(row.latitude), float(row.longitude)) for row in rows if row.status != 'Delivered'},
+            {row.id: (float(row.latitude), float(row.longitude)) for row in rows})
+
+
+@pytest.mark.parametrize('latitude, longitude', CENTRES)
+def test_nearby_matches_a_brute_force_scan(parcels, latitude, longitude):
+    open_points, all_points = parcels
+    args = {'lat': latitude, 'lng': longitude}
+    for radius in (5, 40):
+        expected = _brute_within(open_points, latitude, longitude, radius)
+        assert find_nearby(dict(args, radius=radius, limit=1000)) == expected
+        assert find_nearby(dict(args, radius=radius, limit=1000, scope='all')) == _brute_within(
+            all_points, latitude, longitude, radius)
+    for k in (1, 10, 100):
+        assert find_nearby(dict(args, k=k)) == _brute_within(open_points, latitude, longitude, 1e9)[:k]
+        assert find_nearby(dict(args, k=k, radius=20)) == _brute_within(open_points, latitude, longitude, 20)[:k]
+
+
+def test_nearby_without_parcels_is_empty(client, make_user, monkeypatch):
+    monkeypatch.setattr(spatial, 'open_parcels', OpenParcelIndex())
+    login(client, make_user('admin@example.com', admin=True))
+    for query in ('radius=50', 'k=5', 'radius=50&scope=all'):
+        response = client.get(f'/parcels/nearby?lat=89.99&lng=179.99&{query}')
+        assert response.status_code == 200
+        assert response.get_json() == []
+
+
+def test_the_migration_backfills_with_the_same_geohashes():
+    path = os.path.join(SERVER_DIR, 'migrations', 'versions', 'a8c1e5f7b302_adds_parcel_geohash.py')
+    spec = importlib.util.spec_from_file_location('adds_parcel_geohash', path)
+    migration = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(migration)
+    rng = random.Random(3)
+    points = _points(rng, 500) + [(90, 180), (-90, -180), (0, 0), (-1.2921, 36.8219)]
+    assert migration.GEOHASH_PRECISION == GEOHASH_PRECISION
+    for latitude, longitude in points:
+        assert migration.geohash_encode(latitude, longitude) == geohash_encode(latitude, longitude, GEOHASH_PRECISION)
@@ -0,0 +1,34 @@
+# /server/tests/test_tracking.py
+
+from config import db
+from models import Parcel
+from tracking import lookup_tracking
+from conftest import login
+
+
+def test_a_changed_tracking_number_stops_resolving(client, make_user):
+    user_id = make_user('jane@example.com')
+    parcel = Parcel(user_id=user_id, length=1, width=1, height=1, weight=1, status='Pending', tracking_number='old')
+    db.session.add(parcel)
+    db.session.commit()
+    assert client.get('/track/old').status_code == 200 # Now cached
+
+    login(client, user_id)
+    assert client.patch(f'/parcels/{parcel.id}', json={'tracking_number': 'new'}).status_code == 200
+    assert client.get('/track/old').status_code == 404
+    assert client.get('/track/new').get_json()['status'] == 'Pending'
+
+
+def test_changes_outside_the_endpoints_invalidate_too(database):
+    parcel = Parcel(length=1, width=1, height=1, weight=1, status='Pending', tracking_number='abc')
+    db.session.add(parcel)
+    db.session.commit()
+    assert lookup_tracking('abc')[0]['status'] == 'Pending'
+
+    parcel.status = 'Accepted'
+    db.session.commit()
+    assert lookup_tracking('abc')[0]['status'] == 'Accepted'
+
+    db.session.delete(parcel)
+    db.session.commit()
+    assert lookup_tracking('abc') is None
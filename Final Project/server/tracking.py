@@ -0,0 +1,90 @@
+# /server/tracking.py
+
+# Public parcel tracking by tracking number.
+# Only status, timestamps and a coarse location are exposed, read with a column projected query (no Parcel
+# entity, user or recipient is ever loaded) and kept in a TTL/LRU cache. Every commit that changes or deletes a
+# parcel through the ORM drops its cache entries, under the old tracking number as well when that changed.
+
+import hashlib
+from itertools import chain
+
+from sqlalchemy import select, event, inspect
+from sqlalchemy.orm import Session
+
+from config import app, db
+from models import Parcel
+from cache import TTLCache
+from serializers import dumps, DATETIME_FORMAT
+
+_tracking = TTLCache(maxsize=app.config['TRACKING_CACHE_SIZE'], ttl=app.config['TRACKING_CACHE_TTL'])
+
+COARSE_DECIMALS = 1 # Roughly 11km, enough to show progress on a map without pinpointing an address
+
+
+def _coarse(value):
+    return round(float(value), COARSE_DECIMALS) if value is not None else None
+
+
+def _timestamp(value):
+    return value.strftime(DATETIME_FORMAT) if value is not None else None
+
+
+def lookup_tracking(tracking_number):
+    # Returns (payload, etag) or None when there's no such parcel
+    entry = _tracking.get(tracking_number)
+    if entry is not None:
+        return entry
+
+    stmt = select(
+        Parcel.status, Parcel.created_at, Parcel.updated_at,
+        Parcel.city, Parcel.state, Parcel.country, Parcel.latitude, Parcel.longitude
+    ).where(Parcel.tracking_number == tracking_number)
+    row = db.session.execute(stmt).first()
+    if row is None:
+        return None
+
+    payload = {
+        "tracking_number": tracking_number,
+        "status": row.status,
+        "created_at": _timestamp(row.created_at),
+        "updated_at": _timestamp(row.updated_at),
+        "location": {
+            "city": row.city,
+            "state": row.state,
+            "country": row.country,
+            "latitude": _coarse(row.latitude),
+            "longitude": _coarse(row.longitude),
+        },
+    }
+    etag = hashlib.sha1(dumps(payload, pretty=False)).hexdigest()[:20]
+    entry = (payload, etag)
+    _tracking.set(tracking_number, entry)
+    return entry
+
+
+def invalidate_tracking(tracking_number):
+    if tracking_number:
+        _tracking.pop(tracking_number)
+
+
+@event.listens_for(Session, 'after_flush')
+def collect_changed_tracking(session, flush_context):
+    # The attribute history still holds the values from before the flush here. load_history also reads the
+    # tracking number of a parcel that was expired by the last commit and never loaded again
+    numbers = session.info.setdefault('changed_tracking_numbers', set())
+    for obj in chain(session.dirty, session.deleted):
+        if isinstance(obj, Parcel):
+            history = inspect(obj).attrs.tracking_number.load_history()
+            numbers.update(number for number in chain(history.deleted, history.unchanged, history.added) if number)
+
+
+@event.listens_for(Session, 'after_commit')
+def invalidate_changed_tracking(session):
+    # Not before the commit, a lookup in between would cache the old row again
+    for number in session.info.pop('changed_tracking_numbers', ()):
+        invalidate_tracking(number)
+
+
+@event.listens_for(Session, 'after_rollback')
+def forget_changed_tracking(session):
+    session.info.pop('changed_tracking_numbers', None)